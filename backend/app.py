@@ -1,7 +1,6 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import os
 
@@ -14,9 +13,28 @@ from models.usage import Usage
 from models.discounts import Discount
 from models.audit_logs import AuditLog
 from models.alerts import Alert
+from models.metrics import DailyPlanMetric, DailyUsageMetric
+from models.search_index import UserSearchDocument, UserSearchToken
+from services import metrics_rollup, user_search
+from services.alert_dispatcher import dispatcher
+from services.audit_writer import audit_writer
+from services.auth import auth
+from services.cache import cache
+from services.credentials import credentials
+from services.profiler import profiler
+from services.telemetry import telemetry
+from services.db_pool import pool_monitor
+from services.db_routing import replica_router, STICKY_HEADER
+from services.usage_archive import usage_archive
+from services.recommendations import recommender
+from services.billing import billing
+from services.lifecycle import lifecycle
+from services.quota import quota_monitor
+import migrations
 
 from routes.admin_routes import admin_bp
 from routes.user_routes import user_bp
+from commands import register_commands
 
 def create_app():
     app = Flask(__name__)
@@ -24,16 +42,43 @@ def create_app():
     
     # Initialize extensions
     db.init_app(app)
-    CORS(app, origins=['http://localhost:3000', 'http://127.0.0.1:3000', 'http://localhost:5173', 'http://127.0.0.1:5173'], supports_credentials=True)
+    pool_monitor.init_app(app)
+    replica_router.init_app(app)
+    dispatcher.init_app(app)
+    audit_writer.init_app(app)
+    cache.init_app(app)
+    credentials.init_app(app)
+    auth.init_app(app)
+    profiler.init_app(app)
+    telemetry.init_app(app)
+    usage_archive.init_app(app)
+    recommender.init_app(app)
+    billing.init_app(app)
+    lifecycle.init_app(app)
+    quota_monitor.init_app(app)
+    # The SPA reads the read-your-writes deadline from writes and echoes it back
+    CORS(app, origins=['http://localhost:3000', 'http://127.0.0.1:3000', 'http://localhost:5173', 'http://127.0.0.1:5173'], supports_credentials=True,
+         expose_headers=[STICKY_HEADER])
     
     # Register blueprints
     app.register_blueprint(admin_bp, url_prefix='/admin')
     app.register_blueprint(user_bp, url_prefix='/user')
     
-    # Create tables and insert demo data
+    # Register CLI commands (flask --app app <command>)
+    register_commands(app)
+    
+    # Migrate the schema and insert demo data
     with app.app_context():
-        db.create_all()
-        create_demo_data()
+        if app.config['AUTO_MIGRATE']:
+            migrations.upgrade(log=print)
+        pending = migrations.pending()
+        if pending:
+            # Leave the data alone until `flask --app app migrate` has run
+            print(f"Schema migrations pending ({', '.join(pending)}); skipping startup data checks.")
+        else:
+            create_demo_data()
+            metrics_rollup.ensure_rollups()
+            user_search.ensure_index()
     
     return app
 
@@ -51,7 +96,7 @@ def create_demo_data():
         admin_user = User(
             name='Admin User',
             email='admin@example.com',
-            password_hash=generate_password_hash('admin123'),
+            password_hash=credentials.hash_password('admin123'),
             role='admin',
             created_at=datetime.now(),
             updated_at=datetime.now()
@@ -62,7 +107,7 @@ def create_demo_data():
         demo_user = User(
             name='Demo User',
             email='user@example.com',
-            password_hash=generate_password_hash('user123'),
+            password_hash=credentials.hash_password('user123'),
             role='user',
             created_at=datetime.now(),
             updated_at=datetime.now()
@@ -0,0 +1,73 @@
+# Admin write latency with synchronous vs batched alert writes
+# Usage: python bench_admin_writes.py [--requests 500]
+import argparse
+import statistics
+import threading
+import time
+
+from sqlalchemy import event
+
+from common import authorized_client, make_app
+
+
+def run(app, mode, requests):
+    from db import db
+    from models.alerts import Alert
+    from services.alert_dispatcher import dispatcher
+
+    dispatcher.mode = mode
+    client = authorized_client(app)
+    with app.app_context():
+        engine = db.engine
+        alerts_before = Alert.query.count()
+
+    # Commits made by the request thread, not the background writer
+    request_thread = threading.current_thread()
+    commits = []
+
+    def on_commit(connection):
+        if threading.current_thread() is request_thread:
+            commits.append(connection)
+
+    event.listen(engine, 'commit', on_commit)
+    latencies = []
+    for i in range(requests):
+        started = time.perf_counter()
+        response = client.post('/admin/plans', json={
+            'name': f'Bench {mode} {i}',
+            'monthly_price': 10,
+            'monthly_quota_gb': 10
+        })
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.get_json()
+    dispatcher.flush()
+    event.remove(engine, 'commit', on_commit)
+
+    with app.app_context():
+        written = Alert.query.count() - alerts_before
+    latencies.sort()
+    print(f'{mode:<5}: p50 {statistics.median(latencies) * 1000:.2f} ms, '
+          f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f} ms, '
+          f'{len(commits) / requests:.1f} commits/request on the request path, '
+          f'{written} alerts written')
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    app = make_app()
+    for mode in ('sync', 'async'):
+        written = run(app, mode, args.requests)
+        assert written == args.requests, f'{mode}: expected {args.requests} alerts, got {written}'
+
+    from services.alert_dispatcher import dispatcher
+    stats = dispatcher.stats()
+    print(f"async batches: {stats['batches']} (last {stats['last_batch_size']} alerts), "
+          f"max lag {stats['max_lag_seconds'] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
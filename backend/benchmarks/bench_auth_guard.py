@@ -0,0 +1,60 @@
+# Cost of the bearer-token guard on the admin and user blueprints
+# Times authenticate() for a token seen for the first time (signature check)
+# and for a cached one, then counts the SQL statements a guarded request issues
+# (GET /admin/auth/stats reads no table, so any statement would be the guard's).
+# Usage: python bench_auth_guard.py [--iterations 100000] [--requests 500]
+import argparse
+import time
+
+from common import authorized_client, bench_token, make_app, QueryCounter
+
+
+def per_call_us(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from services.auth import auth
+
+    token = bench_token(app)
+    baseline = per_call_us(lambda: None, args.iterations)
+
+    def verify_uncached():
+        auth._verified.clear()
+        auth.authenticate(token)
+
+    uncached = per_call_us(verify_uncached, args.iterations // 10) - baseline
+    cached = per_call_us(lambda: auth.authenticate(token), args.iterations) - baseline
+    print(f'authenticate, signature check: {uncached:.2f} us')
+    print(f'authenticate, cached token:    {cached:.2f} us')
+
+    client = authorized_client(app)
+    client.get('/admin/auth/stats')  # first guarded request loads the revocation list
+    with app.app_context():
+        engine = db.engine
+    with QueryCounter(engine) as counter:
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            response = client.get('/admin/auth/stats')
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - started
+    print(f'GET /admin/auth/stats: {elapsed / args.requests * 1000:.2f} ms per request, '
+          f'{counter.count} SQL statements in {args.requests} requests')
+
+    anonymous = app.test_client()
+    assert anonymous.get('/admin/auth/stats').status_code == 401
+    print(f"cache hit ratio {auth.stats()['hit_ratio']}, rejections {auth.stats()['rejected']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# Billing run throughput, resume and idempotency
+# Seeds users with subscriptions plus an automatic plan discount, then bills
+# today's periods in two calls: the first stops after half the chunks (as if
+# the run had crashed), the second resumes the rest. Checks that every due
+# subscription got exactly one invoice, that running again bills nothing, and
+# times GET /user/billing (SQL statements per request).
+# Usage: python bench_billing_run.py [--users 20000] [--subscriptions 3] [--chunk-size 1000] [--workers 4]
+import argparse
+import time
+from datetime import date, datetime
+
+from common import QueryCounter, authorized_client, make_app, seed_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--subscriptions', type=int, default=3, help='Subscriptions per user')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from models.billing import invoices
+    from models.discounts import Discount
+    from models.plans import Plan
+    from models.subscriptions import Subscription
+    from services.billing import billing
+    from sqlalchemy import func, select
+
+    today = date.today()
+    with app.app_context():
+        seed_dataset(db, users=args.users, subscriptions_per_user=args.subscriptions, usage_days=0)
+        plan_id = db.session.execute(select(func.max(Plan.id))).scalar()
+        db.session.add(Discount(code='BENCH-AUTO', plan_id=plan_id, discount_type='percentage', discount_value=10,
+                                is_active=True, created_at=datetime.now(), updated_at=datetime.now()))
+        db.session.commit()
+        due = db.session.execute(
+            select(func.count()).select_from(Subscription)
+            .where(Subscription.status == 'active', Subscription.start_date <= today)
+        ).scalar()
+        chunks = -(-due // args.chunk_size)
+
+        first = billing.run(run_date=today, chunk_size=args.chunk_size, workers=args.workers,
+                            max_chunks=max(1, chunks // 2))
+        print(f"first call (stopped early): {first['invoices']} invoices in {first['seconds']}s "
+              f"({first['invoices_per_sec']} invoices/sec), {first['open_chunks']} chunks left")
+        second = billing.run(run_date=today, workers=args.workers)
+        print(f"resumed: {second['invoices']} invoices in {second['seconds']}s "
+              f"({second['invoices_per_sec']} invoices/sec), {second['open_chunks']} chunks left")
+        again = billing.run(run_date=today, workers=args.workers)
+
+        written = db.session.execute(select(func.count()).select_from(invoices)).scalar()
+        distinct = db.session.execute(
+            select(func.count()).select_from(select(invoices.c.subscription_id).distinct().subquery())
+        ).scalar()
+        discounted = db.session.execute(
+            select(func.count()).select_from(invoices).where(invoices.c.discount_code == 'BENCH-AUTO')
+        ).scalar()
+        print(f'{due} due subscriptions, {written} invoices ({discounted} discounted), '
+              f"re-run added {again['invoices']}")
+        assert written == due == distinct == first['invoices'] + second['invoices'], 'missing or duplicate invoices'
+        assert again['invoices'] == 0 and second['open_chunks'] == 0
+        engine = db.engine
+
+    client = authorized_client(app, 'user')
+    client.get('/user/billing')
+    with QueryCounter(engine) as counter:
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            response = client.get('/user/billing')
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - started
+    print(f'GET /user/billing: {elapsed / args.requests * 1000:.2f} ms per request, '
+          f'{counter.count / args.requests:.1f} SQL statements per request')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Concurrent redemption of one discount code
+# Hundreds of clients start together and redeem the same code through
+# POST /user/discounts/redeem until it runs out, first with the single
+# used_count row, then with the count split over counter shards. Checks that
+# exactly usage_limit redemptions succeed, that every other attempt gets 409,
+# and that used_count (after folding the shards) and the rollup agree.
+# Shards pay off on databases with row locks: SQLite locks the whole file for
+# every write, so there the sharded run only shows the extra statements.
+# Usage: python bench_discount_redemption.py [--clients 300] [--limit 1000] [--attempts 5] [--shards 8]
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+
+from common import authorized_client, make_app
+
+
+def run(app, code, clients, attempts):
+    barrier = threading.Barrier(clients)
+    statuses, errors = {}, []
+    lock = threading.Lock()
+    client_pool = [authorized_client(app, 'user') for _ in range(clients)]
+
+    def redeem(client):
+        barrier.wait()
+        for _ in range(attempts):
+            response = client.post('/user/discounts/redeem', json={'code': code, 'amount': 100})
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code not in (200, 409):
+                    errors.append(response.get_json())
+
+    threads = [threading.Thread(target=redeem, args=(client,)) for client in client_pool]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, statuses, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--attempts', type=int, default=5, help='Redemptions each client tries')
+    parser.add_argument('--shards', type=int, default=8)
+    args = parser.parse_args()
+
+    # The clients outnumber the pool: let them queue for a connection instead of timing out
+    os.environ.setdefault('DB_POOL_TIMEOUT', '120')
+    app = make_app()
+    from db import db
+    from models.discounts import Discount
+    from services import metrics_rollup, redemption
+
+    print(f'{args.clients} clients x {args.attempts} attempts against a limit of {args.limit}')
+    for shards in (0, args.shards):
+        code = f'BENCH{shards}'
+        with app.app_context():
+            discount = Discount(code=code, discount_type='percentage', discount_value=10, usage_limit=args.limit,
+                                is_active=True, created_at=datetime.now(), updated_at=datetime.now())
+            db.session.add(discount)
+            db.session.commit()
+            discount_id = discount.id
+            if shards:
+                redemption.set_shards(discount_id, shards)
+            used_before = metrics_rollup.discount_totals().used_discounts or 0
+
+        elapsed, statuses, errors = run(app, code, args.clients, args.attempts)
+
+        with app.app_context():
+            folded = sum(redemption.fold_counters().values())
+            used_count = db.session.get(Discount, discount_id).used_count
+            rolled_up = (metrics_rollup.discount_totals().used_discounts or 0) - used_before
+        redeemed = statuses.get(200, 0)
+        label = f'{shards} shards' if shards else 'single row'
+        print(f'{label:>10}: {redeemed / elapsed:8.1f} redemptions/sec, {redeemed} redeemed, '
+              f'{statuses.get(409, 0)} refused (exhausted), used_count {used_count} ({folded} folded), '
+              f'rollup +{rolled_up}')
+        assert not errors, errors[:3]
+        assert redeemed == min(args.limit, args.clients * args.attempts), 'wrong number of redemptions'
+        assert used_count == redeemed and rolled_up == redeemed, 'counters disagree'
+    print('no over-redemption')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# Query plans and latency of the hot read paths before and after 0002_hot_path_indexes
+# Seeds a dataset, drops the indexes 0002 adds, prints EXPLAIN output and timings,
+# then re-applies the migration and prints them again.
+# Usage: python bench_indexes.py [--users 5000] [--requests 50]
+import argparse
+import importlib
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import authorized_client, make_app, seed_dataset
+
+
+def seed_extras(db, alerts_per_user=5, discounts=2000, seed=7):
+    """Alerts and discounts, which seed_dataset leaves out."""
+    from models.alerts import Alert
+    from models.discounts import Discount
+    from models.plans import Plan
+    from models.users import User
+
+    rnd = random.Random(seed)
+    now = datetime.now()
+    user_ids = [row[0] for row in db.session.query(User.id)]
+    plan_ids = [row[0] for row in db.session.query(Plan.id)]
+    alerts = [{
+        'user_id': user_id,
+        'type': rnd.choice(['info', 'warning', 'error']),
+        'title': 'Bench alert',
+        'message': 'Seeded by bench_indexes.py',
+        'is_read': rnd.random() < 0.9,
+        'created_at': now - timedelta(minutes=rnd.randint(0, 60 * 24 * 90))
+    } for user_id in user_ids for _ in range(alerts_per_user)]
+    db.session.execute(Alert.__table__.insert(), alerts)
+    db.session.execute(Discount.__table__.insert(), [{
+        'plan_id': rnd.choice(plan_ids),
+        'code': f'BENCH{i:06d}',
+        'discount_type': 'percentage',
+        'discount_value': rnd.choice([5, 10, 20]),
+        'used_count': 0,
+        'is_active': True,
+        'created_at': now - timedelta(days=rnd.randint(0, 365)),
+        'updated_at': now
+    } for i in range(discounts)])
+    db.session.commit()
+
+
+def statements(sample_user, sample_day):
+    from sqlalchemy import func, select
+    from models.alerts import Alert
+    from models.discounts import Discount
+    from models.subscriptions import Subscription
+    from models.usage import Usage
+
+    return [
+        ('unread alerts', select(func.count()).select_from(Alert).where(Alert.is_read.is_(False))),
+        ('alerts of a user', select(Alert.id).where(Alert.user_id == sample_user)),
+        ('subscriptions of a user', select(Subscription).where(Subscription.user_id == sample_user)
+         .order_by(Subscription.created_at.desc())),
+        ('active subscriptions', select(func.count()).select_from(Subscription)
+         .where(Subscription.status == 'active')),
+        ('discount by code', select(Discount).where(Discount.code == 'BENCH001234')),
+        ('usage by user/date', select(Usage).where(Usage.user_id == sample_user, Usage.date == sample_day)),
+        ('usage of a day', select(func.sum(Usage.data_used_gb)).where(Usage.date == sample_day)),
+    ]
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    return [' | '.join(str(value) for value in row)
+            for row in connection.exec_driver_sql(prefix + str(compiled), params)]
+
+
+def report(client, engine, label, requests, sample_user, sample_day):
+    print(f'\n=== {label} ===')
+    with engine.connect() as connection:
+        for name, statement in statements(sample_user, sample_day):
+            started = time.perf_counter()
+            for _ in range(requests):
+                connection.execute(statement).all()
+            elapsed = (time.perf_counter() - started) / requests * 1000
+            # After running the query: SQLite's EXPLAIN does not notice a schema
+            # change made on another connection until a real statement has run
+            plan = explain(connection, statement)
+            print(f'{name:<24} {elapsed:8.3f} ms')
+            for line in plan:
+                print(f'    {line}')
+    for path in ('/admin/dashboard', '/admin/users/detailed?per_page=50',
+                 '/admin/alerts?per_page=50', '/admin/subscriptions?per_page=50'):
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(path)
+            assert response.status_code == 200, response.get_json()
+        elapsed = (time.perf_counter() - started) / requests * 1000
+        print(f'GET {path:<36} {elapsed:8.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    import migrations
+    from migrations import ops, schema_migrations
+    from services import metrics_rollup
+
+    index_migration = importlib.import_module('migrations.versions.0002_hot_path_indexes')
+
+    with app.app_context():
+        seed_dataset(db, users=args.users, subscriptions_per_user=2, usage_days=30)
+        seed_extras(db)
+        metrics_rollup.rebuild_rollups()
+        engine = db.engine
+        sample_user = args.users // 2
+        sample_day = datetime.now().date() - timedelta(days=3)
+
+        with engine.begin() as connection:
+            dropped = [name for name, table, _ in index_migration.INDEXES
+                       if ops.drop_index(connection, name, table)]
+            for name, table in (('uq_usage_user_date', 'usage'), ('uq_discounts_code', 'discounts')):
+                # Unique constraints declared inline (create_all on SQLite) cannot be dropped
+                if ops.drop_index(connection, name, table):
+                    dropped.append(name)
+            connection.execute(schema_migrations.delete().where(schema_migrations.c.version == '0002'))
+        print(f"Dropped: {', '.join(dropped)}")
+
+        client = authorized_client(app)
+        report(client, engine, 'without 0002 indexes', args.requests, sample_user, sample_day)
+        started = time.perf_counter()
+        migrations.upgrade(log=print)
+        print(f'Migration took {(time.perf_counter() - started) * 1000:.0f} ms')
+        report(client, engine, 'with 0002 indexes', args.requests, sample_user, sample_day)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Subscription lifecycle sweep
+# Seeds users with subscriptions, gives a share of the active ones an end date
+# in the past (half of them set to auto-renew) and schedules pauses and
+# resumptions for a few more, then times one sweep (rows changed per second,
+# batches). Checks that nothing is left to do, that a second sweep changes
+# nothing, and that the rollup's active count (dashboard) matches the table.
+# Usage: python bench_lifecycle_sweep.py [--users 50000] [--subscriptions 2] [--lapsed 0.3] [--batch-size 1000]
+import argparse
+from datetime import date, timedelta
+
+from common import make_app, seed_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--subscriptions', type=int, default=2, help='Subscriptions per user')
+    parser.add_argument('--lapsed', type=float, default=0.3, help='Share of subscriptions whose end date has passed')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from models.subscriptions import Subscription
+    from services import metrics_rollup
+    from services.lifecycle import lifecycle
+    from sqlalchemy import func, select
+
+    subscriptions = Subscription.__table__
+    today = date.today()
+    with app.app_context():
+        seed_dataset(db, users=args.users, subscriptions_per_user=args.subscriptions, usage_days=0)
+        # Spread the schedules over the ids: every n-th subscription lapsed, a few paused
+        step = max(1, round(1 / args.lapsed))
+        db.session.execute(subscriptions.update().where(subscriptions.c.id % step == 0)
+                           .values(end_date=today - timedelta(days=3)))
+        db.session.execute(subscriptions.update().where(subscriptions.c.id % (step * 2) == 0)
+                           .values(auto_renew=True))
+        db.session.execute(subscriptions.update().where(subscriptions.c.id % 50 == 1)
+                           .values(pause_start=today - timedelta(days=1), pause_end=today + timedelta(days=30)))
+        db.session.execute(subscriptions.update().where(subscriptions.c.id % 50 == 2)
+                           .values(pause_start=today - timedelta(days=30), pause_end=today))
+        metrics_rollup.rebuild_rollups()
+        before = metrics_rollup.dashboard_totals(today.replace(day=1))['active_subscriptions']
+
+        report = lifecycle.sweep(today=today, batch_size=args.batch_size)
+        changed = sum(report[rule] for rule in ('expired', 'renewed', 'paused', 'resumed'))
+        print(f"sweep: {report['expired']} expired, {report['renewed']} renewed, {report['paused']} paused, "
+              f"{report['resumed']} resumed in {report['batches']} batches, {report['seconds']}s "
+              f"({report['rows_per_sec']} rows/sec)")
+        assert not report['error'], report['error']
+
+        lapsed = db.session.execute(
+            select(func.count()).select_from(subscriptions)
+            .where(subscriptions.c.status.in_(('active', 'paused')), subscriptions.c.end_date < today,
+                   subscriptions.c.auto_renew.is_(False))
+        ).scalar()
+        again = lifecycle.sweep(today=today, batch_size=args.batch_size)
+        active = db.session.execute(
+            select(func.count()).select_from(subscriptions).where(subscriptions.c.status == 'active')
+        ).scalar()
+        rolled_up = metrics_rollup.dashboard_totals(today.replace(day=1))['active_subscriptions']
+        print(f'{changed} subscriptions changed, active {before} -> {rolled_up} (table: {active}), '
+              f"second sweep changed {sum(again[rule] for rule in ('expired', 'renewed', 'paused', 'resumed'))}")
+        assert lapsed == 0, 'lapsed subscriptions left active'
+        assert rolled_up == active, 'rollup active count disagrees with the table'
+        assert again['batches'] == 0, 'second sweep found work'
+        print(f"runs recorded: {len(lifecycle.runs())}")
+
+
+if __name__ == '__main__':
+    main()
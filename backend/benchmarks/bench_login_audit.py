@@ -0,0 +1,74 @@
+# Login latency while the database is under write contention
+# A background connection repeatedly holds the write lock, as a long audit or
+# reporting transaction would. With AUDIT_DISPATCH=sync every login waits for
+# its audit insert; with the background writer it does not.
+# Usage: python bench_login_audit.py [--logins 300] [--hold-ms 100]
+import argparse
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from common import make_app
+
+
+def contend(engine, hold, stop):
+    while not stop.is_set():
+        with engine.connect() as connection:
+            connection.exec_driver_sql('BEGIN IMMEDIATE' if engine.dialect.name == 'sqlite' else 'BEGIN')
+            connection.exec_driver_sql('UPDATE audit_logs SET user_agent = user_agent WHERE id < 0')
+            time.sleep(hold)
+            connection.exec_driver_sql('COMMIT')
+        time.sleep(hold / 4)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=300)
+    parser.add_argument('--hold-ms', type=int, default=100)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from models.users import User
+    from services.audit_writer import audit_writer
+
+    with app.app_context():
+        # Cheap hash so the benchmark measures the request path, not PBKDF2
+        db.session.add(User(name='Bench Login', email='bench-login@example.com', role='user',
+                            password_hash=generate_password_hash('secret', method='pbkdf2:sha256:1000')))
+        db.session.commit()
+        engine = db.engine
+
+    client = app.test_client()
+    for mode in ('sync', 'async'):
+        audit_writer.mode = mode
+        stop = threading.Event()
+        contender = threading.Thread(target=contend, args=(engine, args.hold_ms / 1000, stop), daemon=True)
+        contender.start()
+
+        latencies = []
+        for _ in range(args.logins):
+            started = time.perf_counter()
+            response = client.post('/user/login', json={'email': 'bench-login@example.com', 'password': 'secret'})
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.get_json()
+
+        stop.set()
+        contender.join()
+        audit_writer.flush()
+        print(f'{mode:<5}: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, '
+              f'p99 {percentile(latencies, 0.99) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms')
+
+    stats = audit_writer.stats()
+    print(f"audit writer: {stats['written']} written, {stats['spilled']} spilled, "
+          f"max lag {stats['max_lag_seconds'] * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
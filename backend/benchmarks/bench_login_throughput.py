@@ -0,0 +1,91 @@
+# Login throughput with password checks inline vs in the hashing process pool
+# Concurrent clients log in for a fixed time against each worker count
+# (0 = check on the request thread). Also measures a cheap request (GET
+# /admin/plans, cached) issued while the logins run, to show how much the
+# hashes slow the rest of the process down. Throughput stops growing at the
+# number of CPU cores.
+# Usage: python bench_login_throughput.py [--clients 8] [--seconds 5] [--workers 0,1,2,4] [--method scrypt]
+import argparse
+import os
+import threading
+import time
+
+from common import authorized_client, make_app
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def run(app, clients, seconds):
+    stop = threading.Event()
+    logins, statuses, probes = [], {}, []
+    lock = threading.Lock()
+
+    def login():
+        client = app.test_client()
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = client.post('/user/login', json={'email': 'bench-login@example.com', 'password': 'secret'})
+            with lock:
+                logins.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    def probe():
+        client = authorized_client(app)
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get('/admin/plans')
+            probes.append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=login) for _ in range(clients)] + [threading.Thread(target=probe)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, logins, statuses, probes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', default=None, help='Comma-separated worker counts (default: 0,1,2,... up to the CPU count)')
+    parser.add_argument('--method', default='scrypt')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    worker_counts = ([int(value) for value in args.workers.split(',')] if args.workers
+                     else [0] + [count for count in (1, 2, 4, 8, 16) if count <= cpus])
+
+    app = make_app()
+    from db import db
+    from models.users import User
+    from services.credentials import credentials
+
+    credentials.configure(method=args.method, workers=0)
+    with app.app_context():
+        db.session.add(User(name='Bench Login', email='bench-login@example.com', role='user',
+                            password_hash=credentials.hash_password('secret')))
+        db.session.commit()
+
+    print(f'{cpus} CPU(s), method {args.method}, {args.clients} clients, {args.seconds:g}s per run')
+    for workers in worker_counts:
+        credentials.configure(workers=workers, max_pending=args.clients)
+        credentials.hash_password('warm-up')  # start the pool processes outside the timing
+        elapsed, logins, statuses, probes = run(app, args.clients, args.seconds)
+        refused = sum(count for status, count in statuses.items() if status == 503)
+        print(f'workers {workers:>2}: {statuses.get(200, 0) / elapsed:7.1f} logins/sec, '
+              f'p50 {percentile(logins, 0.5) * 1000:7.1f} ms, p99 {percentile(logins, 0.99) * 1000:7.1f} ms, '
+              f'{refused} refused | plans p50 {percentile(probes, 0.5) * 1000:6.1f} ms, '
+              f'p99 {percentile(probes, 0.99) * 1000:6.1f} ms')
+    credentials.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Per-request cost of the /metrics instrumentation
+# Times the registry updates a request makes (in-progress gauge, latency
+# histogram, request counter) on their own and through the request hooks,
+# then renders /metrics once for a few hundred label sets.
+# Usage: python bench_metrics_overhead.py [--iterations 200000]
+import argparse
+import time
+
+from common import make_app
+
+
+def per_call_us(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    app = make_app()
+    from flask import Response
+    from services import telemetry as telemetry_module
+    from services.telemetry import telemetry, registry
+
+    def registry_updates():
+        telemetry_module._in_progress.inc()
+        telemetry_module._in_progress.dec()
+        telemetry_module.request_duration.labels('GET', '/admin/plans').observe(0.0042)
+        telemetry_module.requests_total.labels('GET', '/admin/plans', '200').inc()
+
+    baseline = per_call_us(lambda: None, args.iterations)
+    updates = per_call_us(registry_updates, args.iterations) - baseline
+    print(f'registry updates per request: {updates:.2f} us')
+
+    response = Response('ok')
+    with app.test_request_context('/admin/plans'):
+        from flask import request
+        request.url_rule = app.url_map.bind('localhost').match('/admin/plans', return_rule=True)[0]
+
+        def hooks():
+            telemetry._start()
+            telemetry._finish(response)
+
+        hooks_us = per_call_us(hooks, args.iterations) - baseline
+    print(f'before/after_request hooks per request: {hooks_us:.2f} us')
+
+    for i in range(300):
+        telemetry_module.request_duration.labels('GET', f'/bench/{i}').observe(0.01)
+        telemetry_module.requests_total.labels('GET', f'/bench/{i}', '200').inc()
+    with app.app_context():
+        started = time.perf_counter()
+        text = registry.render()
+        elapsed = (time.perf_counter() - started) * 1000
+    print(f'/metrics render: {elapsed:.1f} ms for {len(text.splitlines())} lines')
+
+
+if __name__ == '__main__':
+    main()
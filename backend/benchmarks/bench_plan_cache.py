@@ -0,0 +1,52 @@
+# Plan catalogue / discount lookups with and without the read-through cache
+# Usage: python bench_plan_cache.py [--requests 2000]
+import argparse
+import time
+
+from common import authorized_client, make_app, seed_dataset, QueryCounter
+
+
+def run(client, engine, path, requests):
+    with QueryCounter(engine) as counter:
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(path)
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - started
+    return elapsed / requests * 1000, counter.count / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from services import catalog
+    from services.cache import cache, MemoryBackend, NullBackend
+
+    with app.app_context():
+        seed_dataset(db, users=10, subscriptions_per_user=0, usage_days=0)
+        engine = db.engine
+
+    client = authorized_client(app)
+    for label, backend in (('no cache', NullBackend()), ('memory', MemoryBackend())):
+        cache.backend = backend
+        latency, queries = run(client, engine, '/admin/plans', args.requests)
+        print(f'GET /admin/plans  {label:<8}: {latency:.3f} ms/request, {queries:.2f} queries/request')
+
+        with app.app_context():
+            started = time.perf_counter()
+            for i in range(args.requests):
+                catalog.discount_by_code(f'CODE{i % 50}')
+            elapsed = time.perf_counter() - started
+        print(f'discount_by_code {label:<8}: {elapsed / args.requests * 1e6:.1f} us/lookup')
+
+    stats = cache.stats()['namespaces']
+    for namespace, counters in stats.items():
+        print(f"{namespace}: {counters['hits']} hits, {counters['misses']} misses")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Quota alerts over usage ingestion
+# Seeds users with one active subscription each, then ingests one day of
+# usage per batch for every user and times the quota tracking inside each
+# batch (rows/sec of the whole ingest, and the share spent on quota totals
+# and alerts). Daily usage is drawn so most users cross 50% and some 80% and
+# 100% during the run. Checks that every user has exactly one alert per
+# threshold reached, that re-ingesting a day raises nothing, and that the
+# stored totals match summing the usage table.
+# Usage: python bench_quota_alerts.py [--users 20000] [--days 20]
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from common import make_app, seed_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from models.alerts import Alert
+    from models.plans import Plan
+    from models.quota import quota_usage
+    from models.subscriptions import Subscription
+    from models.usage import Usage
+    from services import usage_ingest
+    from services.billing import billing_period
+    from services.quota import quota_monitor
+    from sqlalchemy import func, select
+
+    today = date.today()
+    start = today - timedelta(days=args.days - 1)
+    subscriptions = Subscription.__table__
+    with app.app_context():
+        seed_dataset(db, users=args.users, subscriptions_per_user=1, usage_days=0)
+        # Every period starts with the run, so the whole run is one quota period
+        db.session.execute(subscriptions.update().values(status='active', start_date=start, end_date=None))
+        db.session.commit()
+        plans = dict(db.session.execute(
+            select(subscriptions.c.user_id, Plan.monthly_quota_gb).join(Plan, Plan.id == subscriptions.c.plan_id)
+        ).all())
+        alerts_before = db.session.execute(select(func.count()).select_from(Alert)).scalar()
+
+        # Time the quota step on its own by wrapping it
+        apply_usage = quota_monitor.apply_usage
+        quota_seconds = [0.0]
+
+        def timed(connection, changes):
+            started = time.perf_counter()
+            try:
+                return apply_usage(connection, changes)
+            finally:
+                quota_seconds[0] += time.perf_counter() - started
+        quota_monitor.apply_usage = timed
+
+        rnd = random.Random(7)
+        # Each user's daily share of the quota; the total over the run spans 30%-130%
+        shares = {user_id: rnd.uniform(0.3, 1.3) / args.days for user_id in plans}
+        records = 0
+        started = time.perf_counter()
+        for day in range(args.days):
+            batch = [{'user_id': user_id, 'date': (start + timedelta(days=day)).isoformat(),
+                      'data_used_gb': round(quota * shares[user_id], 2)} for user_id, quota in plans.items()]
+            usage_ingest.ingest_batch(batch)
+            records += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f'ingested {records} records in {elapsed:.2f}s ({records / elapsed:,.0f} rows/sec), '
+              f'quota tracking {quota_seconds[0]:.2f}s ({quota_seconds[0] / elapsed:.0%})')
+
+        raised = db.session.execute(select(func.count()).select_from(Alert)).scalar() - alerts_before
+        usage_ingest.ingest_batch(batch)
+        again = db.session.execute(select(func.count()).select_from(Alert)).scalar() - alerts_before - raised
+        quota_monitor.apply_usage = apply_usage
+
+        period_start = billing_period(start, today, 1)[0]
+        stored = dict(db.session.execute(
+            select(quota_usage.c.user_id, quota_usage.c.used_cents).where(quota_usage.c.period_start == period_start)
+        ).all())
+        summed = {user_id: round(float(total) * 100) for user_id, total in db.session.execute(
+            select(Usage.user_id, func.sum(Usage.data_used_gb)).where(Usage.date >= period_start).group_by(Usage.user_id)
+        )}
+        expected = sum(sum(1 for pct in quota_monitor.thresholds if stored[user_id] >= plans[user_id] * pct)
+                       for user_id in plans)
+        per_user = db.session.execute(
+            select(func.count()).select_from(
+                select(Alert.user_id, Alert.message).group_by(Alert.user_id, Alert.message)
+                .having(func.count() > 1).subquery())
+        ).scalar()
+        print(f'{raised} alerts for {len(plans)} users (one per threshold reached: {expected}), '
+              f're-ingesting a day raised {again}')
+        assert stored == summed, 'stored totals disagree with the usage table'
+        assert raised == expected and again == 0 and per_user == 0, 'missing or repeated alerts'
+
+
+if __name__ == '__main__':
+    main()
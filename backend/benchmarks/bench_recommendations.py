@@ -0,0 +1,86 @@
+# Batch plan recommendations
+# Seeds users with daily usage, then times a full refresh (users scored per
+# second), an incremental refresh after re-ingesting a slice of the users'
+# usage, and reading one user's recommendations from the stored rows against
+# scoring them from raw usage rows (the per-request alternative), plus the SQL
+# statements per GET /user/recommendations.
+# Usage: python bench_recommendations.py [--users 20000] [--usage-days 90] [--changed 0.01] [--requests 500] (needs numpy)
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from common import QueryCounter, authorized_client, make_app, seed_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--usage-days', type=int, default=90)
+    parser.add_argument('--changed', type=float, default=0.01, help='Share of users whose usage is re-ingested')
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from models.users import User
+    from models.usage import Usage
+    from services import catalog, recommendations, usage_ingest
+    from services.recommendations import recommender
+    from sqlalchemy import func, select
+
+    if not recommendations.available():
+        raise SystemExit('needs numpy (pip install numpy)')
+
+    with app.app_context():
+        seed_dataset(db, users=args.users, subscriptions_per_user=1, usage_days=args.usage_days)
+        report = recommender.refresh(full=True)
+        print(f"full refresh: {report['users']} users x {report['plans']} plans in {report['seconds']}s "
+              f"({report['users_per_sec']} users/sec)")
+
+        user_ids = db.session.execute(select(User.id).where(User.role == 'user')).scalars().all()
+        changed = random.Random(1).sample(user_ids, max(1, int(len(user_ids) * args.changed)))
+        today = date.today()
+        usage_ingest.ingest_batch([{'user_id': user_id, 'date': (today - timedelta(days=day)).isoformat(),
+                                    'data_used_gb': 1.5} for user_id in changed for day in range(3)])
+        report = recommender.refresh()
+        print(f"incremental refresh: {report['users']} changed users in {report['seconds']}s "
+              f"({report['users_per_sec']} users/sec)")
+        assert report['users'] == len(changed) and not report['full']
+        engine = db.engine
+
+        def score_from_raw_usage(user_id):
+            # The per-request alternative: aggregate the window, then price every plan
+            total, _ = db.session.execute(
+                select(func.sum(Usage.data_used_gb), func.min(Usage.date))
+                .where(Usage.user_id == user_id, Usage.date >= today - timedelta(days=recommender.window_days - 1))
+            ).one()
+            plans = catalog.plan_catalog()
+            return sorted(plans, key=lambda plan: (plan['monthly_quota_gb'] < float(total or 0), plan['monthly_price']))
+
+        requests = min(args.requests, len(user_ids))
+        for label, lookup in (('stored rows', recommendations.for_user), ('raw usage', score_from_raw_usage)):
+            started = time.perf_counter()
+            for user_id in user_ids[:requests]:
+                lookup(user_id)
+            print(f'{label:>11}: {(time.perf_counter() - started) / requests * 1000:.3f} ms per user')
+
+    client = authorized_client(app, 'user')
+    client.get('/user/recommendations')  # loads the plan catalogue into the cache
+    with QueryCounter(engine) as counter:
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get('/user/recommendations')
+            assert response.status_code == 200, response.get_json()
+        elapsed = time.perf_counter() - started
+    print(f'GET /user/recommendations: {elapsed / requests * 1000:.2f} ms per request, '
+          f'{counter.count / requests:.1f} SQL statements per request')
+
+    with app.app_context():
+        sample = recommendations.for_user(changed[0])
+    print(f"user {changed[0]}: {sample['projected_monthly_gb']} GB/month projected, "
+          f"best plan {sample['recommendations'][0]['plan_name'] if sample['recommendations'] else None}")
+
+
+if __name__ == '__main__':
+    main()
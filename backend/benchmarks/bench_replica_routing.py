@@ -0,0 +1,104 @@
+# Report latency with reads on the primary vs the replica, under write load on the primary
+# Without REPLICA_DATABASE_URL the replica is simulated: the seeded SQLite
+# primary is copied to a second file once (so its lag just grows, and
+# REPLICA_MAX_LAG is raised for the run). Point DATABASE_URL and
+# REPLICA_DATABASE_URL at a real MySQL primary/replica pair to measure the
+# real thing.
+# Usage: python bench_replica_routing.py [--users 5000] [--requests 100] [--writers 2]
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SIMULATED = not os.environ.get('REPLICA_DATABASE_URL')
+if SIMULATED:
+    workdir = tempfile.mkdtemp(prefix='bench_replica_')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'primary.db')}")
+    os.environ['REPLICA_DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'replica.db')}"
+    os.environ['REPLICA_MAX_LAG'] = '3600'
+
+from common import authorized_client, make_app, seed_dataset
+
+PATHS = ['/admin/analytics/detailed', '/admin/dashboard', '/admin/users/detailed?per_page=50']
+
+
+def write_load(engine, stop, counter):
+    from models.alerts import Alert
+    while not stop.is_set():
+        with engine.begin() as connection:
+            connection.execute(Alert.__table__.insert(), [{
+                'user_id': None, 'type': 'info', 'title': 'load', 'message': 'bench write load',
+                'is_read': False, 'created_at': datetime.now()
+            } for _ in range(50)])
+        counter[0] += 1
+
+
+def measure(client, requests):
+    results = {}
+    for path in PATHS:
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = client.get(path)
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.get_json()
+        timings.sort()
+        results[path] = (timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99) - 1] * 1000)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--writers', type=int, default=2)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from services import metrics_rollup
+    from services.db_routing import replica_router
+
+    with app.app_context():
+        seed_dataset(db, users=args.users, subscriptions_per_user=2, usage_days=10)
+        metrics_rollup.rebuild_rollups()
+        replica_router.check_lag()
+        engine = db.engine
+        if SIMULATED:
+            engine.dispose()
+            db.engines['replica'].dispose()
+            shutil.copy(engine.url.database, db.engines['replica'].url.database)
+        replica_router.check_lag()
+
+    client = authorized_client(app)
+    stop = threading.Event()
+    counter = [0]
+    writers = [threading.Thread(target=write_load, args=(engine, stop, counter)) for _ in range(args.writers)]
+    for writer in writers:
+        writer.start()
+    try:
+        replica_router.enabled = False
+        on_primary = measure(client, args.requests)
+        replica_router.enabled = True
+        on_replica = measure(client, args.requests)
+    finally:
+        stop.set()
+        for writer in writers:
+            writer.join()
+
+    print(f'{args.writers} writers committed {counter[0]} batches of 50 alerts during the run')
+    for path in PATHS:
+        primary_p50, primary_p99 = on_primary[path]
+        replica_p50, replica_p99 = on_replica[path]
+        print(f'{path:<36} primary p50 {primary_p50:7.2f} ms p99 {primary_p99:7.2f} ms | '
+              f'replica p50 {replica_p50:7.2f} ms p99 {replica_p99:7.2f} ms')
+    print(f"routing: {replica_router.stats()['requests']}")
+    if SIMULATED:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
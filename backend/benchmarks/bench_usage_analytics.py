@@ -0,0 +1,74 @@
+# Compare the SQL aggregates behind /admin/analytics/detailed with the columnar snapshot
+# Times the existing usage-range and plan queries, then the snapshot build
+# (chunked reads into NumPy arrays) and the vectorized computation, which also
+# produces quantiles, quota utilisation and cohorts. Checks that both agree on
+# the histogram and per-plan counts. The default 100k users x 100 days is 10M
+# usage rows; seeding that into SQLite takes a few minutes.
+# Usage: python bench_usage_analytics.py [--users 100000] [--usage-days 100] [--repeat 3]
+import argparse
+import sys
+import time
+
+from common import make_app, seed_dataset, timer
+
+
+def best_of(repeat, run):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--usage-days', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from services import usage_analytics
+    if not usage_analytics.available():
+        print('❌ numpy is not installed (pip install numpy)')
+        sys.exit(1)
+
+    app = make_app()
+    from db import db
+    from services.analytics_engine import DetailedAnalyticsEngine
+
+    with app.app_context():
+        rows = args.users * args.usage_days
+        with timer(f'seed {rows:,} usage rows', rows):
+            seed_dataset(db, users=args.users, subscriptions_per_user=2, usage_days=args.usage_days)
+
+        engine = DetailedAnalyticsEngine()
+        sql_usage_ms, usage_stats = best_of(args.repeat, engine._usage_stats)
+        sql_plans_ms, plan_stats = best_of(args.repeat, engine._plan_stats)
+        build_ms, snapshot = best_of(args.repeat, usage_analytics.Snapshot)
+        compute_ms, result = best_of(args.repeat, lambda: usage_analytics.compute(snapshot))
+
+    print(f'SQL usage ranges   {sql_usage_ms:10.1f} ms')
+    print(f'SQL plan stats     {sql_plans_ms:10.1f} ms')
+    print(f'snapshot build     {build_ms:10.1f} ms ({rows / (build_ms / 1000):,.0f} rows/sec)')
+    print(f'vectorized compute {compute_ms:10.1f} ms (served from the cached snapshot)')
+    arrays = [value for value in vars(snapshot).values() if hasattr(value, 'nbytes')]
+    print(f'snapshot size      {sum(array.nbytes for array in arrays) / 2**20:10.1f} MB')
+
+    # Totals must match: same buckets, same subscription counts per plan
+    columnar_counts = [bucket['count'] for bucket in result['usage']['distribution']]
+    sql_counts = usage_stats['ranges']
+    if sql_counts != columnar_counts:
+        print(f'❌ Histograms differ: SQL {sql_counts} columnar {columnar_counts}')
+        sys.exit(1)
+    plans_sql = {row.name: row.subscription_count for row in plan_stats}
+    plans_columnar = {plan['plan_name']: plan['subscription_count'] for plan in result['plans']
+                      if plan['subscription_count']}
+    if plans_sql != plans_columnar:
+        print(f'❌ Plan counts differ: SQL {plans_sql} columnar {plans_columnar}')
+        sys.exit(1)
+    print('✅ Histogram and plan counts match')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# Bulk usage ingestion throughput (first load = inserts, second load = upserts)
+# Usage: python bench_usage_ingest.py [--users 20000] [--days 10] [--batch-size 10000]
+import argparse
+import json
+import random
+from datetime import date, timedelta
+
+from common import make_app, seed_dataset
+
+
+def ndjson_lines(users, days, first_user, seed):
+    rnd = random.Random(seed)
+    today = date.today()
+    for day in range(days):
+        day_str = (today - timedelta(days=day)).isoformat()
+        for user_id in range(first_user, first_user + users):
+            yield json.dumps({'user_id': user_id, 'date': day_str, 'data_used_gb': round(rnd.uniform(0, 150), 2)}) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from models.users import User
+    from services import usage_ingest
+
+    with app.app_context():
+        first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+        seed_dataset(db, users=args.users, subscriptions_per_user=0, usage_days=0, batch_size=20000)
+
+        for label, seed in (('insert', 1), ('upsert', 2)):
+            lines = list(ndjson_lines(args.users, args.days, first_user, seed))
+            result = usage_ingest.ingest(lines, fmt='ndjson', batch_size=args.batch_size)
+            totals = result['totals']
+            batch_rates = [report['rows_per_sec'] for report in result['batches']]
+            print(f"{label}: {totals['received']:,} rows in {totals['seconds']}s -> {totals['rows_per_sec']:,} rows/sec "
+                  f"(batches {min(batch_rates):,}-{max(batch_rates):,} rows/sec, "
+                  f"{totals['inserted']:,} inserted, {totals['updated']:,} updated)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Indexed user search vs the old leading-wildcard ILIKE path
+# Usage: python bench_user_search.py [--users 1000000]
+import argparse
+import statistics
+import time
+
+from common import make_app, seed_dataset, timer
+
+QUERIES = ['smith', 'grace t', 'bench12345', '@example', 'al', 'zzz']
+RUNS = 5
+
+
+def median_ms(run):
+    samples = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--per-page', type=int, default=10)
+    args = parser.parse_args()
+
+    app = make_app()
+    from db import db
+    from models.users import User
+    from sqlalchemy import or_
+    from services import user_search
+
+    with app.app_context():
+        with timer(f'seed {args.users:,} users', rows=args.users):
+            seed_dataset(db, users=args.users, subscriptions_per_user=0, usage_days=0, batch_size=20000)
+        with timer('build search index', rows=args.users):
+            user_search.rebuild_index(batch_size=20000)
+
+        def ilike_page(term):
+            query = User.query.filter(or_(User.name.ilike(f'%{term}%'), User.email.ilike(f'%{term}%')))
+            return query.order_by(User.id).paginate(page=1, per_page=args.per_page, error_out=False)
+
+        def index_page(term):
+            query = user_search.search_users(User.query, term)
+            return query.paginate(page=1, per_page=args.per_page, error_out=False)
+
+        print(f"\n{'query':<14}{'matches':>10}{'ilike ms':>12}{'index ms':>12}{'speedup':>10}")
+        for term in QUERIES:
+            matches = index_page(term).total
+            ilike_ms = median_ms(lambda: ilike_page(term))
+            index_ms = median_ms(lambda: index_page(term))
+            print(f'{term!r:<14}{matches:>10,}{ilike_ms:>12.1f}{index_ms:>12.1f}{ilike_ms / index_ms:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
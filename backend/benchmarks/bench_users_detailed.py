@@ -0,0 +1,35 @@
+# Query-count regression check for /admin/users/detailed
+# The endpoint must issue the same number of statements whatever the page size.
+import sys
+
+from common import authorized_client, make_app, seed_dataset, QueryCounter
+
+PAGE_SIZES = [10, 50, 100, 250]
+
+
+def main():
+    app = make_app()
+    from db import db
+
+    with app.app_context():
+        seed_dataset(db, users=500, subscriptions_per_user=3, usage_days=10)
+        engine = db.engine
+
+    client = authorized_client(app)
+    counts = {}
+    for per_page in PAGE_SIZES:
+        with QueryCounter(engine) as counter:
+            response = client.get(f'/admin/users/detailed?per_page={per_page}')
+        assert response.status_code == 200, response.get_json()
+        assert len(response.get_json()['users']) == per_page
+        counts[per_page] = counter.count
+        print(f'per_page={per_page:<4} queries={counter.count}')
+
+    if len(set(counts.values())) != 1:
+        print('❌ Query count grows with page size (N+1 regression)')
+        sys.exit(1)
+    print('✅ Constant query count across page sizes')
+
+
+if __name__ == '__main__':
+    main()
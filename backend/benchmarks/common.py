@@ -0,0 +1,163 @@
+# Shared helpers for the benchmark scripts
+# Each script runs against a throwaway SQLite database unless DATABASE_URL is set.
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def make_app():
+    if not os.environ.get('DATABASE_URL'):
+        workdir = tempfile.mkdtemp(prefix='bench_')
+        atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Scheduled sweeps would write (and run statements) in the middle of the timings
+    os.environ.setdefault('LIFECYCLE_SWEEP_INTERVAL', '0')
+    from app import create_app
+    return create_app()
+
+
+def bench_token(app, role='admin'):
+    """A bearer token for a benchmark user with `role` (created on first use)."""
+    from db import db
+    from models.users import User
+    from services.auth import auth
+    from werkzeug.security import generate_password_hash
+
+    email = f'bench-{role}@example.com'
+    with app.app_context():
+        user = User.query.filter_by(email=email).first()
+        if user is None:
+            # Cheap hash: nobody logs in with it, the token is issued directly
+            user = User(name=f'Bench {role.title()}', email=email, role=role,
+                        password_hash=generate_password_hash(email, method='pbkdf2:sha256:1000'))
+            db.session.add(user)
+            db.session.commit()
+        return auth.issue(user)['token']
+
+
+def authorized_client(app, role='admin'):
+    """A test client that sends a bearer token for a benchmark user with `role`."""
+    from services.auth import auth
+
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {bench_token(app, role)}'
+    # Load the revocation list now rather than in the first timed request
+    auth.ensure_sync()
+    return client
+
+
+class QueryCounter:
+    """Counts statements sent to the database while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def timer(label, rows=None):
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    rate = f' ({rows / elapsed:,.0f} rows/sec)' if rows else ''
+    print(f'{label}: {elapsed * 1000:.1f} ms{rate}')
+
+
+def seed_dataset(db, users=1000, subscriptions_per_user=2, usage_days=30, seed=42, batch_size=5000):
+    """Bulk-load plans, users, subscriptions and usage with Core inserts."""
+    from models.users import User
+    from models.plans import Plan
+    from models.subscriptions import Subscription
+    from models.usage import Usage
+
+    rnd = random.Random(seed)
+    now = datetime.now()
+
+    first_plan = (db.session.query(db.func.max(Plan.id)).scalar() or 0) + 1
+    plans = [{
+        'id': first_plan + i,
+        'name': f'Bench Plan {i}',
+        'description': None,
+        'monthly_price': 10 + i * 10,
+        'monthly_quota_gb': [10, 50, 100, 500][i],
+        'is_active': True,
+        'created_at': now,
+        'updated_at': now
+    } for i in range(4)]
+    db.session.execute(Plan.__table__.insert(), plans)
+
+    first_user = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    first_names = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank', 'Grace', 'Heidi']
+    last_names = ['Smith', 'Jones', 'Brown', 'Taylor', 'Wilson', 'Evans']
+
+    def flush(table, rows):
+        if rows:
+            db.session.execute(table.insert(), rows)
+            rows.clear()
+
+    user_rows, sub_rows, usage_rows = [], [], []
+    for i in range(users):
+        user_id = first_user + i
+        user_rows.append({
+            'id': user_id,
+            'name': f'{rnd.choice(first_names)} {rnd.choice(last_names)} {user_id}',
+            'email': f'bench{user_id}@example.com',
+            'password_hash': 'x',
+            'role': 'user',
+            'created_at': now - timedelta(days=rnd.randint(0, 365)),
+            'updated_at': now
+        })
+        for _ in range(subscriptions_per_user):
+            plan = rnd.choice(plans)
+            created = now - timedelta(days=rnd.randint(0, 365))
+            sub_rows.append({
+                'user_id': user_id,
+                'plan_id': plan['id'],
+                'status': rnd.choice(['active', 'expired', 'cancelled', 'paused']),
+                'start_date': created.date(),
+                'end_date': None,
+                'price_paid': plan['monthly_price'],
+                'created_at': created,
+                'updated_at': created
+            })
+        for day in range(usage_days):
+            usage_rows.append({
+                'user_id': user_id,
+                'date': now.date() - timedelta(days=day),
+                'data_used_gb': round(rnd.uniform(0, 150), 2),
+                'created_at': now
+            })
+        if len(usage_rows) >= batch_size:
+            flush(User.__table__, user_rows)
+            flush(Subscription.__table__, sub_rows)
+            flush(Usage.__table__, usage_rows)
+
+    flush(User.__table__, user_rows)
+    flush(Subscription.__table__, sub_rows)
+    flush(Usage.__table__, usage_rows)
+    db.session.commit()
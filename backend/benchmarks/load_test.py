@@ -0,0 +1,158 @@
+# Load test: throughput and latency of the real endpoints for several pool sizes
+# Seeds the database once, then for each pool size starts the app in a
+# separate process (threaded werkzeug server, DB_POOL_SIZE=n) and drives a
+# mix of admin endpoints from concurrent clients for a fixed time. Point
+# DATABASE_URL at a local MySQL to see pool exhaustion as it happens in
+# production; the default throwaway SQLite only shows the pool mechanics.
+# Usage: python load_test.py [--pool-sizes 2,5,10,20] [--concurrency 32] [--duration 10]
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from common import bench_token, make_app, seed_dataset
+
+ENDPOINTS = [
+    '/admin/dashboard',
+    '/admin/users/detailed?per_page=20',
+    '/admin/subscriptions?per_page=50',
+    '/admin/alerts?per_page=50',
+    '/admin/plans',
+]
+# Set in main() to an admin token the server processes accept (same SECRET_KEY and database)
+HEADERS = {}
+
+
+def serve(port):
+    from werkzeug.serving import make_server
+    app = make_app()
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    print('ready', flush=True)
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(port, path, timeout=60):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        connection.request('GET', path, headers=HEADERS)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def drive(port, concurrency, duration):
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        done = []
+        failed = {}
+        i = offset
+        while time.monotonic() < deadline:
+            path = ENDPOINTS[i % len(ENDPOINTS)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status, _ = get(port, path)
+            except OSError as e:
+                status = type(e).__name__
+            if status == 200:
+                done.append(time.perf_counter() - started)
+            else:
+                failed[status] = failed.get(status, 0) + 1
+        with lock:
+            latencies.extend(done)
+            for key, count in failed.items():
+                errors[key] = errors.get(key, 0) + count
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors
+
+
+def percentile(values, fraction):
+    return values[min(int(fraction * len(values)), len(values) - 1)] * 1000 if values else 0
+
+
+def run_pool_size(pool_size, args):
+    port = free_port()
+    env = dict(os.environ, DB_POOL_SIZE=str(pool_size), DB_MAX_OVERFLOW=str(args.max_overflow),
+               DB_POOL_TIMEOUT=str(args.pool_timeout), PROFILING_LOG='none')
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+                              env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in server.stdout:
+            if line.strip() == 'ready':
+                break
+        for path in ENDPOINTS:
+            get(port, path)
+        latencies, errors = drive(port, args.concurrency, args.duration)
+        _, body = get(port, '/admin/db/pool')
+        pool = json.loads(body)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'pool_size': pool_size,
+        'throughput': len(latencies) / args.duration,
+        'p50_ms': percentile(latencies, 0.50),
+        'p99_ms': percentile(latencies, 0.99),
+        'errors': errors,
+        'checkout_timeouts': pool['checkout_timeouts'],
+        'max_wait_ms': pool['max_wait_ms'],
+        'connections_opened': pool['connections_opened']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    parser.add_argument('--pool-sizes', default='2,5,10,20')
+    parser.add_argument('--max-overflow', type=int, default=0)
+    parser.add_argument('--pool-timeout', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--users', type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    app = make_app()
+    from db import db
+    from services import metrics_rollup
+    with app.app_context():
+        seed_dataset(db, users=args.users, subscriptions_per_user=2, usage_days=10)
+        metrics_rollup.rebuild_rollups()
+        HEADERS['Authorization'] = f'Bearer {bench_token(app)}'
+        db.engine.dispose()
+
+    print(f'{args.concurrency} concurrent clients, {args.duration:.0f}s per pool size, max_overflow={args.max_overflow}')
+    print(f"{'pool':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'timeouts':>9} {'max wait ms':>12} {'opened':>7}  errors")
+    for pool_size in [int(size) for size in args.pool_sizes.split(',')]:
+        result = run_pool_size(pool_size, args)
+        print(f"{result['pool_size']:>5} {result['throughput']:>8.1f} {result['p50_ms']:>8.1f} "
+              f"{result['p99_ms']:>8.1f} {result['checkout_timeouts']:>9} {result['max_wait_ms']:>12.1f} "
+              f"{result['connections_opened']:>7}  {result['errors'] or '-'}")
+
+
+if __name__ == '__main__':
+    main()
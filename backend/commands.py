@@ -0,0 +1,149 @@
+import os
+
+import click
+
+import migrations
+
+from services import metrics_rollup, redemption, user_search, usage_ingest
+from services.dataset_import import DatasetImport, BATCH_SIZE as IMPORT_BATCH_SIZE
+from services.audit_writer import audit_writer
+from services.usage_archive import usage_archive
+from services.recommendations import recommender
+from services.billing import billing
+from services.lifecycle import lifecycle
+
+def register_commands(app):
+    @app.cli.command('backfill-metrics')
+    def backfill_metrics():
+        """Rebuild the daily metrics rollup tables from source data."""
+        result = metrics_rollup.rebuild_rollups()
+        click.echo(f"✅ Rebuilt {result['plan_rows']} plan/day rows and {result['usage_rows']} usage/day rows")
+    
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Re-index all user names and emails for admin search."""
+        indexed = user_search.rebuild_index()
+        click.echo(f'✅ Indexed {indexed} users')
+    
+    @app.cli.command('ingest-usage')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default=None,
+                  help='Input format (default: from the file extension)')
+    @click.option('--batch-size', default=usage_ingest.BATCH_SIZE, show_default=True)
+    def ingest_usage(path, fmt, batch_size):
+        """Bulk upsert usage records from an NDJSON or CSV file."""
+        fmt = fmt or ('csv' if os.path.splitext(path)[1].lower() == '.csv' else 'ndjson')
+        
+        def progress(report):
+            click.echo(f"batch {report['batch']}: {report['received']} rows "
+                       f"({report['inserted']} new, {report['updated']} updated, {report['rejected']} rejected) "
+                       f"{report['rows_per_sec']:,} rows/sec")
+        
+        with open(path, newline='', encoding='utf-8') as handle:
+            result = usage_ingest.ingest(handle, fmt=fmt, batch_size=batch_size, on_batch=progress)
+        
+        totals = result['totals']
+        click.echo(f"✅ Ingested {totals['accepted']} of {totals['received']} rows in {totals['seconds']}s "
+                   f"({totals['rows_per_sec']:,} rows/sec)")
+    
+    @app.cli.command('import-dataset')
+    @click.argument('path', type=click.Path(exists=True))
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+    @click.option('--workers', type=int, default=None, help='Password hashing processes (default: CPU count)')
+    @click.option('--default-password', default=None,
+                  help='Password for users without one in the source (default: a random one per user)')
+    def import_dataset(path, batch_size, workers, default_password):
+        """Import plans, users, subscriptions and usage from the dataset workbook or a directory of CSV files."""
+        def progress(report):
+            click.echo(f"{report['sheet']}: {report['rows']} rows ({report['imported']} new, "
+                       f"{report['existing']} existing, {report['rejected']} rejected) {report['rows_per_sec'] or 0:,} rows/sec")
+        
+        job = DatasetImport(path, batch_size=batch_size, workers=workers,
+                            default_password=default_password, on_batch=progress)
+        for report in job.run():
+            if report.get('skipped'):
+                click.echo(f"✅ {report['sheet']}: {report['skipped']}")
+                continue
+            resumed = f", resumed at row {report['resumed_at_row'] + 2}" if report['resumed_at_row'] else ''
+            click.echo(f"✅ {report['sheet']}: {report['imported']} imported, {report['existing']} existing, "
+                       f"{report['rejected']} rejected in {report['seconds']}s "
+                       f"({report['rows_per_sec'] or 0:,} rows/sec{resumed})")
+            for error in report['errors']:
+                click.echo(f"   row {error['row']}: {error['error']}")
+    
+    @app.cli.command('archive-usage')
+    @click.option('--months', type=int, default=None,
+                  help='Whole months to keep in the usage table (default: USAGE_ARCHIVE_MONTHS)')
+    @click.option('--dry-run', is_flag=True, help='Only report what would be archived')
+    def archive_usage(months, dry_run):
+        """Move old usage rows into the monthly archive files."""
+        reports = usage_archive.run(months=months, dry_run=dry_run, log=click.echo)
+        rows = sum(report['rows'] for report in reports)
+        verb = 'Would archive' if dry_run else 'Archived'
+        click.echo(f'✅ {verb} {rows} usage rows from {len(reports)} months to {usage_archive.directory}')
+    
+    @app.cli.command('replay-audit-spill')
+    def replay_audit_spill():
+        """Insert audit events spilled to disk by stopped processes into audit_logs."""
+        replayed = audit_writer.replay_spill()
+        remaining = len(audit_writer.spill_files())
+        click.echo(f'✅ Replayed {replayed} audit events ({remaining} spill files left)')
+    
+    @app.cli.command('fold-discount-counters')
+    def fold_discount_counters():
+        """Add redemptions counted on sharded discount codes to their used_count."""
+        folded = redemption.fold_counters()
+        click.echo(f'✅ Folded {sum(folded.values())} redemptions from {len(folded)} sharded discount codes')
+    
+    @app.cli.command('refresh-recommendations')
+    @click.option('--full', is_flag=True, help='Rescore every user, not only those whose data changed')
+    @click.option('--chunk-size', default=5000, show_default=True, help='Users scored per transaction')
+    def refresh_recommendations(full, chunk_size):
+        """Score users against the active plans and store their top recommendations."""
+        report = recommender.refresh(full=full, chunk_users=chunk_size, log=click.echo if full else None)
+        kind = 'all' if report['full'] else 'changed'
+        click.echo(f"✅ Scored {report['users']} users ({kind}) against {report['plans']} plans "
+                   f"in {report['seconds']}s ({report['users_per_sec']} users/sec)")
+    
+    @app.cli.command('run-billing')
+    @click.option('--date', 'run_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Bill the periods containing this date (default: today)')
+    @click.option('--chunk-size', type=int, default=None, help='Subscriptions per chunk (default: BILLING_CHUNK_SIZE)')
+    @click.option('--workers', type=int, default=None, help='Chunks invoiced in parallel (default: BILLING_WORKERS)')
+    @click.option('--max-chunks', type=int, default=None, help='Stop after this many chunks; the next run resumes')
+    def run_billing(run_date, chunk_size, workers, max_chunks):
+        """Invoice every active subscription for its current billing period."""
+        report = billing.run(run_date=run_date.date() if run_date else None, chunk_size=chunk_size,
+                             workers=workers, max_chunks=max_chunks, log=click.echo)
+        resumed = ' (resumed)' if report['resumed'] else ''
+        click.echo(f"✅ Billing run {report['run_date']}{resumed}: {report['invoices']} invoices, "
+                   f"{report['total']:.2f} billed in {report['seconds']}s ({report['invoices_per_sec']} invoices/sec), "
+                   f"{report['open_chunks']} chunks left")
+        if report['error']:
+            click.echo(f"❌ Some chunks failed and stay open: {report['error']}")
+    
+    @app.cli.command('sweep-subscriptions')
+    @click.option('--date', 'today', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Sweep as of this date (default: today)')
+    @click.option('--batch-size', type=int, default=None, help='Rows per UPDATE (default: LIFECYCLE_BATCH_SIZE)')
+    def sweep_subscriptions(today, batch_size):
+        """Expire, renew, pause and resume subscriptions whose dates have passed."""
+        report = lifecycle.sweep(today=today.date() if today else None, batch_size=batch_size, log=click.echo)
+        click.echo(f"✅ Swept subscriptions: {report['expired']} expired, {report['renewed']} renewed, "
+                   f"{report['paused']} paused, {report['resumed']} resumed in {report['batches']} batches, "
+                   f"{report['seconds']}s ({report['rows_per_sec']} rows/sec)")
+        if report['error']:
+            click.echo(f"❌ Sweep stopped early: {report['error']}")
+    
+    @app.cli.command('migrate')
+    @click.option('--to', 'target', default=None, help='Stop after this version (default: latest)')
+    def migrate(target):
+        """Apply pending schema migrations."""
+        applied = migrations.upgrade(target=target, log=click.echo)
+        click.echo(f'✅ Applied {len(applied)} migrations' if applied else '✅ Schema is up to date')
+    
+    @app.cli.command('migration-status')
+    def migration_status():
+        """List schema migrations and when they were applied."""
+        for row in migrations.status():
+            click.echo(f"{row['version']}_{row['name']}: {row['applied_at'] or 'pending'}")
@@ -0,0 +1,124 @@
+# Schema migrations
+# Versioned, forward-only migrations replace db.create_all(). Each module in
+# migrations/versions/ is named <NNNN>_<slug>.py and defines
+# upgrade(connection); the versions applied so far are recorded in the
+# schema_migrations table. Databases created with db.create_all() before
+# migrations existed are adopted by 0001_baseline, so every operation is
+# written to be idempotent (see migrations/ops.py).
+import importlib
+import os
+import re
+import zlib
+from datetime import datetime
+
+from sqlalchemy import Table, Column, String, DateTime, MetaData, select, text
+
+from db import db
+
+VERSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'versions')
+LOCK_NAME = 'schema_migrations'
+LOCK_TIMEOUT = 300
+
+_MODULE_NAME = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+# Kept out of db.metadata: the runner creates it, not a migration
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', String(4), primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+
+class MigrationError(RuntimeError):
+    pass
+
+
+def available():
+    """(version, name, module) for every migration file, oldest first."""
+    found = []
+    for filename in sorted(os.listdir(VERSIONS_DIR)):
+        match = _MODULE_NAME.match(filename)
+        if match:
+            found.append((match.group(1), match.group(2), f'migrations.versions.{filename[:-3]}'))
+    return found
+
+
+def applied(connection):
+    """{version: applied_at} for the migrations already run."""
+    schema_migrations.create(connection, checkfirst=True)
+    rows = connection.execute(select(schema_migrations.c.version, schema_migrations.c.applied_at))
+    return {version: applied_at for version, applied_at in rows}
+
+
+def _acquire_lock(connection):
+    # Several workers may start at once; only one of them migrates
+    dialect = connection.dialect.name
+    if dialect == 'mysql':
+        if not connection.execute(text('SELECT GET_LOCK(:name, :timeout)'),
+                                  {'name': LOCK_NAME, 'timeout': LOCK_TIMEOUT}).scalar():
+            raise MigrationError('Timed out waiting for the schema migration lock')
+    elif dialect == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': zlib.crc32(LOCK_NAME.encode())})
+
+
+def _release_lock(connection):
+    dialect = connection.dialect.name
+    if dialect == 'mysql':
+        connection.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': LOCK_NAME})
+    elif dialect == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': zlib.crc32(LOCK_NAME.encode())})
+
+
+def upgrade(target=None, log=None):
+    """Apply pending migrations up to `target` (default: all); returns the versions applied.
+
+    Each migration runs in its own transaction. MySQL commits DDL implicitly,
+    which is why the operations themselves are idempotent.
+    """
+    done = []
+    # One connection throughout: the advisory lock belongs to its session, and
+    # a single-connection pool must still be able to migrate
+    with db.engine.connect() as connection:
+        _acquire_lock(connection)
+        connection.commit()
+        try:
+            with connection.begin():
+                already = applied(connection)
+            for version, name, module_name in available():
+                if target is not None and version > target:
+                    break
+                if version in already:
+                    continue
+                module = importlib.import_module(module_name)
+                if log:
+                    log(f'Applying {version}_{name}')
+                with connection.begin():
+                    module.upgrade(connection)
+                    connection.execute(schema_migrations.insert().values(
+                        version=version, name=name, applied_at=datetime.now()
+                    ))
+                done.append(version)
+        finally:
+            if connection.in_transaction():
+                connection.rollback()
+            _release_lock(connection)
+            connection.commit()
+    return done
+
+
+def pending():
+    """Versions not applied yet."""
+    with db.engine.begin() as connection:
+        already = applied(connection)
+    return [version for version, _, _ in available() if version not in already]
+
+
+def status():
+    with db.engine.begin() as connection:
+        already = applied(connection)
+    return [{
+        'version': version,
+        'name': name,
+        'applied_at': already[version].isoformat() if version in already else None
+    } for version, name, _ in available()]
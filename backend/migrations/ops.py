@@ -0,0 +1,60 @@
+# Idempotent schema operations for migrations
+# Each helper checks the live schema first and returns whether it changed
+# anything, so a migration can run against a database that already has
+# (part of) its changes, e.g. one created by db.create_all().
+from sqlalchemy import Index, MetaData, Table, inspect
+from sqlalchemy.schema import CreateColumn
+
+
+def has_table(connection, table):
+    return inspect(connection).has_table(table)
+
+
+def _index_names(connection, table):
+    inspector = inspect(connection)
+    names = {index['name'] for index in inspector.get_indexes(table)}
+    names.update(constraint['name'] for constraint in inspector.get_unique_constraints(table))
+    return names
+
+
+def _unique_column_sets(connection, table):
+    inspector = inspect(connection)
+    sets = {tuple(constraint['column_names']) for constraint in inspector.get_unique_constraints(table)}
+    sets.update(tuple(index['column_names']) for index in inspector.get_indexes(table) if index['unique'])
+    return sets
+
+
+def create_index(connection, name, table, columns, unique=False):
+    """Create an index unless one with this name (or, for unique ones, these columns) exists."""
+    if name in _index_names(connection, table):
+        return False
+    if unique and tuple(columns) in _unique_column_sets(connection, table):
+        return False
+    reflected = Table(table, MetaData(), autoload_with=connection)
+    Index(name, *[reflected.c[column] for column in columns], unique=unique).create(connection)
+    return True
+
+
+def create_unique(connection, name, table, columns):
+    """Unique constraint as a unique index, which every backend can add to an existing table."""
+    return create_index(connection, name, table, columns, unique=True)
+
+
+def drop_index(connection, name, table):
+    if name not in {index['name'] for index in inspect(connection).get_indexes(table)}:
+        return False
+    reflected = Table(table, MetaData(), autoload_with=connection)
+    Index(name, _table=reflected).drop(connection)
+    return True
+
+
+def add_column(connection, table, column):
+    """ALTER TABLE ... ADD COLUMN for a new, unattached Column (give NOT NULL columns a server_default)."""
+    if column.name in {existing['name'] for existing in inspect(connection).get_columns(table)}:
+        return False
+    Table(table, MetaData(), column)
+    spec = CreateColumn(column).compile(dialect=connection.dialect)
+    connection.exec_driver_sql(
+        f'ALTER TABLE {connection.dialect.identifier_preparer.quote(table)} ADD COLUMN {spec}'
+    )
+    return True
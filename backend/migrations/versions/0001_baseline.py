@@ -0,0 +1,147 @@
+# Baseline: the tables db.create_all() used to create at startup
+# A frozen copy of the schema from before migrations existed, so this
+# migration creates the same tables whatever the models look like later.
+# Secondary indexes and constraints come with 0002; later columns and tables
+# with their own migrations. Existing tables (databases set up before
+# migrations existed) are left as they are.
+from sqlalchemy import (
+    JSON, Boolean, Column, Date, DateTime, Enum, ForeignKey, Integer, MetaData, Numeric, String, Table, Text
+)
+
+metadata = MetaData()
+
+Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('name', String(100), nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(255), nullable=False),
+    Column('role', Enum('admin', 'user', name='user_role'), nullable=False),
+    Column('created_at', DateTime, nullable=True),
+    Column('updated_at', DateTime, nullable=True)
+)
+
+Table(
+    'plans', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('name', String(100), nullable=False),
+    Column('description', Text, nullable=True),
+    Column('monthly_price', Numeric(10, 2), nullable=False),
+    Column('monthly_quota_gb', Integer, nullable=False),
+    Column('is_active', Boolean, nullable=True),
+    Column('created_at', DateTime, nullable=True),
+    Column('updated_at', DateTime, nullable=True)
+)
+
+Table(
+    'subscriptions', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    Column('plan_id', Integer, ForeignKey('plans.id', ondelete='CASCADE'), nullable=False),
+    Column('status', Enum('active', 'expired', 'cancelled', 'paused', name='subscription_status'), nullable=False),
+    Column('start_date', Date, nullable=False),
+    Column('end_date', Date, nullable=True),
+    Column('price_paid', Numeric(10, 2), nullable=False),
+    Column('created_at', DateTime, nullable=True),
+    Column('updated_at', DateTime, nullable=True)
+)
+
+Table(
+    'usage', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    Column('date', Date, nullable=False),
+    Column('data_used_gb', Numeric(10, 2), nullable=False),
+    Column('created_at', DateTime, nullable=True)
+)
+
+Table(
+    'discounts', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('plan_id', Integer, ForeignKey('plans.id', ondelete='CASCADE'), nullable=True),
+    Column('code', String(50), nullable=False),
+    Column('description', Text, nullable=True),
+    Column('discount_type', String(20), nullable=False),
+    Column('discount_value', Numeric(10, 2), nullable=False),
+    Column('min_amount', Numeric(10, 2), nullable=True),
+    Column('max_discount', Numeric(10, 2), nullable=True),
+    Column('usage_limit', Integer, nullable=True),
+    Column('used_count', Integer, nullable=False),
+    Column('is_active', Boolean, nullable=True),
+    Column('valid_from', DateTime, nullable=True),
+    Column('valid_until', DateTime, nullable=True),
+    Column('created_at', DateTime, nullable=True),
+    Column('updated_at', DateTime, nullable=True)
+)
+
+Table(
+    'alerts', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=True),
+    Column('type', Enum('info', 'warning', 'error', 'success', 'user_created', 'user_updated', 'user_deleted',
+                        'plan_created', 'plan_updated', 'plan_deleted', 'discount_created', 'discount_updated',
+                        'discount_deleted', name='alert_type'), nullable=False),
+    Column('title', String(200), nullable=False),
+    Column('message', Text, nullable=False),
+    Column('is_read', Boolean, nullable=True),
+    Column('created_at', DateTime, nullable=True)
+)
+
+Table(
+    'audit_logs', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True),
+    Column('action', String(100), nullable=False),
+    Column('table_name', String(50), nullable=False),
+    Column('record_id', Integer, nullable=True),
+    Column('old_values', JSON, nullable=True),
+    Column('new_values', JSON, nullable=True),
+    Column('ip_address', String(45), nullable=True),
+    Column('user_agent', Text, nullable=True),
+    Column('created_at', DateTime, nullable=True)
+)
+
+# Daily rollups (models/metrics.py); plan_id is 0 for rows without a plan
+Table(
+    'daily_plan_metrics', metadata,
+    Column('date', Date, primary_key=True),
+    Column('plan_id', Integer, primary_key=True, autoincrement=False),
+    Column('subscriptions_created', Integer, nullable=False),
+    Column('revenue', Numeric(14, 2), nullable=False),
+    Column('active_count', Integer, nullable=False),
+    Column('active_revenue', Numeric(14, 2), nullable=False),
+    Column('discounts_created', Integer, nullable=False),
+    Column('discounts_active', Integer, nullable=False),
+    Column('discounts_used', Integer, nullable=False)
+)
+
+Table(
+    'daily_usage_metrics', metadata,
+    Column('date', Date, primary_key=True),
+    Column('usage_count', Integer, nullable=False),
+    Column('usage_sum', Numeric(16, 2), nullable=False),
+    Column('usage_max', Numeric(10, 2), nullable=False),
+    Column('bucket_0_10', Integer, nullable=False),
+    Column('bucket_10_50', Integer, nullable=False),
+    Column('bucket_50_100', Integer, nullable=False),
+    Column('bucket_100_plus', Integer, nullable=False)
+)
+
+# User search index (models/search_index.py)
+Table(
+    'user_search_documents', metadata,
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, autoincrement=False),
+    Column('name_norm', String(100), nullable=False),
+    Column('email_norm', String(120), nullable=False)
+)
+
+Table(
+    'user_search_tokens', metadata,
+    Column('kind', String(4), primary_key=True),
+    Column('token', String(120), primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, autoincrement=False)
+)
+
+
+def upgrade(connection):
+    metadata.create_all(connection, checkfirst=True)
@@ -0,0 +1,101 @@
+# Composite indexes for the hot query paths, plus unique usage (user_id, date)
+# and discounts.code
+# Duplicate usage rows from before the constraint existed are collapsed to the
+# newest one per user and day (and the affected rollup days rebuilt); duplicate
+# discount codes need a human decision, so they stop the migration instead.
+# The rollup rebuild is a frozen copy written against the reflected tables,
+# not services.metrics_rollup, so later changes there cannot change it.
+from sqlalchemy import MetaData, Table, and_, case, func, select
+
+from migrations import MigrationError
+from migrations.ops import create_index, create_unique
+
+DELETE_CHUNK = 500
+
+# daily_usage_metrics bucket columns and their [min, max) bounds in GB
+USAGE_BUCKETS = [
+    ('bucket_0_10', 0, 10),
+    ('bucket_10_50', 10, 50),
+    ('bucket_50_100', 50, 100),
+    ('bucket_100_plus', 100, None)
+]
+
+INDEXES = [
+    ('ix_users_created_at_id', 'users', ['created_at', 'id']),
+    ('ix_subscriptions_created_at_id', 'subscriptions', ['created_at', 'id']),
+    ('ix_subscriptions_user_id_created_at', 'subscriptions', ['user_id', 'created_at']),
+    ('ix_subscriptions_status_created_at', 'subscriptions', ['status', 'created_at']),
+    ('ix_subscriptions_plan_id', 'subscriptions', ['plan_id']),
+    ('ix_usage_date', 'usage', ['date']),
+    ('ix_alerts_created_at_id', 'alerts', ['created_at', 'id']),
+    ('ix_alerts_is_read_created_at', 'alerts', ['is_read', 'created_at']),
+    ('ix_alerts_user_id', 'alerts', ['user_id']),
+    ('ix_discounts_created_at_id', 'discounts', ['created_at', 'id']),
+    ('ix_discounts_plan_id', 'discounts', ['plan_id']),
+    ('ix_audit_logs_user_id_created_at', 'audit_logs', ['user_id', 'created_at']),
+    ('ix_user_search_tokens_user_id', 'user_search_tokens', ['user_id']),
+]
+
+
+def _dedupe_usage(connection):
+    usage = Table('usage', MetaData(), autoload_with=connection)
+    duplicates = connection.execute(
+        select(usage.c.user_id, usage.c.date, func.max(usage.c.id))
+        .group_by(usage.c.user_id, usage.c.date)
+        .having(func.count() > 1)
+    ).all()
+    if not duplicates:
+        return
+    doomed = []
+    for user_id, day, keep_id in duplicates:
+        doomed.extend(connection.execute(
+            select(usage.c.id).where(
+                usage.c.user_id == user_id, usage.c.date == day, usage.c.id != keep_id
+            )
+        ).scalars())
+    for start in range(0, len(doomed), DELETE_CHUNK):
+        connection.execute(usage.delete().where(usage.c.id.in_(doomed[start:start + DELETE_CHUNK])))
+    _recompute_usage_days(connection, usage, [day for _, day, _ in duplicates])
+
+
+def _recompute_usage_days(connection, usage, days):
+    """Rebuild the daily_usage_metrics rows of `days` from the usage table."""
+    usage_metrics = Table('daily_usage_metrics', MetaData(), autoload_with=connection)
+    columns = [
+        func.count(usage.c.id).label('usage_count'),
+        func.sum(usage.c.data_used_gb).label('usage_sum'),
+        func.max(usage.c.data_used_gb).label('usage_max')
+    ]
+    for column, min_gb, max_gb in USAGE_BUCKETS:
+        in_bucket = usage.c.data_used_gb >= min_gb
+        if max_gb is not None:
+            in_bucket = and_(in_bucket, usage.c.data_used_gb < max_gb)
+        columns.append(func.count(case((in_bucket, usage.c.id))).label(column))
+
+    for day in sorted(set(days)):
+        aggregates = connection.execute(select(*columns).where(usage.c.date == day)).one()
+        connection.execute(usage_metrics.delete().where(usage_metrics.c.date == day))
+        if aggregates.usage_count:
+            row = {column: value or 0 for column, value in aggregates._mapping.items()}
+            connection.execute(usage_metrics.insert().values(date=day, **row))
+
+
+def _check_discount_codes(connection):
+    discounts = Table('discounts', MetaData(), autoload_with=connection)
+    duplicates = connection.execute(
+        select(discounts.c.code).group_by(discounts.c.code).having(func.count() > 1)
+    ).scalars().all()
+    if duplicates:
+        raise MigrationError(
+            'Duplicate discount codes must be renamed or removed before migrating: '
+            + ', '.join(sorted(duplicates))
+        )
+
+
+def upgrade(connection):
+    for name, table, columns in INDEXES:
+        create_index(connection, name, table, columns)
+    _dedupe_usage(connection)
+    create_unique(connection, 'uq_usage_user_date', 'usage', ['user_id', 'date'])
+    _check_discount_codes(connection)
+    create_unique(connection, 'uq_discounts_code', 'discounts', ['code'])
@@ -0,0 +1,12 @@
+# Heartbeat row used to measure read-replica lag (services/db_routing.py)
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table
+
+replica_heartbeat = Table(
+    'replica_heartbeat', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('beat_at', DateTime, nullable=False)
+)
+
+
+def upgrade(connection):
+    replica_heartbeat.create(connection, checkfirst=True)
@@ -0,0 +1,31 @@
+# Progress and source-id mapping of `flask import-dataset` runs (services/dataset_import.py)
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+metadata = MetaData()
+
+data_imports = Table(
+    'data_imports', metadata,
+    Column('dataset', String(64), primary_key=True),
+    Column('sheet', String(32), primary_key=True),
+    Column('source', String(255), nullable=False),
+    Column('rows_done', Integer, nullable=False),
+    Column('imported', Integer, nullable=False),
+    Column('existing', Integer, nullable=False),
+    Column('rejected', Integer, nullable=False),
+    Column('started_at', DateTime, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+    Column('finished_at', DateTime, nullable=True)
+)
+
+data_import_keys = Table(
+    'data_import_keys', metadata,
+    Column('dataset', String(64), primary_key=True),
+    Column('entity', String(16), primary_key=True),
+    Column('source_id', String(64), primary_key=True),
+    Column('target_id', Integer, nullable=False)
+)
+
+
+def upgrade(connection):
+    data_imports.create(connection, checkfirst=True)
+    data_import_keys.create(connection, checkfirst=True)
@@ -0,0 +1,16 @@
+# Revoked bearer tokens and per-user token cutoffs (services/auth.py)
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table
+
+auth_revocations = Table(
+    'auth_revocations', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('kind', String(8), nullable=False),
+    Column('key', String(64), nullable=False),
+    Column('revoked_at', Float, nullable=False),
+    Column('expires_at', Float, nullable=False, index=True),
+    Column('created_at', DateTime, nullable=False)
+)
+
+
+def upgrade(connection):
+    auth_revocations.create(connection, checkfirst=True)
@@ -0,0 +1,17 @@
+# Sharded redemption counters for hot discount codes (services/redemption.py)
+from sqlalchemy import Column, Integer, MetaData, Table
+
+from migrations.ops import add_column
+
+discount_counter_shards = Table(
+    'discount_counter_shards', MetaData(),
+    Column('discount_id', Integer, primary_key=True, autoincrement=False),
+    Column('shard', Integer, primary_key=True, autoincrement=False),
+    Column('remaining', Integer, nullable=True),
+    Column('redeemed', Integer, nullable=False)
+)
+
+
+def upgrade(connection):
+    add_column(connection, 'discounts', Column('counter_shards', Integer, nullable=False, server_default='0'))
+    discount_counter_shards.create(connection, checkfirst=True)
@@ -0,0 +1,39 @@
+# Stored plan recommendations and the queue of users to rescore (services/recommendations.py)
+from datetime import datetime
+
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, MetaData, Table, select
+
+metadata = MetaData()
+
+plan_recommendations = Table(
+    'plan_recommendations', metadata,
+    Column('user_id', Integer, primary_key=True, autoincrement=False),
+    Column('rank', Integer, primary_key=True, autoincrement=False),
+    Column('plan_id', Integer, nullable=False),
+    Column('score', Float, nullable=False),
+    Column('monthly_cost', Float, nullable=False),
+    Column('fits', Boolean, nullable=False),
+    Column('projected_gb', Float, nullable=False),
+    Column('current_plan_id', Integer, nullable=True),
+    Column('computed_at', DateTime, nullable=False)
+)
+
+recommendation_queue = Table(
+    'recommendation_queue', metadata,
+    Column('user_id', Integer, primary_key=True, autoincrement=False),
+    Column('marked_at', DateTime, nullable=False)
+)
+
+# Queued in place of a user id: rescore every user
+EVERYONE = 0
+
+
+def upgrade(connection):
+    plan_recommendations.create(connection, checkfirst=True)
+    recommendation_queue.create(connection, checkfirst=True)
+    # The first refresh scores every existing user
+    queued = connection.execute(
+        select(recommendation_queue.c.user_id).where(recommendation_queue.c.user_id == EVERYONE)
+    ).first()
+    if queued is None:
+        connection.execute(recommendation_queue.insert().values(user_id=EVERYONE, marked_at=datetime.now()))
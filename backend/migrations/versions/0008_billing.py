@@ -0,0 +1,55 @@
+# Invoices and the checkpoints of `flask run-billing` (services/billing.py)
+from sqlalchemy import (Column, Date, DateTime, Float, ForeignKey, Index, Integer, MetaData, Numeric, String, Table,
+                        UniqueConstraint)
+
+metadata = MetaData()
+
+invoices = Table(
+    'invoices', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('subscription_id', Integer, nullable=False),
+    Column('user_id', Integer, nullable=False),
+    Column('plan_id', Integer, nullable=False),
+    Column('period_start', Date, nullable=False),
+    Column('period_end', Date, nullable=False),
+    Column('amount', Numeric(10, 2), nullable=False),
+    Column('discount_id', Integer, nullable=True),
+    Column('discount_code', String(50), nullable=True),
+    Column('discount_amount', Numeric(10, 2), nullable=False),
+    Column('total', Numeric(10, 2), nullable=False),
+    Column('billing_run_id', Integer, nullable=True),
+    Column('created_at', DateTime, nullable=False),
+    UniqueConstraint('subscription_id', 'period_start', name='uq_invoices_subscription_period'),
+    Index('ix_invoices_user_id_period_start', 'user_id', 'period_start')
+)
+
+billing_runs = Table(
+    'billing_runs', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('run_date', Date, nullable=False, unique=True),
+    Column('status', String(16), nullable=False),
+    Column('chunks', Integer, nullable=False),
+    Column('invoices', Integer, nullable=False),
+    Column('total', Numeric(14, 2), nullable=False),
+    Column('seconds', Float, nullable=False),
+    Column('last_error', String(500), nullable=True),
+    Column('started_at', DateTime, nullable=False),
+    Column('finished_at', DateTime, nullable=True)
+)
+
+billing_run_chunks = Table(
+    'billing_run_chunks', metadata,
+    Column('run_id', Integer, ForeignKey('billing_runs.id', ondelete='CASCADE'), primary_key=True),
+    Column('chunk', Integer, primary_key=True, autoincrement=False),
+    Column('first_id', Integer, nullable=False),
+    Column('last_id', Integer, nullable=True),
+    Column('invoices', Integer, nullable=True),
+    Column('total', Numeric(14, 2), nullable=True),
+    Column('completed_at', DateTime, nullable=True)
+)
+
+
+def upgrade(connection):
+    invoices.create(connection, checkfirst=True)
+    billing_runs.create(connection, checkfirst=True)
+    billing_run_chunks.create(connection, checkfirst=True)
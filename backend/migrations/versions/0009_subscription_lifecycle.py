@@ -0,0 +1,30 @@
+# Renewal and pause schedules on subscriptions, and the sweep log of
+# services/lifecycle.py
+from sqlalchemy import Boolean, Column, Date, DateTime, Float, Integer, MetaData, String, Table
+
+from migrations.ops import add_column, create_index
+
+lifecycle_runs = Table(
+    'lifecycle_runs', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('slot', Integer, nullable=True, unique=True),
+    Column('trigger', String(16), nullable=False),
+    Column('started_at', DateTime, nullable=False),
+    Column('finished_at', DateTime, nullable=True),
+    Column('seconds', Float, nullable=True),
+    Column('batches', Integer, nullable=False),
+    Column('resumed', Integer, nullable=False),
+    Column('paused', Integer, nullable=False),
+    Column('renewed', Integer, nullable=False),
+    Column('expired', Integer, nullable=False),
+    Column('error', String(500), nullable=True)
+)
+
+
+def upgrade(connection):
+    add_column(connection, 'subscriptions', Column('auto_renew', Boolean, nullable=False, server_default='0'))
+    add_column(connection, 'subscriptions', Column('pause_start', Date, nullable=True))
+    add_column(connection, 'subscriptions', Column('pause_end', Date, nullable=True))
+    create_index(connection, 'ix_subscriptions_status_end_date', 'subscriptions', ['status', 'end_date'])
+    create_index(connection, 'ix_subscriptions_status_pause_start', 'subscriptions', ['status', 'pause_start'])
+    lifecycle_runs.create(connection, checkfirst=True)
@@ -0,0 +1,18 @@
+# Per-period usage totals behind the quota alerts (services/quota.py)
+from sqlalchemy import BigInteger, Column, Date, DateTime, Integer, MetaData, Table
+
+quota_usage = Table(
+    'quota_usage', MetaData(),
+    Column('user_id', Integer, primary_key=True, autoincrement=False),
+    Column('period_start', Date, primary_key=True),
+    Column('period_end', Date, nullable=False),
+    Column('subscription_id', Integer, nullable=False),
+    Column('plan_id', Integer, nullable=False),
+    Column('used_cents', BigInteger, nullable=False),
+    Column('alerted_pct', Integer, nullable=False),
+    Column('updated_at', DateTime, nullable=False)
+)
+
+
+def upgrade(connection):
+    quota_usage.create(connection, checkfirst=True)
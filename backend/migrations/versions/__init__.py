@@ -0,0 +1 @@
+# Migration modules: <NNNN>_<slug>.py, each defining upgrade(connection)
@@ -3,6 +3,13 @@ from datetime import datetime
 
 class Alert(db.Model):
     __tablename__ = 'alerts'
+    __table_args__ = (
+        # Keyset pagination order (see utils/pagination.py)
+        db.Index('ix_alerts_created_at_id', 'created_at', 'id'),
+        # Unread counter on the dashboard
+        db.Index('ix_alerts_is_read_created_at', 'is_read', 'created_at'),
+        db.Index('ix_alerts_user_id', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True)
@@ -0,0 +1,14 @@
+from db import db
+
+# Revoked bearer tokens and per-user token cutoffs (services/auth.py), kept
+# until the tokens they cover would have expired anyway
+auth_revocations = db.Table(
+    'auth_revocations',
+    db.Column('id', db.Integer, primary_key=True),
+    # 'token': key is a token id; 'user': key is a user id whose older tokens are void
+    db.Column('kind', db.String(8), nullable=False),
+    db.Column('key', db.String(64), nullable=False),
+    db.Column('revoked_at', db.Float, nullable=False),
+    db.Column('expires_at', db.Float, nullable=False, index=True),
+    db.Column('created_at', db.DateTime, nullable=False)
+)
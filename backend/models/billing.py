@@ -0,0 +1,51 @@
+from db import db
+
+# Invoices written by billing runs (services/billing.py)
+invoices = db.Table(
+    'invoices',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('subscription_id', db.Integer, nullable=False),
+    db.Column('user_id', db.Integer, nullable=False),
+    db.Column('plan_id', db.Integer, nullable=False),
+    db.Column('period_start', db.Date, nullable=False),
+    db.Column('period_end', db.Date, nullable=False),
+    db.Column('amount', db.Numeric(10, 2), nullable=False),
+    db.Column('discount_id', db.Integer, nullable=True),
+    db.Column('discount_code', db.String(50), nullable=True),
+    db.Column('discount_amount', db.Numeric(10, 2), nullable=False),
+    db.Column('total', db.Numeric(10, 2), nullable=False),
+    db.Column('billing_run_id', db.Integer, nullable=True),
+    db.Column('created_at', db.DateTime, nullable=False),
+    # One invoice per subscription and period, however often a run is repeated
+    db.UniqueConstraint('subscription_id', 'period_start', name='uq_invoices_subscription_period'),
+    db.Index('ix_invoices_user_id_period_start', 'user_id', 'period_start')
+)
+
+# One row per `flask run-billing` date
+billing_runs = db.Table(
+    'billing_runs',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('run_date', db.Date, nullable=False, unique=True),
+    # 'running' until every chunk is done, then 'completed'
+    db.Column('status', db.String(16), nullable=False),
+    db.Column('chunks', db.Integer, nullable=False),
+    db.Column('invoices', db.Integer, nullable=False, default=0),
+    db.Column('total', db.Numeric(14, 2), nullable=False, default=0),
+    db.Column('seconds', db.Float, nullable=False, default=0),
+    db.Column('last_error', db.String(500), nullable=True),
+    db.Column('started_at', db.DateTime, nullable=False),
+    db.Column('finished_at', db.DateTime, nullable=True)
+)
+
+# A run's subscription id ranges, each invoiced (and checkpointed) in one transaction
+billing_run_chunks = db.Table(
+    'billing_run_chunks',
+    db.Column('run_id', db.Integer, db.ForeignKey('billing_runs.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('chunk', db.Integer, primary_key=True, autoincrement=False),
+    # Subscription ids first_id..last_id; NULL last_id: no upper bound
+    db.Column('first_id', db.Integer, nullable=False),
+    db.Column('last_id', db.Integer, nullable=True),
+    db.Column('invoices', db.Integer, nullable=True),
+    db.Column('total', db.Numeric(14, 2), nullable=True),
+    db.Column('completed_at', db.DateTime, nullable=True)
+)
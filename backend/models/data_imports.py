@@ -0,0 +1,26 @@
+from db import db
+
+# One row per dataset and sheet: how far `flask import-dataset` got
+# (services/dataset_import.py), so an interrupted run resumes there
+data_imports = db.Table(
+    'data_imports',
+    db.Column('dataset', db.String(64), primary_key=True),
+    db.Column('sheet', db.String(32), primary_key=True),
+    db.Column('source', db.String(255), nullable=False),
+    db.Column('rows_done', db.Integer, nullable=False),
+    db.Column('imported', db.Integer, nullable=False),
+    db.Column('existing', db.Integer, nullable=False),
+    db.Column('rejected', db.Integer, nullable=False),
+    db.Column('started_at', db.DateTime, nullable=False),
+    db.Column('updated_at', db.DateTime, nullable=False),
+    db.Column('finished_at', db.DateTime, nullable=True)
+)
+
+# The dataset's own ids mapped to the rows they were imported as
+data_import_keys = db.Table(
+    'data_import_keys',
+    db.Column('dataset', db.String(64), primary_key=True),
+    db.Column('entity', db.String(16), primary_key=True),
+    db.Column('source_id', db.String(64), primary_key=True),
+    db.Column('target_id', db.Integer, nullable=False)
+)
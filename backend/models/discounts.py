@@ -3,6 +3,13 @@ from datetime import datetime
 
 class Discount(db.Model):
     __tablename__ = 'discounts'
+    __table_args__ = (
+        # Keyset pagination order (see utils/pagination.py)
+        db.Index('ix_discounts_created_at_id', 'created_at', 'id'),
+        # Codes are looked up (and redeemed) by value
+        db.UniqueConstraint('code', name='uq_discounts_code'),
+        db.Index('ix_discounts_plan_id', 'plan_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     plan_id = db.Column(db.Integer, db.ForeignKey('plans.id', ondelete='CASCADE'), nullable=True)
@@ -14,6 +21,8 @@ class Discount(db.Model):
     max_discount = db.Column(db.Numeric(10, 2), nullable=True)
     usage_limit = db.Column(db.Integer, nullable=True)
     used_count = db.Column(db.Integer, nullable=False, default=0)
+    # > 0: redemptions are counted in discount_counter_shards (services/redemption.py)
+    counter_shards = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     is_active = db.Column(db.Boolean, nullable=True, default=True)
     valid_from = db.Column(db.DateTime, nullable=True)
     valid_until = db.Column(db.DateTime, nullable=True)
@@ -35,9 +44,21 @@ class Discount(db.Model):
             'max_discount': float(self.max_discount) if self.max_discount else None,
             'usage_limit': self.usage_limit,
             'used_count': self.used_count,
+            'counter_shards': self.counter_shards,
             'is_active': self.is_active,
             'valid_from': self.valid_from.isoformat() if self.valid_from else None,
             'valid_until': self.valid_until.isoformat() if self.valid_until else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+
+# Redemption counters of sharded discount codes (services/redemption.py)
+discount_counter_shards = db.Table(
+    'discount_counter_shards',
+    db.Column('discount_id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('shard', db.Integer, primary_key=True, autoincrement=False),
+    # Uses this shard may still hand out; NULL for codes without a limit
+    db.Column('remaining', db.Integer, nullable=True),
+    # Taken since the last fold into discounts.used_count
+    db.Column('redeemed', db.Integer, nullable=False, default=0)
+)
@@ -0,0 +1,20 @@
+from db import db
+
+# One row per subscription lifecycle sweep (services/lifecycle.py), with the
+# rows each rule changed
+lifecycle_runs = db.Table(
+    'lifecycle_runs',
+    db.Column('id', db.Integer, primary_key=True),
+    # Scheduler slot (time // interval) the run claimed; NULL for manual runs
+    db.Column('slot', db.Integer, nullable=True, unique=True),
+    db.Column('trigger', db.String(16), nullable=False),
+    db.Column('started_at', db.DateTime, nullable=False),
+    db.Column('finished_at', db.DateTime, nullable=True),
+    db.Column('seconds', db.Float, nullable=True),
+    db.Column('batches', db.Integer, nullable=False, default=0),
+    db.Column('resumed', db.Integer, nullable=False, default=0),
+    db.Column('paused', db.Integer, nullable=False, default=0),
+    db.Column('renewed', db.Integer, nullable=False, default=0),
+    db.Column('expired', db.Integer, nullable=False, default=0),
+    db.Column('error', db.String(500), nullable=True)
+)
@@ -0,0 +1,54 @@
+from db import db
+from datetime import datetime
+
+class DailyPlanMetric(db.Model):
+    __tablename__ = 'daily_plan_metrics'
+    
+    # plan_id is 0 for rows that do not belong to a plan (e.g. global discounts)
+    date = db.Column(db.Date, primary_key=True)
+    plan_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    subscriptions_created = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    active_count = db.Column(db.Integer, nullable=False, default=0)
+    active_revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    discounts_created = db.Column(db.Integer, nullable=False, default=0)
+    discounts_active = db.Column(db.Integer, nullable=False, default=0)
+    discounts_used = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'date': self.date.isoformat() if self.date else None,
+            'plan_id': self.plan_id,
+            'subscriptions_created': self.subscriptions_created,
+            'revenue': float(self.revenue),
+            'active_count': self.active_count,
+            'active_revenue': float(self.active_revenue),
+            'discounts_created': self.discounts_created,
+            'discounts_active': self.discounts_active,
+            'discounts_used': self.discounts_used
+        }
+
+class DailyUsageMetric(db.Model):
+    __tablename__ = 'daily_usage_metrics'
+    
+    date = db.Column(db.Date, primary_key=True)
+    usage_count = db.Column(db.Integer, nullable=False, default=0)
+    usage_sum = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    usage_max = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    bucket_0_10 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_10_50 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_50_100 = db.Column(db.Integer, nullable=False, default=0)
+    bucket_100_plus = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'date': self.date.isoformat() if self.date else None,
+            'usage_count': self.usage_count,
+            'usage_sum': float(self.usage_sum),
+            'usage_avg': float(self.usage_sum) / self.usage_count if self.usage_count else 0,
+            'usage_max': float(self.usage_max),
+            'bucket_0_10': self.bucket_0_10,
+            'bucket_10_50': self.bucket_10_50,
+            'bucket_50_100': self.bucket_50_100,
+            'bucket_100_plus': self.bucket_100_plus
+        }
@@ -0,0 +1,16 @@
+from db import db
+
+# Each user's usage total in the current billing period of their subscription
+# (services/quota.py), in hundredths of a GB
+quota_usage = db.Table(
+    'quota_usage',
+    db.Column('user_id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('period_start', db.Date, primary_key=True),
+    db.Column('period_end', db.Date, nullable=False),
+    db.Column('subscription_id', db.Integer, nullable=False),
+    db.Column('plan_id', db.Integer, nullable=False),
+    db.Column('used_cents', db.BigInteger, nullable=False),
+    # Highest threshold (percent) alerted in this period, 0 for none
+    db.Column('alerted_pct', db.Integer, nullable=False, default=0),
+    db.Column('updated_at', db.DateTime, nullable=False)
+)
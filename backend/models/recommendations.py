@@ -0,0 +1,24 @@
+from db import db
+
+# Each user's best plans, rank 1 first, as scored by the last refresh
+# (services/recommendations.py)
+plan_recommendations = db.Table(
+    'plan_recommendations',
+    db.Column('user_id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('rank', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('plan_id', db.Integer, nullable=False),
+    db.Column('score', db.Float, nullable=False),
+    # Price plus the shortfall penalty
+    db.Column('monthly_cost', db.Float, nullable=False),
+    db.Column('fits', db.Boolean, nullable=False),
+    db.Column('projected_gb', db.Float, nullable=False),
+    db.Column('current_plan_id', db.Integer, nullable=True),
+    db.Column('computed_at', db.DateTime, nullable=False)
+)
+
+# Users to rescore in the next incremental refresh; user_id 0 means everyone
+recommendation_queue = db.Table(
+    'recommendation_queue',
+    db.Column('user_id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('marked_at', db.DateTime, nullable=False)
+)
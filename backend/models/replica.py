@@ -0,0 +1,9 @@
+from db import db
+
+# One row, stamped on the primary and read back from the replica to measure
+# replication lag (services/db_routing.py)
+replica_heartbeat = db.Table(
+    'replica_heartbeat',
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('beat_at', db.DateTime, nullable=False)
+)
@@ -0,0 +1,31 @@
+from db import db
+
+class UserSearchDocument(db.Model):
+    __tablename__ = 'user_search_documents'
+    
+    # Normalized copies of the searchable user fields, used to re-check index candidates
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, autoincrement=False)
+    name_norm = db.Column(db.String(100), nullable=False)
+    email_norm = db.Column(db.String(120), nullable=False)
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'name_norm': self.name_norm,
+            'email_norm': self.email_norm
+        }
+
+class UserSearchToken(db.Model):
+    __tablename__ = 'user_search_tokens'
+    
+    # kind is 'gram' (trigram of a whole field) or 'word' (a full word, used for prefix lookups)
+    kind = db.Column(db.String(4), primary_key=True)
+    token = db.Column(db.String(120), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, autoincrement=False, index=True)
+    
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'token': self.token,
+            'user_id': self.user_id
+        }
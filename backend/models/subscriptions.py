@@ -3,6 +3,18 @@ from datetime import datetime
 
 class Subscription(db.Model):
     __tablename__ = 'subscriptions'
+    __table_args__ = (
+        # Keyset pagination order (see utils/pagination.py)
+        db.Index('ix_subscriptions_created_at_id', 'created_at', 'id'),
+        # Per-user subscription lists (/admin/users/detailed, user deletes)
+        db.Index('ix_subscriptions_user_id_created_at', 'user_id', 'created_at'),
+        # Status counts and "active since" filters
+        db.Index('ix_subscriptions_status_created_at', 'status', 'created_at'),
+        db.Index('ix_subscriptions_plan_id', 'plan_id'),
+        # Lifecycle sweeps: lapsed and scheduled-to-pause subscriptions (services/lifecycle.py)
+        db.Index('ix_subscriptions_status_end_date', 'status', 'end_date'),
+        db.Index('ix_subscriptions_status_pause_start', 'status', 'pause_start'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -11,6 +23,11 @@ class Subscription(db.Model):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=True)
     price_paid = db.Column(db.Numeric(10, 2), nullable=False)
+    # Renewed for another term instead of expiring when end_date passes
+    auto_renew = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    # Paused from pause_start, active again from pause_end (open-ended when NULL)
+    pause_start = db.Column(db.Date, nullable=True)
+    pause_end = db.Column(db.Date, nullable=True)
     created_at = db.Column(db.DateTime, nullable=True)
     updated_at = db.Column(db.DateTime, nullable=True)
     
@@ -26,6 +43,9 @@ class Subscription(db.Model):
             'start_date': self.start_date.isoformat() if self.start_date else None,
             'end_date': self.end_date.isoformat() if self.end_date else None,
             'price_paid': float(self.price_paid),
+            'auto_renew': bool(self.auto_renew),
+            'pause_start': self.pause_start.isoformat() if self.pause_start else None,
+            'pause_end': self.pause_end.isoformat() if self.pause_end else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -3,6 +3,12 @@ from datetime import datetime
 
 class Usage(db.Model):
     __tablename__ = 'usage'
+    __table_args__ = (
+        # One metering record per user per day; bulk ingestion upserts on it
+        db.UniqueConstraint('user_id', 'date', name='uq_usage_user_date'),
+        # Per-day rollup recomputes and date-range reads
+        db.Index('ix_usage_date', 'date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -1,5 +1,4 @@
-from flask import Blueprint, request, jsonify
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
 from models.users import User
 from models.plans import Plan
 from models.subscriptions import Subscription
@@ -7,13 +6,36 @@ from models.usage import Usage
 from models.discounts import Discount
 from models.alerts import Alert
 from models.audit_logs import AuditLog
+from services.analytics_engine import DetailedAnalyticsEngine
+from services import metrics_rollup, user_search, exporter, usage_ingest, catalog, usage_analytics, redemption
+from services.auth import auth, public
+from services.cache import cache
+from services.credentials import credentials, CredentialsBusy
+from services.profiler import profiler
+from services.db_pool import pool_monitor
+from services.db_routing import read_replica, replica_router
+from services.usage_archive import usage_archive
+from services.recommendations import recommender
+from services.billing import billing
+from services.lifecycle import lifecycle
+from services.quota import quota_monitor
+from services.alert_dispatcher import dispatcher, publish_alert
+from services.audit_writer import audit_writer, record_audit
 from db import db
-from datetime import datetime, timedelta
+from utils.pagination import (keyset_paginate, offset_paginate, offset_args, offset_meta, page_args, page_meta,
+                              wants_offset, InvalidCursor)
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import io
 from sqlalchemy import func, desc, and_, or_
+from sqlalchemy.orm import joinedload, contains_eager
 
 admin_bp = Blueprint('admin', __name__)
+# Everything except login needs an admin's bearer token (services/auth.py)
+admin_bp.before_request(auth.guard('admin'))
 
 @admin_bp.route('/login', methods=['POST'])
+@public
 def admin_login():
     try:
         data = request.get_json()
@@ -26,44 +48,55 @@ def admin_login():
         # Find admin user
         admin_user = User.query.filter_by(email=email, role='admin').first()
         
-        if not admin_user or not check_password_hash(admin_user.password_hash, password):
+        if not admin_user or not credentials.verify(admin_user, password):
+            record_audit('LOGIN_FAILED', 'users', record_id=admin_user.id if admin_user else None,
+                         new_values={'email': email, 'role': 'admin'})
             return jsonify({'error': 'Invalid credentials'}), 401
         
-        # Log the login action
-        audit_log = AuditLog(
-            user_id=admin_user.id,
-            action='LOGIN',
-            table_name='users',
-            record_id=admin_user.id,
-            old_values=None,
-            new_values={'login_time': datetime.now().isoformat()},
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent'),
-            created_at=datetime.now()
-        )
-        db.session.add(audit_log)
-        db.session.commit()
+        # Save the password hash if verify() upgraded it to the configured method
+        if db.session.is_modified(admin_user):
+            db.session.commit()
+        
+        # Log the login action (written in the background, off the request path)
+        record_audit('LOGIN', 'users', record_id=admin_user.id, user_id=admin_user.id,
+                     new_values={'login_time': datetime.now().isoformat()})
         
         return jsonify({
             'success': True,
             'message': 'Login successful',
-            'user': admin_user.to_dict()
+            'user': admin_user.to_dict(),
+            **auth.issue(admin_user)
         }), 200
         
+    except CredentialsBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/logout', methods=['POST'])
+def admin_logout():
+    try:
+        # Revoke the token this request came with
+        if g.principal:
+            auth.revoke_token(g.principal)
+            record_audit('LOGOUT', 'users', record_id=g.principal.user_id)
+        return jsonify({'success': True, 'message': 'Logged out'}), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @admin_bp.route('/dashboard', methods=['GET'])
+@read_replica
 def admin_dashboard():
     try:
         # Get dashboard statistics
         total_users = User.query.count()
-        active_subscriptions = Subscription.query.filter_by(status='active').count()
-        total_plans = Plan.query.count()
-        monthly_revenue = db.session.query(func.sum(Subscription.price_paid)).filter(
-            Subscription.status == 'active',
-            Subscription.created_at >= datetime.now().replace(day=1)
-        ).scalar() or 0
+        total_plans = len(catalog.plan_catalog())
+        
+        # Subscription and usage totals come from the daily rollup tables
+        totals = metrics_rollup.dashboard_totals(datetime.now().replace(day=1))
+        active_subscriptions = totals['active_subscriptions']
+        monthly_revenue = totals['monthly_revenue']
         
         # Get recent subscriptions
         recent_subscriptions = Subscription.query.join(User).join(Plan).order_by(
@@ -71,7 +104,7 @@ def admin_dashboard():
         ).limit(5).all()
         
         # Get usage statistics
-        total_usage = db.session.query(func.sum(Usage.data_used_gb)).scalar() or 0
+        total_usage = totals['total_usage']
         
         # Get alerts
         unread_alerts = Alert.query.filter_by(is_read=False).count()
@@ -98,26 +131,32 @@ def admin_dashboard():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@admin_bp.route('/users', methods=['GET', 'POST', 'PUT', 'DELETE'])
+@admin_bp.route('/users', methods=['GET'])
+@read_replica
+def list_users():
+    try:
+        # Get users one keyset page at a time (newest first); ?page= still gets numbered pages
+        if wants_offset(request.args):
+            users = offset_paginate(User.query, User, **offset_args(request.args))
+            meta = offset_meta(users)
+        else:
+            users = keyset_paginate(User.query, User, **page_args(request.args))
+            meta = page_meta(users)
+        
+        return jsonify({
+            'users': [user.to_dict() for user in users.items],
+            **meta
+        }), 200
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/users', methods=['POST', 'PUT', 'DELETE'])
 def manage_users():
     try:
-        if request.method == 'GET':
-            # Get all users with pagination
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            users = User.query.paginate(
-                page=page, per_page=per_page, error_out=False
-            )
-            
-            return jsonify({
-                'users': [user.to_dict() for user in users.items],
-                'total': users.total,
-                'pages': users.pages,
-                'current_page': page
-            }), 200
-            
-        elif request.method == 'POST':
+        if request.method == 'POST':
             # Create new user
             data = request.get_json()
             
@@ -128,7 +167,7 @@ def manage_users():
             user = User(
                 name=data['name'],
                 email=data['email'],
-                password_hash=generate_password_hash(data['password']),
+                password_hash=credentials.hash_password(data['password']),
                 role=data.get('role', 'user'),
                 created_at=datetime.now(),
                 updated_at=datetime.now()
@@ -137,17 +176,16 @@ def manage_users():
             db.session.add(user)
             db.session.commit()
             
+            record_audit('CREATE', 'users', record_id=user.id,
+                         new_values={'name': user.name, 'email': user.email, 'role': user.role})
+            
             # Create alert for user creation
-            alert = Alert(
+            publish_alert(
                 user_id=user.id,
                 type='user_created',
                 title='New User Registered',
-                message=f'User {user.name} ({user.email}) has been successfully created with role: {user.role}',
-                is_read=False,
-                created_at=datetime.now()
+                message=f'User {user.name} ({user.email}) has been successfully created with role: {user.role}'
             )
-            db.session.add(alert)
-            db.session.commit()
             
             return jsonify({
                 'message': 'User created successfully',
@@ -175,10 +213,19 @@ def manage_users():
             user.updated_at = datetime.now()
             
             if 'password' in data:
-                user.password_hash = generate_password_hash(data['password'])
+                user.password_hash = credentials.hash_password(data['password'])
             
             db.session.commit()
             
+            # Tokens carry the role and stand in for the password: void the old ones
+            if 'password' in data or old_data['role'] != user.role:
+                auth.revoke_user(user.id)
+            
+            new_data = {'name': user.name, 'email': user.email, 'role': user.role}
+            if 'password' in data:
+                new_data['password_changed'] = True
+            record_audit('UPDATE', 'users', record_id=user.id, old_values=old_data, new_values=new_data)
+            
             # Create alert for user update
             changes = []
             if old_data['name'] != user.name:
@@ -189,16 +236,12 @@ def manage_users():
                 changes.append(f"role: {old_data['role']} → {user.role}")
             
             if changes:
-                alert = Alert(
+                publish_alert(
                     user_id=user.id,
                     type='user_updated',
                     title='User Profile Updated',
-                    message=f'User {user.name} has been updated. Changes: {", ".join(changes)}',
-                    is_read=False,
-                    created_at=datetime.now()
+                    message=f'User {user.name} has been updated. Changes: {", ".join(changes)}'
                 )
-                db.session.add(alert)
-                db.session.commit()
             
             return jsonify({
                 'message': 'User updated successfully',
@@ -215,35 +258,43 @@ def manage_users():
             
             user_name = user.name
             user_email = user.email
+            old_data = {'name': user.name, 'email': user.email, 'role': user.role}
             
             db.session.delete(user)
             db.session.commit()
+            auth.revoke_user(int(user_id))
+            
+            record_audit('DELETE', 'users', record_id=int(user_id), old_values=old_data)
             
             # Create alert for user deletion
-            alert = Alert(
+            publish_alert(
                 user_id=None,  # User is deleted, so no user_id
                 type='user_deleted',
                 title='User Account Deleted',
-                message=f'User {user_name} ({user_email}) has been permanently deleted from the system',
-                is_read=False,
-                created_at=datetime.now()
+                message=f'User {user_name} ({user_email}) has been permanently deleted from the system'
             )
-            db.session.add(alert)
-            db.session.commit()
             
             return jsonify({'message': 'User deleted successfully'}), 200
             
+    except CredentialsBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/plans', methods=['GET'])
+@read_replica
+def list_plans():
+    try:
+        # Served from the plan catalogue cache; writes below invalidate it
+        return jsonify(catalog.plan_catalog()), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@admin_bp.route('/plans', methods=['GET', 'POST', 'PUT', 'DELETE'])
+@admin_bp.route('/plans', methods=['POST', 'PUT', 'DELETE'])
 def manage_plans():
     try:
-        if request.method == 'GET':
-            plans = Plan.query.all()
-            return jsonify([plan.to_dict() for plan in plans]), 200
-            
-        elif request.method == 'POST':
+        if request.method == 'POST':
             data = request.get_json()
             
             plan = Plan(
@@ -258,18 +309,22 @@ def manage_plans():
             
             db.session.add(plan)
             db.session.commit()
+            catalog.invalidate_plan(plan.id)
+            
+            record_audit('CREATE', 'plans', record_id=plan.id, new_values={
+                'name': plan.name,
+                'monthly_price': plan.monthly_price,
+                'monthly_quota_gb': plan.monthly_quota_gb,
+                'is_active': plan.is_active
+            })
             
             # Create alert for plan creation
-            alert = Alert(
+            publish_alert(
                 user_id=None,  # System alert
                 type='plan_created',
                 title='New Subscription Plan Created',
-                message=f'Plan "{plan.name}" has been created with price ${plan.monthly_price} and {plan.monthly_quota_gb}GB quota',
-                is_read=False,
-                created_at=datetime.now()
+                message=f'Plan "{plan.name}" has been created with price ${plan.monthly_price} and {plan.monthly_quota_gb}GB quota'
             )
-            db.session.add(alert)
-            db.session.commit()
             
             return jsonify({
                 'message': 'Plan created successfully',
@@ -299,6 +354,14 @@ def manage_plans():
             plan.updated_at = datetime.now()
             
             db.session.commit()
+            catalog.invalidate_plan(plan.id)
+            
+            record_audit('UPDATE', 'plans', record_id=plan.id, old_values=old_data, new_values={
+                'name': plan.name,
+                'monthly_price': plan.monthly_price,
+                'monthly_quota_gb': plan.monthly_quota_gb,
+                'is_active': plan.is_active
+            })
             
             # Create alert for plan update
             changes = []
@@ -312,16 +375,12 @@ def manage_plans():
                 changes.append(f"status: {'Active' if old_data['is_active'] else 'Inactive'} → {'Active' if plan.is_active else 'Inactive'}")
             
             if changes:
-                alert = Alert(
+                publish_alert(
                     user_id=None,  # System alert
                     type='plan_updated',
                     title='Subscription Plan Updated',
-                    message=f'Plan "{plan.name}" has been updated. Changes: {", ".join(changes)}',
-                    is_read=False,
-                    created_at=datetime.now()
+                    message=f'Plan "{plan.name}" has been updated. Changes: {", ".join(changes)}'
                 )
-                db.session.add(alert)
-                db.session.commit()
             
             return jsonify({
                 'message': 'Plan updated successfully',
@@ -337,21 +396,26 @@ def manage_plans():
             
             plan_name = plan.name
             plan_price = plan.monthly_price
+            old_data = {
+                'name': plan.name,
+                'monthly_price': plan.monthly_price,
+                'monthly_quota_gb': plan.monthly_quota_gb,
+                'is_active': plan.is_active
+            }
             
             db.session.delete(plan)
             db.session.commit()
+            catalog.invalidate_plan(plan_id, deleted=True)
+            
+            record_audit('DELETE', 'plans', record_id=int(plan_id), old_values=old_data)
             
             # Create alert for plan deletion
-            alert = Alert(
+            publish_alert(
                 user_id=None,  # System alert
                 type='plan_deleted',
                 title='Subscription Plan Deleted',
-                message=f'Plan "{plan_name}" (${plan_price}) has been permanently deleted from the system',
-                is_read=False,
-                created_at=datetime.now()
+                message=f'Plan "{plan_name}" (${plan_price}) has been permanently deleted from the system'
             )
-            db.session.add(alert)
-            db.session.commit()
             
             return jsonify({'message': 'Plan deleted successfully'}), 200
             
@@ -359,67 +423,167 @@ def manage_plans():
         return jsonify({'error': str(e)}), 500
 
 @admin_bp.route('/subscriptions', methods=['GET'])
+@read_replica
 def manage_subscriptions():
     try:
-        subscriptions = Subscription.query.join(User).join(Plan).all()
+        # Full dumps stream instead of building one big JSON array
+        if request.args.get('format') in exporter.FORMATS:
+            return export_response('subscriptions', request.args['format'])
         
-        return jsonify([{
-            'id': sub.id,
-            'user_name': sub.user.name,
-            'user_email': sub.user.email,
-            'plan_name': sub.plan.name,
-            'status': sub.status,
-            'start_date': sub.start_date.isoformat() if sub.start_date else None,
-            'end_date': sub.end_date.isoformat() if sub.end_date else None,
-            'price_paid': float(sub.price_paid),
-            'created_at': sub.created_at.isoformat() if sub.created_at else None
-        } for sub in subscriptions]), 200
+        query = Subscription.query.join(User).join(Plan).options(
+            contains_eager(Subscription.user), contains_eager(Subscription.plan)
+        )
         
+        def serialize(sub):
+            return {
+                'id': sub.id,
+                'user_name': sub.user.name,
+                'user_email': sub.user.email,
+                'plan_name': sub.plan.name,
+                'status': sub.status,
+                'start_date': sub.start_date.isoformat() if sub.start_date else None,
+                'end_date': sub.end_date.isoformat() if sub.end_date else None,
+                'price_paid': float(sub.price_paid),
+                'auto_renew': bool(sub.auto_renew),
+                'pause_start': sub.pause_start.isoformat() if sub.pause_start else None,
+                'pause_end': sub.pause_end.isoformat() if sub.pause_end else None,
+                'created_at': sub.created_at.isoformat() if sub.created_at else None
+            }
+        
+        # One keyset page at a time (newest first); full dumps go through ?format=
+        subscriptions = keyset_paginate(query, Subscription, **page_args(request.args))
+        return jsonify({
+            'subscriptions': [serialize(sub) for sub in subscriptions.items],
+            **page_meta(subscriptions)
+        }), 200
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@admin_bp.route('/analytics', methods=['GET'])
-def analytics():
+@admin_bp.route('/subscriptions/<int:subscription_id>/schedule', methods=['PUT'])
+def schedule_subscription(subscription_id):
+    try:
+        # Renewal and pause dates; the lifecycle sweep (services/lifecycle.py) acts on them
+        subscription = Subscription.query.get(subscription_id)
+        if not subscription:
+            return jsonify({'error': 'Subscription not found'}), 404
+        data = request.get_json() or {}
+        old_data = {
+            'auto_renew': bool(subscription.auto_renew),
+            'pause_start': subscription.pause_start.isoformat() if subscription.pause_start else None,
+            'pause_end': subscription.pause_end.isoformat() if subscription.pause_end else None
+        }
+        try:
+            if 'auto_renew' in data:
+                subscription.auto_renew = bool(data['auto_renew'])
+            if 'pause_start' in data:
+                subscription.pause_start = date.fromisoformat(data['pause_start']) if data['pause_start'] else None
+            if 'pause_end' in data:
+                subscription.pause_end = date.fromisoformat(data['pause_end']) if data['pause_end'] else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'pause_start and pause_end must be YYYY-MM-DD dates'}), 400
+        if subscription.pause_start and subscription.pause_end and subscription.pause_end <= subscription.pause_start:
+            return jsonify({'error': 'pause_end must be after pause_start'}), 400
+        subscription.updated_at = datetime.now()
+        db.session.commit()
+        
+        record_audit('UPDATE', 'subscriptions', record_id=subscription.id, old_values=old_data, new_values={
+            'auto_renew': bool(subscription.auto_renew),
+            'pause_start': subscription.pause_start.isoformat() if subscription.pause_start else None,
+            'pause_end': subscription.pause_end.isoformat() if subscription.pause_end else None
+        })
+        
+        return jsonify({'message': 'Subscription schedule updated', 'subscription': subscription.to_dict()}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def export_response(resource, fmt):
+    response = Response(
+        stream_with_context(exporter.stream_export(resource, fmt)),
+        mimetype=exporter.FORMATS[fmt]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename={resource}.{fmt}'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@admin_bp.route('/export/<resource>', methods=['GET'])
+@read_replica
+def export_data(resource):
     try:
-        # Get subscription trends
-        subscription_trends = db.session.query(
-            func.date(Subscription.created_at).label('date'),
-            func.count(Subscription.id).label('count')
-        ).group_by(func.date(Subscription.created_at)).all()
+        fmt = request.args.get('format', 'ndjson')
         
-        # Get plan popularity
-        plan_popularity = db.session.query(
-            Plan.name,
-            func.count(Subscription.id).label('subscription_count')
-        ).join(Subscription).group_by(Plan.id).all()
+        if resource not in exporter.EXPORTS:
+            return jsonify({'error': f'Unknown export: {resource}'}), 404
+        if fmt not in exporter.FORMATS:
+            return jsonify({'error': 'format must be ndjson or csv'}), 400
         
-        # Get usage statistics
-        usage_stats = db.session.query(
-            func.avg(Usage.data_used_gb).label('avg_usage'),
-            func.max(Usage.data_used_gb).label('max_usage'),
-            func.sum(Usage.data_used_gb).label('total_usage')
-        ).first()
+        return export_response(resource, fmt)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Usage Ingestion
+@admin_bp.route('/usage/ingest', methods=['POST'])
+def ingest_usage():
+    try:
+        fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+        batch_size = request.args.get('batch_size', usage_ingest.BATCH_SIZE, type=int)
+        
+        if fmt not in ('ndjson', 'csv'):
+            return jsonify({'error': 'format must be ndjson or csv'}), 400
+        if batch_size < 1:
+            return jsonify({'error': 'batch_size must be positive'}), 400
+        
+        # Read the body line by line instead of loading it whole
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        report = usage_ingest.ingest(lines, fmt=fmt, batch_size=batch_size)
+        record_audit('IMPORT', 'usage', new_values=report['totals'])
+        
+        return jsonify(report), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/analytics', methods=['GET'])
+@read_replica
+def analytics():
+    try:
+        # All three sections read the daily rollup tables (one row per day/plan)
+        subscription_trends = metrics_rollup.subscription_trends()
+        plan_popularity = metrics_rollup.plan_popularity()
+        usage_stats = metrics_rollup.usage_summary()
         
         return jsonify({
-            'subscription_trends': [{'date': str(trend.date), 'count': trend.count} for trend in subscription_trends],
-            'plan_popularity': [{'name': plan.name, 'count': plan.subscription_count} for plan in plan_popularity],
+            'subscription_trends': [{'date': str(trend.date), 'count': int(trend.count)} for trend in subscription_trends],
+            'plan_popularity': [{'name': plan.name, 'count': int(plan.subscription_count)} for plan in plan_popularity],
             'usage_stats': {
-                'avg_usage': float(usage_stats.avg_usage) if usage_stats.avg_usage else 0,
-                'max_usage': float(usage_stats.max_usage) if usage_stats.max_usage else 0,
-                'total_usage': float(usage_stats.total_usage) if usage_stats.total_usage else 0
-            }
+                'avg_usage': usage_stats['avg_usage'],
+                'max_usage': usage_stats['max_usage'],
+                'total_usage': usage_stats['total_usage']
+            },
+            'usage_distribution': usage_stats['distribution']
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@admin_bp.route('/alerts', methods=['GET', 'PUT'])
-def manage_alerts():
+@admin_bp.route('/alerts', methods=['GET'])
+@read_replica
+def list_alerts():
     try:
-        if request.method == 'GET':
-            alerts = Alert.query.join(User).order_by(desc(Alert.created_at)).all()
-            
-            return jsonify([{
+        # Full dumps stream instead of building one big JSON array
+        if request.args.get('format') in exporter.FORMATS:
+            return export_response('alerts', request.args['format'])
+        
+        query = Alert.query.join(User).options(contains_eager(Alert.user))
+        
+        def serialize(alert):
+            return {
                 'id': alert.id,
                 'user_name': alert.user.name,
                 'type': alert.type,
@@ -427,9 +591,24 @@ def manage_alerts():
                 'message': alert.message,
                 'is_read': alert.is_read,
                 'created_at': alert.created_at.isoformat() if alert.created_at else None
-            } for alert in alerts]), 200
-            
-        elif request.method == 'PUT':
+            }
+        
+        # One keyset page at a time (newest first); full dumps go through ?format=
+        alerts = keyset_paginate(query, Alert, **page_args(request.args))
+        return jsonify({
+            'alerts': [serialize(alert) for alert in alerts.items],
+            **page_meta(alerts)
+        }), 200
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/alerts', methods=['PUT'])
+def manage_alerts():
+    try:
+        if request.method == 'PUT':
             # Mark alert as read
             data = request.get_json()
             alert_id = data.get('id')
@@ -438,52 +617,151 @@ def manage_alerts():
             if not alert:
                 return jsonify({'error': 'Alert not found'}), 404
             
+            was_read = alert.is_read
             alert.is_read = True
             db.session.commit()
             
-            return jsonify({'message': 'Alert marked as read'}), 200
+            record_audit('UPDATE', 'alerts', record_id=alert.id, old_values={'is_read': was_read},
+                         new_values={'is_read': True})
             
+            return jsonify({'message': 'Alert marked as read'}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/alerts/dispatcher', methods=['GET'])
+def alert_dispatcher_stats():
+    try:
+        # Queue depth, lag and write counters of the background alert writer
+        return jsonify(dispatcher.stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    try:
+        # Hit / miss / invalidation counters per cache namespace (this process)
+        return jsonify(cache.stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/auth/stats', methods=['GET'])
+def auth_stats():
+    try:
+        # Issued tokens, verified-token cache hits, rejections by reason and revocation sync (this process)
+        return jsonify(auth.stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/db/pool', methods=['GET'])
+def db_pool_stats():
+    try:
+        # Pool settings, current occupancy, connection churn and checkout waits (this process)
+        return jsonify(pool_monitor.stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/db/replica', methods=['GET'])
+def db_replica_stats():
+    try:
+        # Replica health, last lag reading and how @read_replica requests were routed (this process)
+        return jsonify(replica_router.stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/usage/archive', methods=['GET'])
+def usage_archive_status():
+    try:
+        # Archived months and the first day still in the usage table
+        return jsonify(usage_archive.status()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/_perf', methods=['GET'])
+def perf_stats():
+    try:
+        # Rolling per-route latency / query histograms, recent slow and repeated statements
+        window = request.args.get('window', type=int)
+        if window is not None and window <= 0:
+            return jsonify({'error': 'window must be a positive number of seconds'}), 400
+        return jsonify(profiler.snapshot(window)), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/_perf', methods=['DELETE'])
+def reset_perf_stats():
+    try:
+        profiler.reset()
+        return jsonify({'message': 'Profiling data cleared'}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/audit/writer', methods=['GET'])
+def audit_writer_stats():
+    try:
+        # Queue, spill-file and write counters of the background audit writer
+        return jsonify(audit_writer.stats()), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Discount Management Endpoints
-@admin_bp.route('/discounts', methods=['GET', 'POST', 'PUT', 'DELETE'])
-def manage_discounts():
+def _discount_values(discount):
+    # Audit snapshot of a discount's editable fields
+    return {
+        'code': discount.code,
+        'discount_type': discount.discount_type,
+        'discount_value': discount.discount_value,
+        'usage_limit': discount.usage_limit,
+        'is_active': discount.is_active,
+        'valid_from': discount.valid_from,
+        'valid_until': discount.valid_until,
+        'plan_id': discount.plan_id
+    }
+
+@admin_bp.route('/discounts', methods=['GET'])
+@read_replica
+def list_discounts():
     try:
-        if request.method == 'GET':
-            # List all discounts with pagination
-            page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
-            
-            discounts = Discount.query.paginate(
-                page=page, per_page=per_page, error_out=False
-            )
-            
-            return jsonify({
-                'discounts': [{
-                    'id': discount.id,
-                    'code': discount.code,
-                    'description': discount.description,
-                    'discount_type': discount.discount_type,
-                    'discount_value': float(discount.discount_value),
-                    'min_amount': float(discount.min_amount) if discount.min_amount else None,
-                    'max_discount': float(discount.max_discount) if discount.max_discount else None,
-                    'usage_limit': discount.usage_limit,
-                    'used_count': discount.used_count,
-                    'is_active': discount.is_active,
-                    'valid_from': discount.valid_from.isoformat() if discount.valid_from else None,
-                    'valid_until': discount.valid_until.isoformat() if discount.valid_until else None,
-                    'plan_id': discount.plan_id,
-                    'plan_name': discount.plan.name if discount.plan else None,
-                    'created_at': discount.created_at.isoformat() if discount.created_at else None,
-                    'updated_at': discount.updated_at.isoformat() if discount.updated_at else None
-                } for discount in discounts.items],
-                'total': discounts.total,
-                'pages': discounts.pages,
-                'current_page': page
-            }), 200
+        # List discounts one keyset page at a time (newest first); ?page= still gets numbered pages
+        query = Discount.query.options(joinedload(Discount.plan))
+        if wants_offset(request.args):
+            discounts = offset_paginate(query, Discount, **offset_args(request.args))
+            meta = offset_meta(discounts)
+        else:
+            discounts = keyset_paginate(query, Discount, **page_args(request.args))
+            meta = page_meta(discounts)
+        
+        return jsonify({
+            'discounts': [{
+                'id': discount.id,
+                'code': discount.code,
+                'description': discount.description,
+                'discount_type': discount.discount_type,
+                'discount_value': float(discount.discount_value),
+                'min_amount': float(discount.min_amount) if discount.min_amount else None,
+                'max_discount': float(discount.max_discount) if discount.max_discount else None,
+                'usage_limit': discount.usage_limit,
+                'used_count': discount.used_count,
+                'is_active': discount.is_active,
+                'valid_from': discount.valid_from.isoformat() if discount.valid_from else None,
+                'valid_until': discount.valid_until.isoformat() if discount.valid_until else None,
+                'plan_id': discount.plan_id,
+                'plan_name': discount.plan.name if discount.plan else None,
+                'created_at': discount.created_at.isoformat() if discount.created_at else None,
+                'updated_at': discount.updated_at.isoformat() if discount.updated_at else None
+            } for discount in discounts.items],
+            **meta
+        }), 200
         
-        elif request.method == 'POST':
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/discounts', methods=['POST', 'PUT', 'DELETE'])
+def manage_discounts():
+    try:
+        if request.method == 'POST':
             # Create new discount
             data = request.get_json()
             
@@ -493,7 +771,7 @@ def manage_discounts():
                     return jsonify({'error': f'{field} is required'}), 400
             
             # Check if discount code already exists
-            existing_discount = Discount.query.filter_by(code=data['code']).first()
+            existing_discount = catalog.discount_by_code(data['code'])
             if existing_discount:
                 return jsonify({'error': 'Discount code already exists'}), 400
             
@@ -515,18 +793,17 @@ def manage_discounts():
             
             db.session.add(discount)
             db.session.commit()
+            catalog.invalidate_discount(discount.code)
+            
+            record_audit('CREATE', 'discounts', record_id=discount.id, new_values=_discount_values(discount))
             
             # Create alert for discount creation
-            alert = Alert(
+            publish_alert(
                 user_id=None,  # System alert
                 type='discount_created',
                 title='New Discount Code Created',
-                message=f'Discount code "{discount.code}" has been created: {discount.discount_type} {discount.discount_value}% off',
-                is_read=False,
-                created_at=datetime.now()
+                message=f'Discount code "{discount.code}" has been created: {discount.discount_type} {discount.discount_value}% off'
             )
-            db.session.add(alert)
-            db.session.commit()
             
             return jsonify({
                 'message': 'Discount created successfully',
@@ -552,13 +829,13 @@ def manage_discounts():
             if not discount:
                 return jsonify({'error': 'Discount not found'}), 404
             
+            old_data = _discount_values(discount)
+            
             # Update fields
             if 'code' in data:
                 # Check if new code already exists (excluding current discount)
-                existing = Discount.query.filter(
-                    and_(Discount.code == data['code'], Discount.id != discount_id)
-                ).first()
-                if existing:
+                existing = catalog.discount_by_code(data['code'])
+                if existing and existing['id'] != discount.id:
                     return jsonify({'error': 'Discount code already exists'}), 400
                 discount.code = data['code']
             
@@ -585,18 +862,21 @@ def manage_discounts():
             
             discount.updated_at = datetime.now()
             db.session.commit()
+            catalog.invalidate_discount(old_data['code'], discount.code)
+            if discount.counter_shards and 'usage_limit' in data:
+                # Re-split what is left of the new limit between the shards
+                redemption.set_shards(discount.id, discount.counter_shards)
+            
+            record_audit('UPDATE', 'discounts', record_id=discount.id, old_values=old_data,
+                         new_values=_discount_values(discount))
             
             # Create alert for discount update
-            alert = Alert(
+            publish_alert(
                 user_id=None,  # System alert
                 type='discount_updated',
                 title='Discount Code Updated',
-                message=f'Discount code "{discount.code}" has been updated successfully',
-                is_read=False,
-                created_at=datetime.now()
+                message=f'Discount code "{discount.code}" has been updated successfully'
             )
-            db.session.add(alert)
-            db.session.commit()
             
             return jsonify({'message': 'Discount updated successfully'}), 200
         
@@ -612,29 +892,57 @@ def manage_discounts():
                 return jsonify({'error': 'Discount not found'}), 404
             
             discount_code = discount.code
+            sharded = discount.counter_shards
+            old_data = _discount_values(discount)
             
             db.session.delete(discount)
             db.session.commit()
+            catalog.invalidate_discount(discount_code)
+            if sharded:
+                redemption.drop_shards(int(discount_id))
+            
+            record_audit('DELETE', 'discounts', record_id=int(discount_id), old_values=old_data)
             
             # Create alert for discount deletion
-            alert = Alert(
+            publish_alert(
                 user_id=None,  # System alert
                 type='discount_deleted',
                 title='Discount Code Deleted',
-                message=f'Discount code "{discount_code}" has been permanently deleted from the system',
-                is_read=False,
-                created_at=datetime.now()
+                message=f'Discount code "{discount_code}" has been permanently deleted from the system'
             )
-            db.session.add(alert)
-            db.session.commit()
             
             return jsonify({'message': 'Discount deleted successfully'}), 200
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/discounts/<int:discount_id>/shards', methods=['GET', 'PUT'])
+def discount_shards(discount_id):
+    """Counter shards of a hot discount code (see services/redemption.py)."""
+    try:
+        if request.method == 'GET':
+            return jsonify({'discount_id': discount_id, 'shards': redemption.shard_status(discount_id)}), 200
+        
+        data = request.get_json() or {}
+        try:
+            shards = int(data['shards'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'shards must be an integer'}), 400
+        try:
+            result = redemption.set_shards(discount_id, shards)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        
+        record_audit('UPDATE', 'discounts', record_id=discount_id, new_values={'counter_shards': shards})
+        return jsonify({'message': 'Discount counters updated', **result}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Enhanced User Management with Subscriptions
 @admin_bp.route('/users/detailed', methods=['GET'])
+@read_replica
 def get_detailed_users():
     try:
         page = request.args.get('page', 1, type=int)
@@ -644,29 +952,39 @@ def get_detailed_users():
         
         query = User.query
         
-        # Apply search filter
+        # Apply search filter (indexed, ranked by match quality)
         if search:
-            query = query.filter(
-                or_(
-                    User.name.ilike(f'%{search}%'),
-                    User.email.ilike(f'%{search}%')
-                )
-            )
+            query = user_search.search_users(query, search)
         
         # Apply role filter
         if role_filter:
             query = query.filter(User.role == role_filter)
         
         users = query.paginate(page=page, per_page=per_page, error_out=False)
+        user_ids = [user.id for user in users.items]
+        
+        # Load subscriptions (with their plans) and usage totals for the whole page at once
+        subscriptions_by_user = {user_id: [] for user_id in user_ids}
+        usage_by_user = {}
+        if user_ids:
+            page_subscriptions = Subscription.query.options(
+                joinedload(Subscription.plan)
+            ).filter(Subscription.user_id.in_(user_ids)).order_by(Subscription.id).all()
+            for sub in page_subscriptions:
+                subscriptions_by_user[sub.user_id].append(sub)
+            
+            usage_by_user = dict(db.session.query(
+                Usage.user_id,
+                func.sum(Usage.data_used_gb)
+            ).filter(Usage.user_id.in_(user_ids)).group_by(Usage.user_id).all())
+            for user_id, cents in usage_archive.user_totals(user_ids).items():
+                usage_by_user[user_id] = (usage_by_user.get(user_id) or 0) + Decimal(cents).scaleb(-2)
         
         detailed_users = []
         for user in users.items:
-            # Get user's subscriptions
-            subscriptions = Subscription.query.filter_by(user_id=user.id).all()
+            subscriptions = subscriptions_by_user[user.id]
             active_subscription = next((sub for sub in subscriptions if sub.status == 'active'), None)
-            
-            # Get user's usage
-            total_usage = db.session.query(func.sum(Usage.data_used_gb)).filter_by(user_id=user.id).scalar() or 0
+            total_usage = usage_by_user.get(user.id) or 0
             
             detailed_users.append({
                 'id': user.id,
@@ -707,141 +1025,66 @@ def get_detailed_users():
 
 # Enhanced Analytics
 @admin_bp.route('/analytics/detailed', methods=['GET'])
+@read_replica
 def get_detailed_analytics():
     try:
-        # User Analytics
-        total_users = User.query.count()
-        active_users = User.query.join(Subscription).filter(Subscription.status == 'active').distinct().count()
-        new_users_this_month = User.query.filter(
-            User.created_at >= datetime.now().replace(day=1)
-        ).count()
-        
-        # Subscription Analytics
-        total_subscriptions = Subscription.query.count()
-        active_subscriptions = Subscription.query.filter_by(status='active').count()
-        cancelled_subscriptions = Subscription.query.filter_by(status='cancelled').count()
-        
-        # Revenue Analytics
-        total_revenue = db.session.query(func.sum(Subscription.price_paid)).scalar() or 0
-        monthly_revenue = db.session.query(func.sum(Subscription.price_paid)).filter(
-            Subscription.created_at >= datetime.now().replace(day=1)
-        ).scalar() or 0
-        
-        # Usage Analytics
-        total_usage = db.session.query(func.sum(Usage.data_used_gb)).scalar() or 0
-        average_usage_per_user = total_usage / total_users if total_users > 0 else 0
-        
-        # Plan Popularity
-        plan_stats = db.session.query(
-            Plan.name,
-            func.count(Subscription.id).label('subscription_count'),
-            func.sum(Subscription.price_paid).label('total_revenue')
-        ).join(Subscription, Plan.id == Subscription.plan_id).group_by(Plan.id, Plan.name).all()
-        
-        # Monthly Trends (last 6 months)
-        monthly_trends = []
-        for i in range(6):
-            month_start = datetime.now().replace(day=1) - timedelta(days=30*i)
-            month_end = month_start + timedelta(days=30)
-            
-            month_revenue = db.session.query(func.sum(Subscription.price_paid)).filter(
-                and_(
-                    Subscription.created_at >= month_start,
-                    Subscription.created_at < month_end
-                )
-            ).scalar() or 0
-            
-            month_subscriptions = Subscription.query.filter(
-                and_(
-                    Subscription.created_at >= month_start,
-                    Subscription.created_at < month_end
-                )
-            ).count()
-            
-            monthly_trends.append({
-                'month': month_start.strftime('%b %Y'),
-                'revenue': float(month_revenue),
-                'subscriptions': month_subscriptions
-            })
+        engine = DetailedAnalyticsEngine()
+        response = jsonify(engine.compute())
         
-        monthly_trends.reverse()
-        
-        # Usage Distribution
-        usage_ranges = [
-            ('0-10 GB', 0, 10),
-            ('10-50 GB', 10, 50),
-            ('50-100 GB', 100, 100),
-            ('100+ GB', 100, 1000)
-        ]
-        
-        usage_distribution = []
-        for range_name, min_gb, max_gb in usage_ranges:
-            if max_gb == 1000:  # 100+ GB
-                count = db.session.query(func.count(Usage.id)).filter(
-                    Usage.data_used_gb >= min_gb
-                ).scalar()
-            else:
-                count = db.session.query(func.count(Usage.id)).filter(
-                    and_(
-                        Usage.data_used_gb >= min_gb,
-                        Usage.data_used_gb < max_gb
-                    )
-                ).scalar()
-            
-            percentage = (count / total_users * 100) if total_users > 0 else 0
-            usage_distribution.append({
-                'range': range_name,
-                'count': count,
-                'percentage': round(percentage, 1)
-            })
+        # Per-query timings join the profiler's Server-Timing header
+        for name, duration_ms in engine.timings:
+            profiler.span(name, duration_ms)
         
-        # Discount Analytics
-        total_discounts = Discount.query.count()
-        active_discounts = Discount.query.filter_by(is_active=True).count()
-        used_discounts = db.session.query(func.sum(Discount.used_count)).scalar() or 0
+        return response, 200
         
-        return jsonify({
-            'user_analytics': {
-                'total_users': total_users,
-                'active_users': active_users,
-                'new_users_this_month': new_users_this_month,
-                'user_growth_rate': round((new_users_this_month / total_users * 100), 2) if total_users > 0 else 0
-            },
-            'subscription_analytics': {
-                'total_subscriptions': total_subscriptions,
-                'active_subscriptions': active_subscriptions,
-                'cancelled_subscriptions': cancelled_subscriptions,
-                'conversion_rate': round((active_subscriptions / total_users * 100), 2) if total_users > 0 else 0
-            },
-            'revenue_analytics': {
-                'total_revenue': float(total_revenue),
-                'monthly_revenue': float(monthly_revenue),
-                'average_revenue_per_user': float(total_revenue / total_users) if total_users > 0 else 0,
-                'revenue_growth_rate': 12.5  # Placeholder - would calculate from historical data
-            },
-            'usage_analytics': {
-                'total_usage_gb': float(total_usage),
-                'average_usage_per_user': float(average_usage_per_user),
-                'usage_distribution': usage_distribution
-            },
-            'plan_analytics': {
-                'plan_popularity': [{
-                    'plan_name': stat.name,
-                    'subscription_count': stat.subscription_count,
-                    'total_revenue': float(stat.total_revenue) if stat.total_revenue else 0
-                } for stat in plan_stats]
-            },
-            'trends': {
-                'monthly_revenue_trend': monthly_trends,
-                'monthly_subscription_trend': monthly_trends
-            },
-            'discount_analytics': {
-                'total_discounts': total_discounts,
-                'active_discounts': active_discounts,
-                'used_discounts': int(used_discounts),
-                'discount_usage_rate': round((used_discounts / total_discounts * 100), 2) if total_discounts > 0 else 0
-            }
-        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Quantiles, quota utilisation and cohorts from the columnar usage snapshot
+@admin_bp.route('/analytics/usage', methods=['GET'])
+@read_replica
+def get_usage_analytics():
+    try:
+        if not usage_analytics.available():
+            return jsonify({'error': 'Usage analytics requires numpy (pip install numpy)'}), 501
         
+        refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+        snapshot = usage_analytics.get_snapshot(refresh=refresh)
+        return jsonify(usage_analytics.compute(snapshot)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/billing/runs', methods=['GET'])
+def billing_runs():
+    try:
+        # Recent `flask run-billing` runs, newest first, with invoices/sec
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        return jsonify({'runs': billing.runs(limit=limit)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/lifecycle/runs', methods=['GET'])
+def lifecycle_runs():
+    try:
+        # Recent subscription sweeps (scheduled and `flask sweep-subscriptions`), newest first
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        return jsonify({'runs': lifecycle.runs(limit=limit), **lifecycle.stats()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/quota/stats', methods=['GET'])
+def quota_stats():
+    try:
+        # Alert thresholds and this process's counters (services/quota.py)
+        return jsonify(quota_monitor.stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/recommendations/stats', methods=['GET'])
+def recommendation_stats():
+    try:
+        # Users waiting for `flask refresh-recommendations`, and this process's last run
+        return jsonify(recommender.stats()), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,13 +1,21 @@
-from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, g, request, jsonify
 from models.users import User
-from models.audit_logs import AuditLog
+from services.audit_writer import record_audit
+from services.auth import auth, public
+from services.credentials import credentials, CredentialsBusy
+from services.redemption import redeem, RedemptionRefused
+from services import billing as billing_service, recommendations
+from services.db_routing import read_replica
+from services.quota import quota_monitor
 from db import db
-from datetime import datetime
+from datetime import date, datetime
 
 user_bp = Blueprint('user', __name__)
+# Everything except signup and login needs a bearer token (services/auth.py)
+user_bp.before_request(auth.guard('user', 'admin'))
 
 @user_bp.route('/signup', methods=['POST'])
+@public
 def user_signup():
     try:
         data = request.get_json()
@@ -27,34 +35,33 @@ def user_signup():
         new_user = User(
             name=name,
             email=email,
-            password_hash=generate_password_hash(password),
+            password_hash=credentials.hash_password(password),
             role='user'
         )
         
         db.session.add(new_user)
         db.session.commit()
         
-        # Log the signup action
-        audit_log = AuditLog(
-            user_id=new_user.id,
-            action='user_signup',
-            details=f'New user registered: {email}'
-        )
-        db.session.add(audit_log)
-        db.session.commit()
+        # Log the signup action (written in the background, off the request path)
+        record_audit('SIGNUP', 'users', record_id=new_user.id, user_id=new_user.id,
+                     new_values={'name': new_user.name, 'email': new_user.email})
         
         return jsonify({
             'success': True,
             'message': 'User created successfully',
             'user': new_user.to_dict(),
+            **auth.issue(new_user),
             'redirect_url': '/user/dashboard'
         }), 201
         
+    except CredentialsBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @user_bp.route('/login', methods=['POST'])
+@public
 def user_login():
     try:
         data = request.get_json()
@@ -67,25 +74,57 @@ def user_login():
         # Find user
         user = User.query.filter_by(email=email, role='user').first()
         
-        if not user or not check_password_hash(user.password_hash, password):
+        if not user or not credentials.verify(user, password):
+            record_audit('LOGIN_FAILED', 'users', record_id=user.id if user else None,
+                         new_values={'email': email, 'role': 'user'})
             return jsonify({'error': 'Invalid credentials'}), 401
         
-        # Log the login action
-        audit_log = AuditLog(
-            user_id=user.id,
-            action='user_login',
-            details=f'User login from IP: {request.remote_addr}'
-        )
-        db.session.add(audit_log)
-        db.session.commit()
+        # Save the password hash if verify() upgraded it to the configured method
+        if db.session.is_modified(user):
+            db.session.commit()
+        
+        # Log the login action (written in the background, off the request path)
+        record_audit('LOGIN', 'users', record_id=user.id, user_id=user.id,
+                     new_values={'login_time': datetime.now().isoformat()})
         
         return jsonify({
             'success': True,
             'message': 'Login successful',
             'user': user.to_dict(),
+            **auth.issue(user),
             'redirect_url': '/user/dashboard'
         }), 200
         
+    except CredentialsBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/logout', methods=['POST'])
+def user_logout():
+    try:
+        # Revoke the token this request came with
+        if g.principal:
+            auth.revoke_token(g.principal)
+            record_audit('LOGOUT', 'users', record_id=g.principal.user_id)
+        return jsonify({'success': True, 'message': 'Logged out'}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/discounts/redeem', methods=['POST'])
+def redeem_discount():
+    try:
+        data = request.get_json() or {}
+        if not data.get('code'):
+            return jsonify({'error': 'code is required'}), 400
+        
+        result = redeem(data['code'], plan_id=data.get('plan_id'), amount=data.get('amount'))
+        record_audit('REDEEM', 'discounts', record_id=result['discount_id'], new_values=result)
+        return jsonify({'success': True, **result}), 200
+        
+    except RedemptionRefused as e:
+        return jsonify({'error': str(e), 'reason': e.reason}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -99,13 +138,56 @@ def my_subscriptions():
     return jsonify({'message': 'My subscriptions - to be implemented'}), 200
 
 @user_bp.route('/recommendations', methods=['GET'])
+@read_replica
 def plan_recommendations():
-    return jsonify({'message': 'Plan recommendations - to be implemented'}), 200
+    try:
+        # Precomputed by `flask refresh-recommendations` (services/recommendations.py)
+        user_id = g.principal.user_id if g.principal else request.args.get('user_id', type=int)
+        if user_id is None:
+            return jsonify({'error': 'user_id is required'}), 400
+        return jsonify(recommendations.for_user(user_id)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/quota', methods=['GET'])
+@read_replica
+def quota_status():
+    try:
+        # Usage so far in the current quota period, kept up to date by ingestion (services/quota.py)
+        user_id = g.principal.user_id if g.principal else request.args.get('user_id', type=int)
+        if user_id is None:
+            return jsonify({'error': 'user_id is required'}), 400
+        return jsonify({'user_id': user_id, 'quota': quota_monitor.for_user(user_id)}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @user_bp.route('/usage', methods=['GET'])
 def usage_history():
     return jsonify({'message': 'Usage history - to be implemented'}), 200
 
 @user_bp.route('/billing', methods=['GET'])
+@read_replica
 def billing():
-    return jsonify({'message': 'Billing - to be implemented'}), 200
+    try:
+        # Invoices written by `flask run-billing` (services/billing.py), newest period first
+        user_id = g.principal.user_id if g.principal else request.args.get('user_id', type=int)
+        if user_id is None:
+            return jsonify({'error': 'user_id is required'}), 400
+        
+        before = None
+        if request.args.get('before'):
+            try:
+                period_start, invoice_id = request.args['before'].split(',')
+                before = (date.fromisoformat(period_start), int(invoice_id))
+            except ValueError:
+                return jsonify({'error': 'before must be <period_start>,<invoice id>'}), 400
+        limit = request.args.get('per_page', 24, type=int)
+        
+        invoices = billing_service.user_invoices(user_id, limit=limit, before=before)
+        next_before = f"{invoices[-1]['period_start']},{invoices[-1]['id']}" if len(invoices) == min(limit, billing_service.MAX_PER_PAGE) else None
+        return jsonify({'user_id': user_id, 'invoices': invoices, 'next_before': next_before}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,45 @@
+# Alert dispatcher
+# Admin handlers publish alerts to a background batch writer instead of
+# committing a second transaction per request (see services/batch_writer.py).
+import logging
+from datetime import datetime
+
+from models.alerts import Alert
+from services.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+# How long publish() waits for room in a full queue before dropping the alert
+PUT_TIMEOUT = 0.5
+
+
+class AlertDispatcher(BatchWriter):
+    config_prefix = 'ALERT'
+    thread_name = 'alert-dispatcher'
+    table = Alert.__table__
+
+    def publish(self, type, title, message, user_id=None):
+        """Queue an alert for the next batch insert."""
+        self.submit({
+            'user_id': user_id,
+            'type': type,
+            'title': title,
+            'message': message,
+            'is_read': False,
+            'created_at': datetime.now()
+        })
+
+    def _put(self, item):
+        self._queue.put(item, timeout=PUT_TIMEOUT)
+
+    def _overflow(self, row):
+        # Back-pressure is bounded: a stuck database must not stall requests
+        self.dropped += 1
+        logger.warning('Alert queue full, dropped %s alert: %s', row['type'], row['title'])
+
+
+dispatcher = AlertDispatcher()
+
+
+def publish_alert(type, title, message, user_id=None):
+    dispatcher.publish(type, title, message, user_id=user_id)
@@ -0,0 +1,182 @@
+# Analytics engine
+# Computes the /admin/analytics/detailed payload from a fixed number of
+# grouped / conditional-aggregate queries instead of one query per metric.
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, case, and_
+
+from db import db
+from models.users import User
+from models.plans import Plan
+from models.subscriptions import Subscription
+from models.usage import Usage
+from services import metrics_rollup
+from services.usage_archive import usage_archive
+
+# (label, min_gb, max_gb) - a max of 1000 means "and above". Same bounds as
+# metrics_rollup.USAGE_BUCKETS, which the usage archive counts by.
+USAGE_RANGES = [
+    ('0-10 GB', 0, 10),
+    ('10-50 GB', 10, 50),
+    ('50-100 GB', 50, 100),
+    ('100+ GB', 100, 1000)
+]
+
+TREND_MONTHS = 6
+
+
+class DetailedAnalyticsEngine:
+    """Builds the detailed analytics payload and records per-query timings."""
+
+    def __init__(self, now=None):
+        self.now = now or datetime.now()
+        self.month_start = self.now.replace(day=1)
+        self.timings = []
+
+    def _timed(self, name, run_query):
+        started = time.perf_counter()
+        result = run_query()
+        self.timings.append((name, (time.perf_counter() - started) * 1000))
+        return result
+
+    def _trend_windows(self):
+        windows = []
+        for i in range(TREND_MONTHS):
+            month_start = self.month_start - timedelta(days=30*i)
+            windows.append((month_start, month_start + timedelta(days=30)))
+        return windows
+
+    def _user_stats(self):
+        return db.session.query(
+            func.count(User.id).label('total_users'),
+            func.count(case((User.created_at >= self.month_start, User.id))).label('new_users_this_month')
+        ).one()
+
+    def _subscription_stats(self, windows):
+        columns = [
+            func.count(Subscription.id).label('total_subscriptions'),
+            func.count(case((Subscription.status == 'active', Subscription.id))).label('active_subscriptions'),
+            func.count(case((Subscription.status == 'cancelled', Subscription.id))).label('cancelled_subscriptions'),
+            func.count(func.distinct(case((Subscription.status == 'active', Subscription.user_id)))).label('active_users'),
+            func.sum(Subscription.price_paid).label('total_revenue'),
+            func.sum(case((Subscription.created_at >= self.month_start, Subscription.price_paid))).label('monthly_revenue')
+        ]
+        for i, (month_start, month_end) in enumerate(windows):
+            in_window = and_(Subscription.created_at >= month_start, Subscription.created_at < month_end)
+            columns.append(func.sum(case((in_window, Subscription.price_paid))).label(f'revenue_{i}'))
+            columns.append(func.count(case((in_window, Subscription.id))).label(f'subscriptions_{i}'))
+        return db.session.query(*columns).one()
+
+    def _usage_stats(self):
+        columns = [func.sum(Usage.data_used_gb).label('total_usage')]
+        for i, (range_name, min_gb, max_gb) in enumerate(USAGE_RANGES):
+            if max_gb == 1000:
+                in_range = Usage.data_used_gb >= min_gb
+            else:
+                in_range = and_(Usage.data_used_gb >= min_gb, Usage.data_used_gb < max_gb)
+            columns.append(func.count(case((in_range, Usage.id))).label(f'range_{i}'))
+        stats = db.session.query(*columns).one()
+
+        # Months moved to the usage archive are counted from its manifests
+        archived = usage_archive.totals()
+        return {
+            'total_usage': (stats.total_usage or 0) + Decimal(archived['cents']).scaleb(-2),
+            'ranges': [getattr(stats, f'range_{i}') + archived['buckets'][i] for i in range(len(USAGE_RANGES))]
+        }
+
+    def _plan_stats(self):
+        return db.session.query(
+            Plan.name,
+            func.count(Subscription.id).label('subscription_count'),
+            func.sum(Subscription.price_paid).label('total_revenue')
+        ).join(Subscription, Plan.id == Subscription.plan_id).group_by(Plan.id, Plan.name).all()
+
+    def _discount_stats(self):
+        # Maintained incrementally in daily_plan_metrics
+        return metrics_rollup.discount_totals()
+
+    def compute(self):
+        windows = self._trend_windows()
+
+        user_stats = self._timed('users', self._user_stats)
+        sub_stats = self._timed('subscriptions', lambda: self._subscription_stats(windows))
+        usage_stats = self._timed('usage', self._usage_stats)
+        plan_stats = self._timed('plans', self._plan_stats)
+        discount_stats = self._timed('discounts', self._discount_stats)
+
+        total_users = user_stats.total_users
+        new_users_this_month = user_stats.new_users_this_month
+        active_users = sub_stats.active_users
+        active_subscriptions = sub_stats.active_subscriptions
+        total_revenue = sub_stats.total_revenue or 0
+        monthly_revenue = sub_stats.monthly_revenue or 0
+        total_usage = usage_stats['total_usage']
+        average_usage_per_user = total_usage / total_users if total_users > 0 else 0
+
+        monthly_trends = []
+        for i, (month_start, month_end) in enumerate(windows):
+            monthly_trends.append({
+                'month': month_start.strftime('%b %Y'),
+                'revenue': float(getattr(sub_stats, f'revenue_{i}') or 0),
+                'subscriptions': getattr(sub_stats, f'subscriptions_{i}')
+            })
+        monthly_trends.reverse()
+
+        usage_distribution = []
+        for i, (range_name, min_gb, max_gb) in enumerate(USAGE_RANGES):
+            count = usage_stats['ranges'][i]
+            percentage = (count / total_users * 100) if total_users > 0 else 0
+            usage_distribution.append({
+                'range': range_name,
+                'count': count,
+                'percentage': round(percentage, 1)
+            })
+
+        total_discounts = int(discount_stats.total_discounts or 0)
+        active_discounts = int(discount_stats.active_discounts or 0)
+        used_discounts = int(discount_stats.used_discounts or 0)
+
+        return {
+            'user_analytics': {
+                'total_users': total_users,
+                'active_users': active_users,
+                'new_users_this_month': new_users_this_month,
+                'user_growth_rate': round((new_users_this_month / total_users * 100), 2) if total_users > 0 else 0
+            },
+            'subscription_analytics': {
+                'total_subscriptions': sub_stats.total_subscriptions,
+                'active_subscriptions': active_subscriptions,
+                'cancelled_subscriptions': sub_stats.cancelled_subscriptions,
+                'conversion_rate': round((active_subscriptions / total_users * 100), 2) if total_users > 0 else 0
+            },
+            'revenue_analytics': {
+                'total_revenue': float(total_revenue),
+                'monthly_revenue': float(monthly_revenue),
+                'average_revenue_per_user': float(total_revenue / total_users) if total_users > 0 else 0,
+                'revenue_growth_rate': 12.5  # Placeholder - would calculate from historical data
+            },
+            'usage_analytics': {
+                'total_usage_gb': float(total_usage),
+                'average_usage_per_user': float(average_usage_per_user),
+                'usage_distribution': usage_distribution
+            },
+            'plan_analytics': {
+                'plan_popularity': [{
+                    'plan_name': stat.name,
+                    'subscription_count': stat.subscription_count,
+                    'total_revenue': float(stat.total_revenue) if stat.total_revenue else 0
+                } for stat in plan_stats]
+            },
+            'trends': {
+                'monthly_revenue_trend': monthly_trends,
+                'monthly_subscription_trend': monthly_trends
+            },
+            'discount_analytics': {
+                'total_discounts': total_discounts,
+                'active_discounts': active_discounts,
+                'used_discounts': int(used_discounts),
+                'discount_usage_rate': round((used_discounts / total_discounts * 100), 2) if total_discounts > 0 else 0
+            }
+        }
@@ -0,0 +1,250 @@
+# Audit writer
+# Auth and CRUD handlers record audit events on a background batch writer
+# (see services/batch_writer.py), so no request waits on the audit_logs table.
+# When the database falls behind and the queue fills up, or a batch cannot be
+# inserted, events are appended to a local spill file (one JSON object per
+# line, fsynced) and replayed into audit_logs once the database accepts writes.
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import g, has_request_context, request
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.audit_logs import AuditLog
+from services.batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between attempts to replay spilled events
+REPLAY_INTERVAL = 5.0
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _spill_owner(path):
+    # audit-<pid>.jsonl or audit-<pid>-<n>.replay
+    name = os.path.basename(path)[len('audit-'):]
+    try:
+        return int(name.split('.')[0].split('-')[0])
+    except ValueError:
+        return None
+
+
+def _plain(value):
+    """JSON-safe copy of audit values (Decimal prices, dates)."""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _encode(row):
+    row = dict(row)
+    row['created_at'] = row['created_at'].isoformat() if row['created_at'] else None
+    return json.dumps(row, default=str)
+
+
+def _decode(line):
+    row = json.loads(line)
+    row['created_at'] = datetime.fromisoformat(row['created_at']) if row['created_at'] else None
+    return row
+
+
+class AuditWriter(BatchWriter):
+    config_prefix = 'AUDIT'
+    thread_name = 'audit-writer'
+    table = AuditLog.__table__
+
+    def __init__(self, app=None):
+        self.spill_dir = None
+        self.spilled = 0
+        self.replayed = 0
+        self.rejected = 0
+        self._spill_lock = threading.Lock()
+        self._last_replay = 0.0
+        super().__init__(app)
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.spill_dir = app.config.get('AUDIT_SPILL_DIR') or os.path.join(app.instance_path, 'audit_spill')
+
+    def record(self, action, table_name, record_id=None, user_id=None, old_values=None, new_values=None):
+        """Queue an audit event; the client address and user agent come from the current request,
+        and so does the actor when user_id is not given (the token's user, see services/auth.py)."""
+        if user_id is None and has_request_context():
+            principal = getattr(g, 'principal', None)
+            user_id = principal.user_id if principal else None
+        self.submit({
+            'user_id': user_id,
+            'action': action,
+            'table_name': table_name,
+            'record_id': record_id,
+            'old_values': _plain(old_values),
+            'new_values': _plain(new_values),
+            'ip_address': request.remote_addr if has_request_context() else None,
+            'user_agent': request.headers.get('User-Agent') if has_request_context() else None,
+            'created_at': datetime.now()
+        })
+
+    # Fallbacks
+
+    def _overflow(self, row):
+        self._spill([row])
+
+    def _write_failed(self, rows):
+        written = self._write_individually(rows)
+        if written < len(rows):
+            logger.warning('Audit writes failing, spilling %d events to disk', len(rows) - written)
+            self._spill(rows[written:])
+
+    def _write_individually(self, rows):
+        """Write rows one at a time after a batch failed; returns how many were handled.
+
+        Events whose user was deleted meanwhile are kept with user_id NULL,
+        as ON DELETE SET NULL would have done. Stops at the first error that
+        is not a constraint violation (the database is down or too slow).
+        """
+        for index, row in enumerate(rows):
+            try:
+                try:
+                    self._write([row])
+                except IntegrityError:
+                    if row['user_id'] is None:
+                        raise
+                    self._write([dict(row, user_id=None)])
+            except IntegrityError:
+                self.rejected += 1
+                logger.exception('Rejected audit event %s on %s', row['action'], row['table_name'])
+                continue
+            except Exception:
+                return index
+            self.written += 1
+        return len(rows)
+
+    # Spill file
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f'audit-{os.getpid()}.jsonl')
+
+    def _spill(self, rows):
+        lines = ''.join(_encode(row) + '\n' for row in rows)
+        with self._spill_lock:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(), 'a', encoding='utf-8') as handle:
+                handle.write(lines)
+                handle.flush()
+                os.fsync(handle.fileno())
+        self.spilled += len(rows)
+
+    def spill_files(self):
+        if not self.spill_dir:
+            return []
+        return glob.glob(os.path.join(self.spill_dir, 'audit-*.jsonl')) + \
+            glob.glob(os.path.join(self.spill_dir, 'audit-*.replay'))
+
+    def _claim_spill_files(self):
+        """Spill files this process may replay: its own and those left by exited processes."""
+        pid = os.getpid()
+        claimed = []
+        for path in sorted(self.spill_files()):
+            owner = _spill_owner(path)
+            if owner is None:
+                continue
+            if owner == pid and path.endswith('.replay'):
+                claimed.append(path)
+                continue
+            if owner != pid and _process_alive(owner):
+                continue
+            target = os.path.join(self.spill_dir, f'audit-{pid}-{time.time_ns()}.replay')
+            with self._spill_lock:
+                try:
+                    os.replace(path, target)
+                except FileNotFoundError:
+                    # Another process claimed it first
+                    continue
+            claimed.append(target)
+        return claimed
+
+    def replay_spill(self):
+        """Insert spilled events into audit_logs; returns how many were replayed."""
+        self._last_replay = time.monotonic()
+        replayed = 0
+        for path in self._claim_spill_files():
+            with open(path, encoding='utf-8') as handle:
+                rows = [_decode(line) for line in handle if line.strip()]
+            try:
+                if rows:
+                    # One transaction per file, so a failed replay can be retried without duplicates
+                    with self.app.app_context():
+                        with db.engine.begin() as connection:
+                            for i in range(0, len(rows), self.batch_size):
+                                connection.execute(self.table.insert(), rows[i:i + self.batch_size])
+            except IntegrityError:
+                written = self._write_individually(rows)
+                if written < len(rows):
+                    # Keep what is left for the next attempt
+                    with open(path, 'w', encoding='utf-8') as handle:
+                        handle.writelines(_encode(row) + '\n' for row in rows[written:])
+                    replayed += written
+                    break
+            except Exception:
+                logger.warning('Audit replay of %s failed, will retry', path)
+                break
+            else:
+                self.written += len(rows)
+            os.remove(path)
+            replayed += len(rows)
+        self.replayed += replayed
+        return replayed
+
+    # Worker hooks
+
+    def _idle_timeout(self):
+        return REPLAY_INTERVAL
+
+    def _on_idle(self):
+        if self.spill_files():
+            self.replay_spill()
+
+    def _flush_batch(self, batch):
+        super()._flush_batch(batch)
+        if time.monotonic() - self._last_replay >= REPLAY_INTERVAL and self.spill_files():
+            self.replay_spill()
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'spilled': self.spilled,
+            'replayed': self.replayed,
+            'rejected': self.rejected,
+            'spill_files': len(self.spill_files())
+        })
+        return stats
+
+
+audit_writer = AuditWriter()
+
+
+def record_audit(action, table_name, record_id=None, user_id=None, old_values=None, new_values=None):
+    audit_writer.record(action, table_name, record_id=record_id, user_id=user_id,
+                        old_values=old_values, new_values=new_values)
@@ -0,0 +1,261 @@
+# Token authentication for the admin and user blueprints
+# Login and signup issue a signed, stateless bearer token (itsdangerous, keyed
+# with SECRET_KEY) carrying the user id, role, a token id and the issue time;
+# it expires after AUTH_TOKEN_TTL seconds. A before_request guard on each
+# blueprint checks the Authorization header without touching the database:
+#
+#   - verified tokens are cached until they expire (at most
+#     AUTH_TOKEN_CACHE_SIZE, oldest dropped first), so the signature is
+#     checked once per token and process,
+#   - revocations are held in memory: single tokens (logout) and per-user
+#     cutoffs that void every token issued before them (password or role
+#     change, deleted account).
+#
+# Revocations are also written to auth_revocations (models/auth.py). A daemon
+# thread in each process loads new rows every AUTH_REVOCATION_SYNC seconds, so
+# a token revoked in one worker stops working in the others within that
+# interval. Rows are pruned once the tokens they cover have expired anyway.
+#
+# Views marked @public (login, signup) skip the guard. A role change only
+# takes effect at the next login: the role is read from the token.
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from flask import current_app, g, jsonify, request
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import select
+
+from db import db
+from models.auth import auth_revocations
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TTL = 8 * 3600
+CACHE_SIZE = 10000
+SYNC_INTERVAL = 5.0
+# config.py's fallback SECRET_KEY: it is public, so tokens signed with it can be forged
+DEFAULT_SECRET_KEY = 'your-secret-key-here'
+
+Principal = namedtuple('Principal', 'user_id role token_id issued_at expires_at')
+
+
+def public(view):
+    """Let requests reach this view without a token (login, signup)."""
+    view.public = True
+    return view
+
+
+class TokenAuth:
+    def __init__(self):
+        self.app = None
+        self.enabled = True
+        self.token_ttl = TOKEN_TTL
+        self.cache_size = CACHE_SIZE
+        self.sync_interval = SYNC_INTERVAL
+        self._serializer = None
+        self._verified = OrderedDict()
+        self._revoked_tokens = {}
+        self._user_cutoffs = {}
+        self._last_revocation_id = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('AUTH_REQUIRED', True)
+        self.token_ttl = app.config.get('AUTH_TOKEN_TTL', TOKEN_TTL)
+        self.cache_size = app.config.get('AUTH_TOKEN_CACHE_SIZE', CACHE_SIZE)
+        self.sync_interval = app.config.get('AUTH_REVOCATION_SYNC', SYNC_INTERVAL)
+        if self.enabled and app.config['SECRET_KEY'] == DEFAULT_SECRET_KEY:
+            if not (app.debug or app.config.get('APP_ENV') == 'development'):
+                raise RuntimeError('SECRET_KEY is the public default, so anyone could forge an admin token; '
+                                   'set SECRET_KEY before starting with AUTH_REQUIRED=true')
+            logger.warning('SECRET_KEY is the public default: anyone can forge tokens for this app. '
+                           'Allowed because APP_ENV=development (or debug); set SECRET_KEY everywhere else.')
+        self._serializer = URLSafeSerializer(app.config['SECRET_KEY'], salt='auth-token')
+        with self._lock:
+            self._verified.clear()
+        app.extensions['auth'] = self
+
+    def _reset_stats(self):
+        self.issued = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = {}
+        self.revocations_loaded = 0
+        self.last_sync_at = None
+        self.last_sync_error = None
+
+    # Issuing and revoking
+
+    def issue(self, user):
+        """A bearer token for `user` plus its lifetime, for the login response."""
+        now = time.time()
+        token = self._serializer.dumps({
+            'uid': user.id,
+            'role': user.role,
+            'jti': secrets.token_hex(8),
+            'iat': now,
+            'exp': now + self.token_ttl
+        })
+        self.issued += 1
+        return {'token': token, 'token_type': 'Bearer', 'expires_in': self.token_ttl}
+
+    def revoke_token(self, principal):
+        """Log out one token (everywhere, within the sync interval)."""
+        self._revoked_tokens[principal.token_id] = principal.expires_at
+        self._store('token', principal.token_id, time.time(), principal.expires_at)
+
+    def revoke_user(self, user_id):
+        """Void every token issued to user_id so far (password / role change, deletion)."""
+        now = time.time()
+        self._user_cutoffs[user_id] = max(now, self._user_cutoffs.get(user_id, 0))
+        self._store('user', str(user_id), now, now + self.token_ttl)
+
+    def _store(self, kind, key, revoked_at, expires_at):
+        now = time.time()
+        with db.engine.begin() as connection:
+            connection.execute(auth_revocations.insert().values(
+                kind=kind, key=key, revoked_at=revoked_at, expires_at=expires_at, created_at=datetime.now()))
+            # Revocations are rare, so pruning rides along with them
+            connection.execute(auth_revocations.delete().where(auth_revocations.c.expires_at < now))
+
+    # Verifying
+
+    def authenticate(self, token):
+        """The token's Principal, or raise ValueError with the rejection reason."""
+        now = time.time()
+        principal = self._verified.get(token)
+        if principal is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                claims = self._serializer.loads(token)
+                principal = Principal(int(claims['uid']), claims['role'], claims['jti'],
+                                      float(claims['iat']), float(claims['exp']))
+            except (BadSignature, KeyError, TypeError, ValueError):
+                raise ValueError('invalid')
+            if principal.expires_at > now:
+                with self._lock:
+                    self._verified[token] = principal
+                    while len(self._verified) > self.cache_size:
+                        self._verified.popitem(last=False)
+        if principal.expires_at <= now:
+            self._verified.pop(token, None)
+            raise ValueError('expired')
+        if principal.token_id in self._revoked_tokens or \
+                principal.issued_at <= self._user_cutoffs.get(principal.user_id, 0):
+            self._verified.pop(token, None)
+            raise ValueError('revoked')
+        return principal
+
+    def guard(self, *roles):
+        """A before_request hook admitting requests whose token carries one of `roles`."""
+        def check():
+            g.principal = None
+            if not self.enabled or request.method == 'OPTIONS':
+                return None
+            view = current_app.view_functions.get(request.endpoint)
+            if view is None or getattr(view, 'public', False):
+                return None
+            self.ensure_sync()
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not token:
+                return self._reject('missing', 'Authentication required', 401)
+            try:
+                principal = self.authenticate(token.strip())
+            except ValueError as e:
+                return self._reject(str(e), 'Invalid or expired token', 401)
+            if principal.role not in roles:
+                return self._reject('forbidden', 'Not allowed for this account', 403)
+            g.principal = principal
+            return None
+        return check
+
+    def _reject(self, reason, message, status):
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        headers = {'WWW-Authenticate': 'Bearer'} if status == 401 else {}
+        return jsonify({'error': message}), status, headers
+
+    # Revocation sync
+
+    def ensure_sync(self):
+        """Load the revocations and start the sync thread, once per process (the guard's first request does it)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._sync()
+            self._thread = threading.Thread(target=self._sync_loop, name='auth-revocations', daemon=True)
+            self._thread.start()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            self._sync()
+
+    def _sync(self):
+        try:
+            with self.app.app_context(), db.engine.connect() as connection:
+                rows = connection.execute(
+                    select(auth_revocations.c.id, auth_revocations.c.kind, auth_revocations.c.key,
+                           auth_revocations.c.revoked_at, auth_revocations.c.expires_at)
+                    .where(auth_revocations.c.id > self._last_revocation_id)
+                    .order_by(auth_revocations.c.id)
+                ).all()
+            for row in rows:
+                if row.kind == 'token':
+                    self._revoked_tokens[row.key] = row.expires_at
+                else:
+                    user_id = int(row.key)
+                    self._user_cutoffs[user_id] = max(row.revoked_at, self._user_cutoffs.get(user_id, 0))
+                self._last_revocation_id = row.id
+            self.revocations_loaded += len(rows)
+            self._forget_expired()
+            self.last_sync_at = datetime.now()
+            self.last_sync_error = None
+        except Exception as e:
+            # Keep the revocations already loaded and try again next interval
+            logger.warning('Loading token revocations failed: %s', e)
+            self.last_sync_error = str(e)
+
+    def _forget_expired(self):
+        now = time.time()
+        for token_id, expires_at in list(self._revoked_tokens.items()):
+            if expires_at <= now:
+                self._revoked_tokens.pop(token_id, None)
+        # A cutoff older than the token lifetime no longer matches any live token
+        for user_id, cutoff in list(self._user_cutoffs.items()):
+            if cutoff + self.token_ttl <= now:
+                self._user_cutoffs.pop(user_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'token_ttl': self.token_ttl,
+            'issued': self.issued,
+            'cached_tokens': len(self._verified),
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'rejected': dict(self.rejected),
+            'revoked_tokens': len(self._revoked_tokens),
+            'revoked_users': len(self._user_cutoffs),
+            'last_sync_at': self.last_sync_at.isoformat() if self.last_sync_at else None,
+            'last_sync_error': self.last_sync_error
+        }
+
+
+auth = TokenAuth()
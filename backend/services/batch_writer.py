@@ -0,0 +1,243 @@
+# Background batch writer
+# Request handlers submit rows to an in-process bounded queue; a daemon worker
+# drains it and Core-inserts the rows in batches every FLUSH_INTERVAL seconds
+# (or as soon as BATCH_SIZE are waiting), and flushes what is left on shutdown.
+# Subclasses pick the table, the config prefix and what happens to rows that
+# do not fit in the queue or fail to insert.
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+FLUSH_INTERVAL = 0.05
+BATCH_SIZE = 500
+
+_STOP = object()
+
+
+class BatchWriter:
+    # Config keys are read as <config_prefix>_DISPATCH, _QUEUE_SIZE, _FLUSH_INTERVAL, _BATCH_SIZE
+    config_prefix = None
+    thread_name = 'batch-writer'
+    table = None
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mode = 'async'
+        self.queue_size = QUEUE_SIZE
+        self.flush_interval = FLUSH_INTERVAL
+        self.batch_size = BATCH_SIZE
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        prefix = self.config_prefix
+        self.mode = app.config.get(f'{prefix}_DISPATCH', 'async')
+        self.queue_size = app.config.get(f'{prefix}_QUEUE_SIZE', QUEUE_SIZE)
+        self.flush_interval = app.config.get(f'{prefix}_FLUSH_INTERVAL', FLUSH_INTERVAL)
+        self.batch_size = app.config.get(f'{prefix}_BATCH_SIZE', BATCH_SIZE)
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        app.extensions[self.thread_name] = self
+        atexit.register(self.stop)
+
+    def _reset_stats(self):
+        self.published = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_at = None
+        self.last_batch_size = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    # Submitting
+
+    def submit(self, row):
+        """Queue a row for the next batch insert."""
+        if self.mode == 'sync' or self._queue is None:
+            self._write([row])
+            self.written += 1
+            return
+
+        self._ensure_worker()
+        try:
+            self._put((time.monotonic(), row))
+        except queue.Full:
+            self._overflow(row)
+            return
+        self.published += 1
+
+    def _put(self, item):
+        self._queue.put_nowait(item)
+
+    def _overflow(self, row):
+        """Called with a row that did not fit in the queue."""
+        self.dropped += 1
+        logger.warning('%s queue full, dropped a row', self.thread_name)
+
+    def _ensure_worker(self):
+        # Started lazily so forked WSGI workers each get their own thread
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+            self._pid = os.getpid()
+            self._on_worker_start()
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def _on_worker_start(self):
+        pass
+
+    # Worker
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._idle_timeout())
+            except queue.Empty:
+                self._guarded(self._on_idle)
+                continue
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._guarded(self._flush_batch, batch)
+            for _ in range(len(batch) + stopping):
+                self._queue.task_done()
+            if stopping:
+                return
+
+    def _guarded(self, func, *args):
+        # The worker must outlive any unexpected error, or the queue would never drain
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('%s worker error', self.thread_name)
+
+    def _idle_timeout(self):
+        """Seconds the worker waits for rows before calling _on_idle (None waits forever)."""
+        return None
+
+    def _on_idle(self):
+        pass
+
+    def _flush_batch(self, batch):
+        self.last_lag = time.monotonic() - batch[0][0]
+        self.max_lag = max(self.max_lag, self.last_lag)
+        rows = [row for _, row in batch]
+        try:
+            self._write(rows)
+            self.written += len(rows)
+        except Exception:
+            self._write_failed(rows)
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_at = datetime.now()
+
+    def _write_failed(self, rows):
+        # One bad row must not sink the batch
+        for row in rows:
+            try:
+                self._write([row])
+                self.written += 1
+            except Exception:
+                self.failed += 1
+                logger.exception('%s failed to write a row', self.thread_name)
+
+    def _write(self, rows):
+        # Core insert on its own connection, independent of any request session
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(self.table.insert(), rows)
+
+    # Lifecycle
+
+    def flush(self, timeout=None):
+        """Block until every queued row has been written (or timeout seconds pass)."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if not self._thread.is_alive():
+                    return False
+                remaining = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Flush pending rows and stop the worker."""
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning('%s queue still full at shutdown, %d rows not written',
+                           self.thread_name, self._queue.qsize())
+            return
+        self._thread.join(timeout)
+
+    def _oldest_pending(self):
+        try:
+            item = self._queue.queue[0]
+        except (AttributeError, IndexError):
+            return None
+        return item[0] if item is not _STOP else None
+
+    def stats(self):
+        oldest = self._oldest_pending()
+        return {
+            'mode': self.mode,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'queue_capacity': self.queue_size if self._queue is not None else 0,
+            # Queued plus the batch the worker is currently collecting or writing
+            'pending': self._queue.unfinished_tasks if self._queue is not None else 0,
+            'oldest_pending_seconds': round(time.monotonic() - oldest, 4) if oldest is not None else 0,
+            'published': self.published,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'last_batch_size': self.last_batch_size,
+            'last_lag_seconds': round(self.last_lag, 4),
+            'max_lag_seconds': round(self.max_lag, 4),
+            'last_flush_at': self.last_flush_at.isoformat() if self.last_flush_at else None,
+            'worker_alive': bool(self._thread and self._thread.is_alive())
+        }
@@ -0,0 +1,315 @@
+# Billing runs
+# `flask run-billing` invoices every active subscription for the billing
+# period that contains the run date. GET /user/billing then only reads the
+# caller's stored invoices (the (user_id, period_start) index).
+#
+# Periods start on the subscription's start date and repeat monthly, or
+# yearly when price_paid is at least twelve monthly prices of the plan.
+# Subscriptions do not record their interval, and the dataset import stores
+# yearly ones that way. Each period is invoiced at price_paid. A subscription
+# whose end_date is on or before the period start is not billed.
+#
+# Discounts: of the discounts scoped to the subscription's plan that are
+# active on the period start and have no usage limit, the one taking the most
+# off is applied. Limited codes are redeemed at checkout instead
+# (services/redemption.py), and site-wide codes are never applied
+# automatically.
+#
+# A run is planned as chunks of BILLING_CHUNK_SIZE subscription ids, stored in
+# billing_run_chunks. BILLING_WORKERS threads invoice the chunks, each in
+# its own transaction that also marks the chunk done. A run that stops
+# (crash, --max-chunks) resumes with the chunks still open the next time it
+# is started for the same date. Invoices are unique per (subscription_id,
+# period_start), so a chunk written twice, or two runs in the same period,
+# never bill a period again.
+import logging
+import threading
+import time
+from calendar import monthrange
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.billing import billing_run_chunks, billing_runs, invoices
+from models.discounts import Discount
+from models.plans import Plan
+from models.subscriptions import Subscription
+from services.redemption import discount_amount
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+WORKERS = 4
+MAX_PER_PAGE = 100
+
+_CENT = Decimal('0.01')
+
+
+def _add_months(day, months, anchor_day):
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, min(anchor_day, monthrange(year, month + 1)[1]))
+
+
+def term_months(price_paid, monthly_price):
+    """12 when price_paid covers at least twelve monthly prices (a yearly subscription), else 1."""
+    yearly = monthly_price is not None and monthly_price > 0 and price_paid >= monthly_price * 12
+    return 12 if yearly else 1
+
+
+def billing_period(start_date, run_date, months):
+    """(start, end) of the `months`-long period anchored on start_date that contains run_date, or None."""
+    if run_date < start_date:
+        return None
+    elapsed = (run_date.year - start_date.year) * 12 + run_date.month - start_date.month
+    periods = elapsed // months
+    period_start = _add_months(start_date, periods * months, start_date.day)
+    if period_start > run_date:
+        periods -= 1
+        period_start = _add_months(start_date, periods * months, start_date.day)
+    next_start = _add_months(start_date, (periods + 1) * months, start_date.day)
+    return period_start, next_start - timedelta(days=1)
+
+
+class BillingEngine:
+    def __init__(self):
+        self.app = None
+        self.chunk_size = CHUNK_SIZE
+        self.workers = WORKERS
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.chunk_size = app.config.get('BILLING_CHUNK_SIZE', CHUNK_SIZE)
+        self.workers = app.config.get('BILLING_WORKERS', WORKERS)
+        app.extensions['billing'] = self
+
+    # Runs
+
+    def run(self, run_date=None, chunk_size=None, workers=None, max_chunks=None, log=None):
+        """Invoice every subscription due on run_date, resuming that date's run if it was interrupted.
+
+        max_chunks bounds the chunks handled by this call; the rest are left for the next one.
+        Returns a report with invoices/sec.
+        """
+        run_date = run_date or date.today()
+        workers = workers or self.workers
+        with self._lock:
+            started = time.perf_counter()
+            run_id, resumed = self._start(run_date, chunk_size or self.chunk_size)
+            pending = db.session.execute(
+                select(billing_run_chunks.c.chunk, billing_run_chunks.c.first_id, billing_run_chunks.c.last_id)
+                .where(billing_run_chunks.c.run_id == run_id, billing_run_chunks.c.completed_at.is_(None))
+                .order_by(billing_run_chunks.c.chunk)
+            ).all()
+            if max_chunks is not None:
+                pending = pending[:max_chunks]
+            prices, discounts = self._catalog()
+            # Workers take their own connections; do not hold one here meanwhile
+            db.session.commit()
+
+            invoiced, billed, error = 0, Decimal('0'), None
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='billing') as pool:
+                futures = [pool.submit(self._bill_chunk, run_id, run_date, chunk, prices, discounts)
+                           for chunk in pending]
+                for done, future in enumerate(futures, start=1):
+                    try:
+                        count, total = future.result()
+                    except Exception as e:
+                        # The chunk stays open for the next run; keep going with the others
+                        logger.exception('Billing chunk failed')
+                        error = str(e)[:500]
+                        continue
+                    invoiced += count
+                    billed += total
+                    if log and (done % 10 == 0 or done == len(futures)):
+                        log(f'{done}/{len(futures)} chunks, {invoiced} invoices')
+
+            seconds = time.perf_counter() - started
+            return self._finish(run_id, run_date, resumed, len(pending), invoiced, billed, seconds, error)
+
+    def _start(self, run_date, chunk_size):
+        """The run for run_date and whether it was resumed, planning its chunks when it is new."""
+        existing = db.session.execute(
+            select(billing_runs.c.id).where(billing_runs.c.run_date == run_date)
+        ).scalar()
+        if existing is not None:
+            return existing, True
+        ids = db.session.execute(
+            select(Subscription.id).where(Subscription.status == 'active').order_by(Subscription.id)
+        ).scalars().all()
+        # Boundaries every chunk_size active subscriptions; the last chunk is open-ended
+        # so subscriptions created during the run are billed too
+        firsts = [1] + [ids[i] for i in range(chunk_size, len(ids), chunk_size)]
+        try:
+            run_id = db.session.execute(billing_runs.insert().values(
+                run_date=run_date, status='running', chunks=len(firsts), invoices=0, total=0, seconds=0,
+                started_at=datetime.now()
+            )).inserted_primary_key[0]
+            db.session.execute(billing_run_chunks.insert(), [{
+                'run_id': run_id,
+                'chunk': index,
+                'first_id': first_id,
+                'last_id': firsts[index + 1] - 1 if index + 1 < len(firsts) else None
+            } for index, first_id in enumerate(firsts)])
+            db.session.commit()
+        except IntegrityError:
+            # Another process planned this date first
+            db.session.rollback()
+            return self._start(run_date, chunk_size)
+        return run_id, False
+
+    def _catalog(self):
+        """Monthly prices by plan, and the automatic discounts by plan (as dicts)."""
+        prices = dict(db.session.execute(select(Plan.id, Plan.monthly_price)).all())
+        discounts = {}
+        for discount in Discount.query.filter(Discount.plan_id.isnot(None), Discount.is_active.is_(True),
+                                              Discount.usage_limit.is_(None)):
+            discounts.setdefault(discount.plan_id, []).append(discount.to_dict())
+        return prices, discounts
+
+    def _invoice(self, subscription, run_date, prices, discounts):
+        """The invoice row for the period containing run_date, or None when nothing is due."""
+        amount = subscription.price_paid
+        period = billing_period(subscription.start_date, run_date, term_months(amount, prices.get(subscription.plan_id)))
+        if period is None or (subscription.end_date and subscription.end_date <= period[0]):
+            return None
+        period_start, period_end = period
+
+        best, off = None, Decimal('0')
+        for discount in discounts.get(subscription.plan_id, ()):
+            valid_from = discount['valid_from'] and date.fromisoformat(discount['valid_from'][:10])
+            valid_until = discount['valid_until'] and date.fromisoformat(discount['valid_until'][:10])
+            if (valid_from and period_start < valid_from) or (valid_until and period_start > valid_until):
+                continue
+            if discount['min_amount'] is not None and amount < Decimal(str(discount['min_amount'])):
+                continue
+            candidate = discount_amount(discount, amount)
+            if candidate > off:
+                best, off = discount, candidate
+        return {
+            'subscription_id': subscription.id,
+            'user_id': subscription.user_id,
+            'plan_id': subscription.plan_id,
+            'period_start': period_start,
+            'period_end': period_end,
+            'amount': amount,
+            'discount_id': best['id'] if best else None,
+            'discount_code': best['code'] if best else None,
+            'discount_amount': off,
+            'total': (amount - off).quantize(_CENT)
+        }
+
+    def _bill_chunk(self, run_id, run_date, chunk, prices, discounts):
+        """Invoice one chunk and mark it done, in one transaction; returns (invoices, total)."""
+        number, first_id, last_id = chunk
+        in_chunk = [Subscription.id >= first_id]
+        if last_id is not None:
+            in_chunk.append(Subscription.id <= last_id)
+        with self.app.app_context(), db.engine.begin() as connection:
+            subscriptions = connection.execute(
+                select(Subscription.id, Subscription.user_id, Subscription.plan_id, Subscription.start_date,
+                       Subscription.end_date, Subscription.price_paid)
+                .where(*in_chunk, Subscription.status == 'active', Subscription.start_date <= run_date)
+            ).all()
+            rows = [row for row in (self._invoice(subscription, run_date, prices, discounts)
+                                    for subscription in subscriptions) if row is not None]
+            if rows:
+                # Periods invoiced already (an earlier run this period, or this chunk before a crash)
+                billed = set(connection.execute(
+                    select(invoices.c.subscription_id, invoices.c.period_start)
+                    .where(*[invoices.c.subscription_id.between(first_id, last_id) if last_id is not None
+                             else invoices.c.subscription_id >= first_id],
+                           invoices.c.period_start >= min(row['period_start'] for row in rows))
+                ).all())
+                now = datetime.now()
+                rows = [dict(row, billing_run_id=run_id, created_at=now) for row in rows
+                        if (row['subscription_id'], row['period_start']) not in billed]
+            if rows:
+                connection.execute(invoices.insert(), rows)
+            total = sum((row['total'] for row in rows), Decimal('0'))
+            connection.execute(
+                billing_run_chunks.update()
+                .where(billing_run_chunks.c.run_id == run_id, billing_run_chunks.c.chunk == number)
+                .values(invoices=len(rows), total=total, completed_at=datetime.now())
+            )
+        return len(rows), total
+
+    def _finish(self, run_id, run_date, resumed, chunks, invoiced, billed, seconds, error):
+        # Totals over every call that worked on this run
+        open_chunks, run_invoices, run_total = db.session.execute(
+            select(func.count().filter(billing_run_chunks.c.completed_at.is_(None)),
+                   func.coalesce(func.sum(billing_run_chunks.c.invoices), 0),
+                   func.coalesce(func.sum(billing_run_chunks.c.total), 0))
+            .where(billing_run_chunks.c.run_id == run_id)
+        ).one()
+        db.session.execute(billing_runs.update().where(billing_runs.c.id == run_id).values(
+            status='running' if open_chunks else 'completed',
+            invoices=run_invoices,
+            total=run_total,
+            seconds=billing_runs.c.seconds + seconds,
+            last_error=error,
+            finished_at=None if open_chunks else datetime.now()
+        ))
+        db.session.commit()
+        return {
+            'run_id': run_id,
+            'run_date': run_date.isoformat(),
+            'resumed': resumed,
+            'chunks': chunks,
+            'open_chunks': open_chunks,
+            'invoices': invoiced,
+            'total': float(billed),
+            'seconds': round(seconds, 3),
+            'invoices_per_sec': round(invoiced / seconds) if seconds > 0 else None,
+            'error': error
+        }
+
+    # Reads
+
+    def runs(self, limit=20):
+        rows = db.session.execute(select(billing_runs).order_by(billing_runs.c.run_date.desc()).limit(limit)).all()
+        return [{
+            'id': row.id,
+            'run_date': row.run_date.isoformat(),
+            'status': row.status,
+            'chunks': row.chunks,
+            'invoices': row.invoices,
+            'total': float(row.total),
+            'seconds': round(row.seconds, 3),
+            'invoices_per_sec': round(row.invoices / row.seconds) if row.seconds else None,
+            'last_error': row.last_error,
+            'started_at': row.started_at.isoformat(),
+            'finished_at': row.finished_at.isoformat() if row.finished_at else None
+        } for row in rows]
+
+
+def user_invoices(user_id, limit=24, before=None):
+    """A user's invoices, newest period first; `before` is the (period_start, id) of the last one seen."""
+    query = select(invoices).where(invoices.c.user_id == user_id)
+    if before is not None:
+        period_start, invoice_id = before
+        query = query.where(or_(invoices.c.period_start < period_start,
+                                and_(invoices.c.period_start == period_start, invoices.c.id < invoice_id)))
+    rows = db.session.execute(
+        query.order_by(invoices.c.period_start.desc(), invoices.c.id.desc()).limit(min(limit, MAX_PER_PAGE))
+    ).all()
+    return [{
+        'id': row.id,
+        'subscription_id': row.subscription_id,
+        'plan_id': row.plan_id,
+        'period_start': row.period_start.isoformat(),
+        'period_end': row.period_end.isoformat(),
+        'amount': float(row.amount),
+        'discount_code': row.discount_code,
+        'discount_amount': float(row.discount_amount),
+        'total': float(row.total),
+        'created_at': row.created_at.isoformat()
+    } for row in rows]
+
+
+billing = BillingEngine()
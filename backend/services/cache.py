@@ -0,0 +1,224 @@
+# Read-through cache
+# A small TTL + LRU cache for lookups that change rarely (plan catalogue,
+# discounts by code). Values are stored as JSON, never as ORM objects, so a
+# cached value is detached from any session and callers cannot mutate the
+# cached copy. The in-process backend is the default; CACHE_BACKEND=redis
+# shares entries and invalidations between workers through any
+# Redis-compatible server (eviction is then the server's maxmemory-policy).
+#
+# With the in-process backend an invalidation only reaches the worker that
+# made the write: the others keep serving their copy until its TTL runs out.
+# Run redis with more than one worker process; CACHE_NAMESPACE_TTLS keeps the
+# window short where staleness matters most (discounts).
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+MAX_ENTRIES = 1024
+
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def clear(self, prefix):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    name = 'redis'
+
+    def __init__(self, url, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('CACHE_BACKEND=redis requires the redis package (pip install redis)')
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.evictions = None
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=max(1, math.ceil(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def counter(self, key):
+        return int(self.client.get(key) or 0)
+
+    def clear(self, prefix):
+        keys = list(self.client.scan_iter(match=f'{prefix}:*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def size(self):
+        return None
+
+
+class NullBackend:
+    """Caching disabled: every lookup goes to the loader."""
+    name = 'none'
+    evictions = None
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def counter(self, key):
+        return 0
+
+    def clear(self, prefix):
+        pass
+
+    def size(self):
+        return 0
+
+
+class Cache:
+    def __init__(self, backend=None, prefix='cache', default_ttl=DEFAULT_TTL):
+        self.backend = backend or MemoryBackend()
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.namespace_ttls = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        kind = app.config.get('CACHE_BACKEND', 'memory')
+        if kind == 'redis':
+            self.backend = RedisBackend(app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+        elif kind == 'none':
+            self.backend = NullBackend()
+        else:
+            self.backend = MemoryBackend(app.config.get('CACHE_MAX_ENTRIES', MAX_ENTRIES))
+        self.prefix = app.config.get('CACHE_KEY_PREFIX', self.prefix)
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', self.default_ttl)
+        self.namespace_ttls = dict(app.config.get('CACHE_NAMESPACE_TTLS') or {})
+        if self.backend.name == 'memory' and app.config.get('APP_ENV') == 'production':
+            logger.warning('CACHE_BACKEND=memory is per process: with several workers, writes only invalidate '
+                           'the worker that made them. Use CACHE_BACKEND=redis for multi-worker deployments.')
+        app.extensions['cache'] = self
+
+    def _namespace_stats(self, namespace):
+        stats = self._stats.get(namespace)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'invalidations': 0})
+        return stats
+
+    def _key(self, namespace, key):
+        # Keys embed the namespace generation, so invalidate_namespace() drops every entry at once
+        generation = self.backend.counter(f'{self.prefix}:gen:{namespace}')
+        return f'{self.prefix}:{namespace}:{generation}:{key}'
+
+    def get_or_load(self, namespace, key, loader, ttl=None):
+        """Return the cached value for key, calling loader() and caching its result on a miss.
+
+        loader must return JSON-serialisable data; None results are cached too.
+        """
+        stats = self._namespace_stats(namespace)
+        full_key = self._key(namespace, key)
+        raw = self.backend.get(full_key)
+        if raw is not None:
+            stats['hits'] += 1
+            return json.loads(raw)
+
+        stats['misses'] += 1
+        value = loader()
+        self.backend.set(full_key, json.dumps(value), ttl or self.namespace_ttls.get(namespace) or self.default_ttl)
+        return value
+
+    def delete(self, namespace, *keys):
+        self._namespace_stats(namespace)['invalidations'] += len(keys)
+        self.backend.delete(*[self._key(namespace, key) for key in keys])
+
+    def invalidate_namespace(self, namespace):
+        self._namespace_stats(namespace)['invalidations'] += 1
+        self.backend.incr(f'{self.prefix}:gen:{namespace}')
+
+    def clear(self):
+        self.backend.clear(self.prefix)
+
+    def stats(self):
+        namespaces = {}
+        for namespace, stats in sorted(self._stats.items()):
+            lookups = stats['hits'] + stats['misses']
+            namespaces[namespace] = dict(stats, hit_ratio=round(stats['hits'] / lookups, 4) if lookups else None)
+        return {
+            'backend': self.backend.name,
+            'entries': self.backend.size(),
+            'evictions': self.backend.evictions,
+            'default_ttl': self.default_ttl,
+            'namespace_ttls': dict(self.namespace_ttls),
+            'namespaces': namespaces
+        }
+
+
+cache = Cache()
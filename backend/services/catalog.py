@@ -0,0 +1,48 @@
+# Plan catalogue and discount lookups
+# Read through services.cache. Every write path must call the matching
+# invalidate_* function after its commit. Misses load from the primary: a
+# value read from a lagging replica would be cached for every client.
+from models.plans import Plan
+from models.discounts import Discount
+from services.cache import cache
+from services.db_routing import primary
+
+PLANS = 'plans'
+DISCOUNTS = 'discounts'
+
+
+def plan_catalog():
+    """All plans as dicts."""
+    def load():
+        with primary():
+            return [plan.to_dict() for plan in Plan.query.all()]
+    return cache.get_or_load(PLANS, 'all', load)
+
+
+def get_plan(plan_id):
+    """One plan as a dict, or None."""
+    def load():
+        with primary():
+            plan = Plan.query.get(plan_id)
+            return plan.to_dict() if plan else None
+    return cache.get_or_load(PLANS, f'id:{int(plan_id)}', load)
+
+
+def discount_by_code(code):
+    """The discount with this code as a dict, or None (misses are cached too)."""
+    def load():
+        with primary():
+            discount = Discount.query.filter_by(code=code).first()
+            return discount.to_dict() if discount else None
+    return cache.get_or_load(DISCOUNTS, f'code:{code}', load)
+
+
+def invalidate_plan(plan_id, deleted=False):
+    cache.delete(PLANS, 'all', f'id:{int(plan_id)}')
+    if deleted:
+        # Deleting a plan cascades to its discounts
+        cache.invalidate_namespace(DISCOUNTS)
+
+
+def invalidate_discount(*codes):
+    cache.delete(DISCOUNTS, *[f'code:{code}' for code in codes if code])
@@ -0,0 +1,203 @@
+# Password hashing off the request thread
+# Hashing and checking a password costs tens to hundreds of milliseconds of
+# CPU by design (scrypt / PBKDF2). Done inline, every signup and login holds a
+# request thread for that long and competes with the other requests for the
+# worker's CPU. CredentialService runs the hashes in a process pool of
+# PASSWORD_HASH_WORKERS processes (0 hashes on the calling thread).
+#
+# The pool is started on the first hash, with the spawn start method, so its
+# workers re-import __main__. A script that hashes without an
+# `if __name__ == '__main__':` guard would start another pool from inside a
+# worker while it is still bootstrapping, which multiprocessing refuses. Child
+# processes therefore always hash on the calling thread.
+#
+# Backpressure: at most PASSWORD_HASH_MAX_PENDING hashes may be running or
+# waiting. A request that gets no slot within PASSWORD_HASH_WAIT seconds gets
+# CredentialsBusy, which the routes answer with 503 + Retry-After, instead of
+# queueing without bound behind a burst of logins.
+#
+# PASSWORD_HASH_METHOD is a werkzeug method string including its cost
+# ('scrypt:32768:8:1', 'pbkdf2:sha256:600000'). Raising it only affects new
+# hashes: a stored hash made with a different method is replaced on the
+# user's next successful login, when the plain password is at hand.
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+METHOD = 'scrypt'
+WAIT = 2.0
+
+
+class CredentialsBusy(Exception):
+    """No hashing slot became free within PASSWORD_HASH_WAIT seconds."""
+
+
+# Job functions run in the pool processes, so they only take picklable arguments
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _check(password_hash, password, method, current):
+    """(matches, replacement hash or None): verify and upgrade in one round trip."""
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if _method_of(password_hash) == current:
+        return True, None
+    return True, generate_password_hash(password, method=method)
+
+
+def _method_of(password_hash):
+    return password_hash.split('$', 1)[0]
+
+
+class CredentialService:
+    def __init__(self, app=None):
+        self.method = METHOD
+        self.workers = 0
+        self.max_pending = 1
+        self.wait = WAIT
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._pid = None
+        self._current = None
+        self._pool_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        method = app.config.get('PASSWORD_HASH_METHOD') or METHOD
+        if method.split(':', 1)[0] not in ('scrypt', 'pbkdf2'):
+            raise ValueError(f'Unsupported PASSWORD_HASH_METHOD {method!r} (use scrypt[:n:r:p] or pbkdf2:<hash>[:iterations])')
+        workers = app.config.get('PASSWORD_HASH_WORKERS')
+        self.configure(
+            method=method,
+            workers=(os.cpu_count() or 1) if workers is None else workers,
+            max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING'),
+            wait=app.config.get('PASSWORD_HASH_WAIT', WAIT)
+        )
+        app.extensions['credentials'] = self
+        atexit.register(self.stop)
+
+    def configure(self, method=None, workers=None, max_pending=None, wait=None):
+        """Change settings at runtime (the benchmark uses this); restarts the pool."""
+        self.stop()
+        if method is not None:
+            self.method = method
+            self._current = None
+        if workers is not None:
+            self.workers = max(0, workers)
+        # Default: enough waiting jobs to keep every worker busy through a short burst
+        self.max_pending = max_pending or max(1, self.workers) * 4
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        if wait is not None:
+            self.wait = wait
+
+    def _reset_stats(self):
+        self.hashed = 0
+        self.checked = 0
+        self.upgraded = 0
+        self.busy = 0
+        self.pending = 0
+        self.hash_seconds = 0.0
+        self.max_wait = 0.0
+
+    # API
+
+    def hash_password(self, password):
+        """Hash with the configured method (for signup and password changes)."""
+        password_hash = self._run(_hash, password, self.method)
+        self.hashed += 1
+        return password_hash
+
+    def verify(self, user, password):
+        """Check a login. On success, a hash made with another method is replaced
+        on `user` (the caller commits); returns whether the password matched."""
+        matches, replacement = self._run(_check, user.password_hash, password, self.method, self.current_method())
+        self.checked += 1
+        if replacement:
+            user.password_hash = replacement
+            self.upgraded += 1
+        return matches
+
+    def current_method(self):
+        """The method as werkzeug writes it into hashes, defaults filled in ('scrypt' -> 'scrypt:32768:8:1')."""
+        if self._current is None:
+            self._current = _method_of(self._run(_hash, '', self.method))
+        return self._current
+
+    # Pool
+
+    def _run(self, job, *args):
+        slots = self._slots
+        started = time.monotonic()
+        if not slots.acquire(timeout=self.wait):
+            self.busy += 1
+            raise CredentialsBusy('Too many password checks in progress, retry shortly')
+        with self._lock:
+            self.max_wait = max(self.max_wait, time.monotonic() - started)
+            self.pending += 1
+        try:
+            started = time.monotonic()
+            if self._inline():
+                return job(*args)
+            try:
+                return self._executor().submit(job, *args).result()
+            except BrokenProcessPool:
+                # A worker died (OOM killer, signal): start a fresh pool for the next call
+                logger.exception('Password hashing pool broke; restarting it')
+                self.stop()
+                raise
+        finally:
+            with self._lock:
+                self.hash_seconds += time.monotonic() - started
+                self.pending -= 1
+            slots.release()
+
+    def _inline(self):
+        # A spawned child is named by its parent before it re-imports __main__
+        return self.workers == 0 or multiprocessing.current_process().name != 'MainProcess'
+
+    def _executor(self):
+        # Processes are started on first use, and again in a forked child (gunicorn --preload)
+        if self._pool is None or self._pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                    self._pid = os.getpid()
+        return self._pool
+
+    def stop(self):
+        pool, self._pool = self._pool, None
+        if pool is not None and self._pid == os.getpid():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        jobs = self.hashed + self.checked
+        return {
+            'method': self.method,
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'hashed': self.hashed,
+            'checked': self.checked,
+            'upgraded': self.upgraded,
+            'busy': self.busy,
+            'mean_seconds': round(self.hash_seconds / jobs, 4) if jobs else None,
+            'max_wait_seconds': round(self.max_wait, 4)
+        }
+
+
+credentials = CredentialService()
@@ -0,0 +1,525 @@
+# Dataset import
+# Loads plans, users, subscriptions and usage from the dataset workbook
+# (SubscriptionUseCase_Dataset.xlsx) or from a directory of CSV files with the
+# same columns (plans.csv, users.csv, subscriptions.csv, usage.csv). Sheets
+# are streamed row by row (the .xlsx is read with zipfile + iterparse), so
+# memory stays at a couple of batches plus the workbook's shared strings.
+#
+# Each batch is written with Core inserts and committed together with the
+# sheet's row in data_imports, so a run that fails resumes after its last
+# committed batch when the same source is imported again. The source's ids
+# are mapped to the new rows in data_import_keys; a user whose email exists
+# already, or a plan whose name does, is reused instead of duplicated.
+# Password hashing (PASSWORD_HASH_METHOD, tens of milliseconds each) runs in a process pool
+# one batch ahead of the inserts.
+import csv
+import hashlib
+import multiprocessing
+import os
+import re
+import secrets
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from datetime import date, datetime, time as day_start, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from sqlalchemy import select
+from werkzeug.security import generate_password_hash
+
+from db import db
+from models.data_imports import data_import_keys, data_imports
+from models.users import User
+from models.plans import Plan
+from models.subscriptions import Subscription
+from services import metrics_rollup, recommendations, usage_ingest, user_search
+from services.credentials import credentials
+
+BATCH_SIZE = 1000
+MAX_ERRORS_PER_SHEET = 20
+
+# Imported in this order, so every sheet's references are already mapped:
+# sheet -> (workbook sheet name, CSV file name)
+SOURCES = {
+    'plans': ('Subscription_Plans', 'plans.csv'),
+    'users': ('User_Data', 'users.csv'),
+    'subscriptions': ('Subscriptions', 'subscriptions.csv'),
+    'usage': ('Usage', 'usage.csv'),
+}
+
+SUBSCRIPTION_STATUSES = {
+    'active': 'active', 'paused': 'paused', 'expired': 'expired',
+    'cancelled': 'cancelled', 'canceled': 'cancelled', 'terminated': 'cancelled'
+}
+
+_XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_XLSX_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+# Sources
+
+def _header_key(value):
+    """'User Id' / 'user_id' / 'USER ID' -> 'user_id'."""
+    return re.sub(r'[^a-z0-9]+', '_', str(value or '').strip().lower()).strip('_')
+
+
+def _column_index(reference):
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+class Workbook:
+    """Streams the rows of an .xlsx file's sheets (cell values only)."""
+
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path)
+        relations = ET.fromstring(self.archive.read('xl/_rels/workbook.xml.rels'))
+        targets = {relation.get('Id'): relation.get('Target') for relation in relations}
+        self.sheets = {}
+        for sheet in ET.fromstring(self.archive.read('xl/workbook.xml')).iter(_XLSX + 'sheet'):
+            target = targets[sheet.get(_XLSX_REL + 'id')]
+            self.sheets[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+        self._strings = None
+
+    def _shared_strings(self):
+        if self._strings is None:
+            self._strings = []
+            if 'xl/sharedStrings.xml' in self.archive.namelist():
+                with self.archive.open('xl/sharedStrings.xml') as handle:
+                    for _, element in ET.iterparse(handle):
+                        if element.tag == _XLSX + 'si':
+                            self._strings.append(''.join(text.text or '' for text in element.iter(_XLSX + 't')))
+                            element.clear()
+        return self._strings
+
+    def rows(self, name):
+        """Each row after the header, as a dict keyed by the normalized header."""
+        strings = self._shared_strings()
+        header = None
+        sheet_data = None
+        with self.archive.open(self.sheets[name]) as handle:
+            for event, element in ET.iterparse(handle, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == _XLSX + 'sheetData':
+                        sheet_data = element
+                    continue
+                if element.tag != _XLSX + 'row':
+                    continue
+                values = {}
+                for position, cell in enumerate(element.iter(_XLSX + 'c')):
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        value = ''.join(text.text or '' for text in cell.iter(_XLSX + 't'))
+                    else:
+                        node = cell.find(_XLSX + 'v')
+                        value = node.text if node is not None else None
+                        if kind == 's' and value is not None:
+                            value = strings[int(value)]
+                    reference = cell.get('r')
+                    values[_column_index(reference) if reference else position] = value
+                # Finished rows are dropped so the parsed tree never grows
+                sheet_data.clear()
+                if header is None:
+                    header = {index: _header_key(value) for index, value in values.items()}
+                elif any(value not in (None, '') for value in values.values()):
+                    yield {header[index]: value for index, value in values.items() if index in header}
+
+
+def _csv_rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        reader = csv.reader(handle)
+        header = [_header_key(name) for name in next(reader, [])]
+        for values in reader:
+            if any(values):
+                yield dict(zip(header, values))
+
+
+def _checksum(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+# Cell parsers return None for missing or invalid values
+
+def _text(value):
+    value = str(value).strip() if value is not None else ''
+    return value or None
+
+
+def _int(value):
+    try:
+        number = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None
+    return int(number) if number.is_finite() and number == number.to_integral_value() else None
+
+
+def _money(value):
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None
+    return amount.quantize(Decimal('0.01')) if amount.is_finite() and 0 <= amount < 10 ** 8 else None
+
+
+def _date(value):
+    text = _text(value)
+    if text is None:
+        return None
+    try:
+        return date.fromisoformat(text[:10])
+    except ValueError:
+        pass
+    try:
+        # Date cells without a string format hold Excel serial day numbers
+        return _EXCEL_EPOCH + timedelta(days=int(float(text)))
+    except (ValueError, OverflowError):
+        return None
+
+
+def _flag(value):
+    return (_text(value) or '').lower() in ('yes', 'y', 'true', '1', 'active')
+
+
+def _key(value):
+    number = _int(value)
+    return str(number) if number is not None else _text(value)
+
+
+# Import
+
+class DatasetImport:
+    def __init__(self, path, batch_size=BATCH_SIZE, workers=None, default_password=None, on_batch=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.default_password = default_password
+        self.on_batch = on_batch
+        if os.path.isdir(path):
+            self.workbook = None
+            self.files = {sheet: os.path.join(path, filename) for sheet, (_, filename) in SOURCES.items()
+                          if os.path.exists(os.path.join(path, filename))}
+            self.dataset = _checksum([self.files[sheet] for sheet in SOURCES if sheet in self.files])
+        else:
+            self.workbook = Workbook(path)
+            self.files = {sheet: path for sheet, (name, _) in SOURCES.items() if name in self.workbook.sheets}
+            self.dataset = _checksum([path])
+        self._pool = None
+
+    def _rows(self, sheet):
+        if self.workbook is not None:
+            return self.workbook.rows(SOURCES[sheet][0])
+        return _csv_rows(self.files[sheet])
+
+    def run(self):
+        """Import every sheet the source has; returns one report per sheet."""
+        try:
+            return [self._run_sheet(sheet) for sheet in SOURCES if sheet in self.files]
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+
+    # Progress
+
+    def _progress(self, sheet):
+        row = db.session.execute(select(data_imports).where(
+            data_imports.c.dataset == self.dataset, data_imports.c.sheet == sheet
+        )).first()
+        if row is None:
+            now = datetime.now()
+            db.session.execute(data_imports.insert().values(
+                dataset=self.dataset, sheet=sheet, source=os.path.basename(self.files[sheet]),
+                rows_done=0, imported=0, existing=0, rejected=0, started_at=now, updated_at=now
+            ))
+            db.session.commit()
+            return self._progress(sheet)
+        return row
+
+    def _advance(self, sheet, rows, imported, existing, rejected, finished=False):
+        values = {
+            'rows_done': data_imports.c.rows_done + rows,
+            'imported': data_imports.c.imported + imported,
+            'existing': data_imports.c.existing + existing,
+            'rejected': data_imports.c.rejected + rejected,
+            'updated_at': datetime.now()
+        }
+        if finished:
+            values['finished_at'] = datetime.now()
+        db.session.execute(data_imports.update().where(
+            data_imports.c.dataset == self.dataset, data_imports.c.sheet == sheet
+        ).values(**values))
+
+    def _run_sheet(self, sheet):
+        progress = self._progress(sheet)
+        report = {
+            'sheet': sheet, 'source': progress.source, 'resumed_at_row': progress.rows_done,
+            'rows': 0, 'imported': 0, 'existing': 0, 'rejected': 0, 'errors': [], 'seconds': 0, 'rows_per_sec': None
+        }
+        if progress.finished_at is not None:
+            report['skipped'] = 'already imported'
+            return report
+
+        prepare, write = getattr(self, f'_prepare_{sheet}'), getattr(self, f'_write_{sheet}')
+        started = time.perf_counter()
+        first_row = progress.rows_done
+        rows = islice(self._rows(sheet), first_row, None)
+
+        # The next batch is prepared (for users: hashed in the pool) while this one is written
+        pending = None
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            prepared = prepare(batch, first_row) if batch else None
+            if pending is not None:
+                self._commit(sheet, report, write, *pending)
+            if not batch:
+                break
+            pending = (batch, prepared)
+            first_row += len(batch)
+
+        self._advance(sheet, 0, 0, 0, 0, finished=True)
+        db.session.commit()
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        report['rows_per_sec'] = round(report['rows'] / report['seconds']) if report['seconds'] > 0 else None
+        return report
+
+    def _commit(self, sheet, report, write, batch, prepared):
+        started = time.perf_counter()
+        try:
+            imported, existing, rejected, errors = write(prepared)
+            self._advance(sheet, len(batch), imported, existing, rejected)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        report['rows'] += len(batch)
+        report['imported'] += imported
+        report['existing'] += existing
+        report['rejected'] += rejected
+        report['errors'].extend(errors[:MAX_ERRORS_PER_SHEET - len(report['errors'])])
+        if self.on_batch:
+            seconds = time.perf_counter() - started
+            self.on_batch(dict(sheet=sheet, rows=len(batch), imported=imported, existing=existing,
+                               rejected=rejected, rows_per_sec=round(len(batch) / seconds) if seconds > 0 else None))
+
+    def _keys(self, entity, source_ids):
+        """{source_id: target_id} for the given source ids already mapped in this dataset."""
+        if not source_ids:
+            return {}
+        return dict(db.session.execute(select(data_import_keys.c.source_id, data_import_keys.c.target_id).where(
+            data_import_keys.c.dataset == self.dataset,
+            data_import_keys.c.entity == entity,
+            data_import_keys.c.source_id.in_(source_ids)
+        )).all())
+
+    def _save_keys(self, entity, mapping):
+        if mapping:
+            db.session.execute(data_import_keys.insert(), [
+                {'dataset': self.dataset, 'entity': entity, 'source_id': source_id, 'target_id': target_id}
+                for source_id, target_id in mapping.items()
+            ])
+
+    def _parse(self, batch, first_row, parse):
+        """Run parse(record) -> (source_id, values) or error message over a batch."""
+        parsed, errors = [], []
+        for offset, record in enumerate(batch):
+            # Spreadsheet row numbers: the header is row 1
+            row_number = first_row + offset + 2
+            result = parse(record)
+            if isinstance(result, str):
+                errors.append({'row': row_number, 'error': result})
+            else:
+                parsed.append((row_number,) + result)
+        return parsed, errors
+
+    def _claim(self, entity, parsed, errors):
+        """Drop rows whose source id is repeated or was imported earlier in this dataset."""
+        seen = self._keys(entity, [source_id for _, source_id, _ in parsed])
+        kept = []
+        for row_number, source_id, values in parsed:
+            if source_id in seen:
+                errors.append({'row': row_number, 'error': f'duplicate {entity} id {source_id}'})
+                continue
+            seen[source_id] = None
+            kept.append((row_number, source_id, values))
+        return kept
+
+    # Plans
+
+    def _parse_plan(self, record):
+        source_id = _key(record.get('product_id') or record.get('plan_id') or record.get('id'))
+        name = _text(record.get('name'))
+        price = _money(record.get('price') or record.get('monthly_price'))
+        if source_id is None or name is None or price is None:
+            return 'plan needs a product id, a name and a price'
+        quota = _int(record.get('quota_gb') or record.get('monthly_quota_gb'))
+        return source_id, {
+            'name': name[:100],
+            'description': _text(record.get('description')),
+            'monthly_price': price,
+            'monthly_quota_gb': quota if quota and quota > 0 else 0,
+            'is_active': _flag(record.get('status', 'active'))
+        }
+
+    def _prepare_plans(self, batch, first_row):
+        return self._parse(batch, first_row, self._parse_plan)
+
+    def _write_plans(self, prepared):
+        parsed, errors = prepared
+        parsed = self._claim('plan', parsed, errors)
+        existing = dict(db.session.execute(
+            select(Plan.name, Plan.id).where(Plan.name.in_(list({values['name'] for _, _, values in parsed})))
+        ).all()) if parsed else {}
+        now = datetime.now()
+        mapping = {}
+        reused = 0
+        for _, source_id, values in parsed:
+            plan_id = existing.get(values['name'])
+            if plan_id is None:
+                # Plans are few, so each insert reads back its own id
+                plan_id = db.session.execute(
+                    Plan.__table__.insert().values(**values, created_at=now, updated_at=now)
+                ).inserted_primary_key[0]
+                existing[values['name']] = plan_id
+                recommendations.mark_everyone(db.session.connection())
+            else:
+                reused += 1
+            mapping[source_id] = plan_id
+        self._save_keys('plan', mapping)
+        return len(mapping) - reused, reused, len(errors), errors
+
+    # Users
+
+    def _parse_user(self, record):
+        source_id = _key(record.get('user_id') or record.get('id'))
+        email = (_text(record.get('email')) or '').lower()
+        name = _text(record.get('name'))
+        if source_id is None or '@' not in email or name is None:
+            return 'user needs a user id, a name and an email'
+        role = (_text(record.get('role')) or 'user').lower()
+        if role not in ('admin', 'user'):
+            return f'unknown role {role}'
+        return source_id, {
+            'name': name[:100],
+            'email': email[:120],
+            'role': role,
+            # Without a password column or a default, accounts get a random one (an admin resets it)
+            'password': _text(record.get('password')) or self.default_password or secrets.token_urlsafe(16)
+        }
+
+    def _prepare_users(self, batch, first_row):
+        parsed, errors = self._parse(batch, first_row, self._parse_user)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        passwords = [values.pop('password') for _, _, values in parsed]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return parsed, errors, self._pool.map(
+            partial(generate_password_hash, method=credentials.method), passwords, chunksize=chunksize)
+
+    def _write_users(self, prepared):
+        parsed, errors, hashes = prepared
+        for (_, _, values), password_hash in zip(parsed, hashes):
+            values['password_hash'] = password_hash
+        parsed = self._claim('user', parsed, errors)
+
+        emails = {values['email'] for _, _, values in parsed}
+        existing = dict(db.session.execute(select(User.email, User.id).where(User.email.in_(list(emails)))).all()) if emails else {}
+        now = datetime.now()
+        new_rows = {}
+        for _, _, values in parsed:
+            if values['email'] not in existing and values['email'] not in new_rows:
+                new_rows[values['email']] = dict(values, created_at=now, updated_at=now)
+        if new_rows:
+            db.session.execute(User.__table__.insert(), list(new_rows.values()))
+            created = dict(db.session.execute(
+                select(User.email, User.id).where(User.email.in_(list(new_rows)))
+            ).all())
+            # Bulk inserts skip the search-index mapper events
+            user_search.index_users(db.session, [(created[email], row['name'], email) for email, row in new_rows.items()])
+            recommendations.mark_users(db.session.connection(), created.values())
+            existing.update(created)
+
+        self._save_keys('user', {source_id: existing[values['email']] for _, source_id, values in parsed})
+        return len(new_rows), len(parsed) - len(new_rows), len(errors), errors
+
+    # Subscriptions
+
+    def _parse_subscription(self, record):
+        user_key = _key(record.get('user_id'))
+        plan_key = _key(record.get('product_id') or record.get('plan_id'))
+        status = SUBSCRIPTION_STATUSES.get((_text(record.get('status')) or '').lower())
+        start_date = _date(record.get('start_date'))
+        if user_key is None or plan_key is None:
+            return 'subscription needs a user id and a product id'
+        if status is None:
+            return f"unknown status {record.get('status')}"
+        if start_date is None:
+            return 'invalid start date'
+        terminated = _date(record.get('terminated_date') or record.get('end_date'))
+        return (user_key, plan_key), {
+            'status': 'cancelled' if terminated and status == 'active' else status,
+            'start_date': start_date,
+            'end_date': terminated,
+            'price_paid': _money(record.get('price_paid')),
+            'yearly': (_text(record.get('subscription_type')) or '').lower() == 'yearly',
+            'created_at': datetime.combine(start_date, day_start())
+        }
+
+    def _prepare_subscriptions(self, batch, first_row):
+        return self._parse(batch, first_row, self._parse_subscription)
+
+    def _write_subscriptions(self, prepared):
+        parsed, errors = prepared
+        users = self._keys('user', list({keys[0] for _, keys, _ in parsed}))
+        plans = self._keys('plan', list({keys[1] for _, keys, _ in parsed}))
+        prices = dict(db.session.execute(
+            select(Plan.id, Plan.monthly_price).where(Plan.id.in_(list(set(plans.values()))))
+        ).all()) if plans else {}
+
+        now = datetime.now()
+        rows = []
+        for row_number, (user_key, plan_key), values in parsed:
+            if user_key not in users:
+                errors.append({'row': row_number, 'error': f'unknown user id {user_key}'})
+                continue
+            if plan_key not in plans:
+                errors.append({'row': row_number, 'error': f'unknown product id {plan_key}'})
+                continue
+            plan_id = plans[plan_key]
+            yearly = values.pop('yearly')
+            if values['price_paid'] is None:
+                values['price_paid'] = prices[plan_id] * (12 if yearly else 1)
+            rows.append(dict(values, user_id=users[user_key], plan_id=plan_id, updated_at=now))
+
+        if rows:
+            db.session.execute(Subscription.__table__.insert(), rows)
+            # Bulk inserts skip the rollup mapper events
+            metrics_rollup.apply_subscriptions(db.session.connection(), rows)
+            recommendations.mark_users(db.session.connection(), {row['user_id'] for row in rows})
+        return len(rows), 0, len(errors), errors
+
+    # Usage
+
+    def _prepare_usage(self, batch, first_row):
+        return batch, first_row
+
+    def _write_usage(self, prepared):
+        batch, first_row = prepared
+        users = self._keys('user', list({_key(record.get('user_id')) for record in batch} - {None}))
+        records = [dict(record, user_id=users.get(_key(record.get('user_id')))) for record in batch]
+        # Upserts on (user_id, date) and commits on its own, so a resumed batch is simply written again
+        report = usage_ingest.ingest_batch(records, first_row=first_row + 2)
+        errors = [{'row': error['row'], 'error': ', '.join(error['errors'])} for error in report['errors']]
+        return report['inserted'], report['updated'], report['rejected'], errors
@@ -0,0 +1,128 @@
+# Connection pool monitoring
+# Pool events count connections opened, closed and invalidated (a failed
+# pre-ping or a disconnect error), and a thin wrapper around pool.connect
+# measures how long callers wait for a connection, including checkouts that
+# give up at pool_timeout. GET /admin/db/pool and /metrics read stats().
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from db import db
+
+
+class PoolMonitor:
+    def __init__(self):
+        self.options = {}
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.invalidations = 0
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_errors = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._observers = []
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        app.extensions['pool_monitor'] = self
+        with app.app_context():
+            engine = db.engine
+        if engine is self._engine:
+            return
+        self._engine = engine
+        # Listeners on the engine carry over to the new pool after dispose();
+        # the connect wrapper lives on the pool object, so it is re-applied
+        event.listen(engine, 'connect', self._opened)
+        event.listen(engine, 'close', self._closed)
+        event.listen(engine, 'close_detached', self._closed)
+        event.listen(engine, 'invalidate', self._invalidated)
+        event.listen(engine, 'engine_disposed', lambda engine: self._wrap(engine.pool))
+        self._wrap(engine.pool)
+
+    def add_checkout_observer(self, observer):
+        """`observer(seconds, error)` is called after every checkout; error is None or the exception."""
+        if observer not in self._observers:
+            self._observers.append(observer)
+
+    def _opened(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_opened += 1
+
+    def _closed(self, dbapi_connection, *args):
+        with self._lock:
+            self.connections_closed += 1
+
+    def _invalidated(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def _wrap(self, pool):
+        if getattr(pool, '_checkout_monitored', False):
+            return
+        connect = pool.connect
+
+        def monitored_connect():
+            started = time.perf_counter()
+            error = None
+            try:
+                return connect()
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self._checked_out(time.perf_counter() - started, error)
+
+        pool.connect = monitored_connect
+        pool._checkout_monitored = True
+
+    def _checked_out(self, seconds, error):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if isinstance(error, PoolTimeoutError):
+                self.checkout_timeouts += 1
+            elif error is not None:
+                self.checkout_errors += 1
+        for observer in self._observers:
+            observer(seconds, error)
+
+    def stats(self):
+        pool = db.engine.pool
+        live = {}
+        for key, attribute in (('size', 'size'), ('checked_out', 'checkedout'),
+                               ('checked_in', 'checkedin'), ('overflow', 'overflow')):
+            method = getattr(pool, attribute, None)
+            if method is not None:
+                # QueuePool counts overflow from -size until the pool has filled up
+                live[key] = max(method(), 0)
+        if 'checked_out' in live and 'checked_in' in live:
+            live['open'] = live['checked_out'] + live['checked_in']
+        with self._lock:
+            return {
+                'pool_class': type(pool).__name__,
+                'settings': {
+                    'pool_size': self.options.get('pool_size'),
+                    'max_overflow': self.options.get('max_overflow'),
+                    'pool_timeout': self.options.get('pool_timeout'),
+                    'pool_recycle': self.options.get('pool_recycle'),
+                    'pool_pre_ping': self.options.get('pool_pre_ping', False)
+                },
+                'live': live,
+                'connections_opened': self.connections_opened,
+                'connections_closed': self.connections_closed,
+                'invalidations': self.invalidations,
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_errors': self.checkout_errors,
+                'mean_wait_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0,
+                'max_wait_ms': round(self.wait_max * 1000, 3)
+            }
+
+
+pool_monitor = PoolMonitor()
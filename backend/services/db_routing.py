@@ -0,0 +1,194 @@
+# Read-replica routing
+# GET requests to views marked @read_replica run their session reads on the
+# 'replica' bind (REPLICA_DATABASE_URL); everything else stays on the primary.
+# A request falls back to the primary when:
+#   - no replica is configured, or the last lag check failed (retried after
+#     REPLICA_RETRY_AFTER seconds),
+#   - the replica is more than REPLICA_MAX_LAG seconds behind,
+#   - the client wrote recently (read-your-writes): a successful non-GET
+#     request returns the time until which that client should read from the
+#     primary (now + REPLICA_STICKY_SECONDS), both as a short-lived cookie and
+#     as an X-DB-Primary-Until header. The SPA calls the API cross-origin
+#     without credentials, so it never holds the cookie: it echoes the header
+#     back on its next requests instead,
+#   - the request itself has flushed (see RoutingSession in db.py).
+# Loaders that fill a shared cache read inside `with primary():`, so a lagging
+# replica never gets cached for everyone.
+# Lag is measured pt-heartbeat style: each check stamps a row on the primary
+# and reads the replicated stamp back from the replica, so it works for any
+# replication setup (MySQL, PostgreSQL, or a copied SQLite file in tests).
+# A daemon thread in each process (started by the first routed request, like
+# the other background workers) checks every REPLICA_CHECK_INTERVAL seconds,
+# so requests never wait for the probe. Routing adds the reading's age to the
+# lag: if the probe stalls, the lag grows past REPLICA_MAX_LAG and reads go
+# back to the primary.
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import event, select
+
+from db import db, RoutingSession
+from models.replica import replica_heartbeat
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'db_primary_until'
+STICKY_HEADER = 'X-DB-Primary-Until'
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.enabled = False
+        self.max_lag = 5.0
+        self.check_interval = 1.0
+        self.retry_after = 30.0
+        self.sticky_seconds = 10
+        self.lag = None
+        self.healthy = False
+        self.last_error = None
+        self.last_check_at = None
+        self.routed = {}
+        self.app = None
+        self._checked = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = 'replica' in (app.config.get('SQLALCHEMY_BINDS') or {})
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 5.0)
+        self.check_interval = app.config.get('REPLICA_CHECK_INTERVAL', 1.0)
+        self.retry_after = app.config.get('REPLICA_RETRY_AFTER', 30.0)
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 10)
+        app.extensions['replica_router'] = self
+        if self.enabled:
+            app.after_request(self._mark_writer)
+
+    def _count(self, reason):
+        with self._lock:
+            self.routed[reason] = self.routed.get(reason, 0) + 1
+
+    def ensure_probe(self):
+        """Start the lag probe thread, once per process (the first routed request does it)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._probe_loop, name='replica-lag-probe', daemon=True)
+            self._thread.start()
+
+    def _probe_loop(self):
+        while True:
+            with self.app.app_context():
+                self.check_lag()
+            time.sleep(self.check_interval if self.healthy else self.retry_after)
+
+    def check_lag(self):
+        """Take a lag reading now (the probe thread calls this every check_interval)."""
+        try:
+            beat = datetime.now()
+            with db.engine.begin() as connection:
+                updated = connection.execute(
+                    replica_heartbeat.update().where(replica_heartbeat.c.id == 1).values(beat_at=beat)
+                ).rowcount
+                if not updated:
+                    connection.execute(replica_heartbeat.insert().values(id=1, beat_at=beat))
+            with db.engines['replica'].connect() as connection:
+                replicated = connection.execute(
+                    select(replica_heartbeat.c.beat_at).where(replica_heartbeat.c.id == 1)
+                ).scalar()
+            self.lag = (datetime.now() - replicated).total_seconds() if replicated else None
+            self.healthy = True
+            self.last_error = None
+        except Exception as e:
+            logger.warning('Replica lag check failed, reading from the primary: %s', e)
+            self.lag = None
+            self.healthy = False
+            self.last_error = str(e)
+        self._checked = time.monotonic()
+        self.last_check_at = datetime.now()
+
+    def route(self):
+        """Where this request's reads should go: 'replica' or 'primary', and why."""
+        if not self.enabled:
+            return 'primary', 'disabled'
+        sticky_until = max(request.cookies.get(STICKY_COOKIE, 0, type=float),
+                           request.headers.get(STICKY_HEADER, 0, type=float))
+        if sticky_until > time.time():
+            return 'primary', 'recent_write'
+        self.ensure_probe()
+        if self._checked is None:
+            return 'primary', 'no_reading'
+        if not self.healthy:
+            return 'primary', 'replica_error'
+        if self.lag is None or self.lag + (time.monotonic() - self._checked) > self.max_lag:
+            return 'primary', 'lag'
+        return 'replica', 'replica'
+
+    def _mark_writer(self, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            until = str(time.time() + self.sticky_seconds)
+            response.set_cookie(STICKY_COOKIE, until, max_age=int(self.sticky_seconds) + 1,
+                                httponly=True, samesite='Lax')
+            response.headers[STICKY_HEADER] = until
+        return response
+
+    def stats(self):
+        with self._lock:
+            routed = dict(self.routed)
+        return {
+            'enabled': self.enabled,
+            'healthy': self.healthy,
+            'lag_seconds': round(self.lag, 3) if self.lag is not None else None,
+            'max_lag_seconds': self.max_lag,
+            'last_check_at': self.last_check_at.isoformat() if self.last_check_at else None,
+            'probe_running': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            'last_error': self.last_error,
+            'requests': routed
+        }
+
+
+def read_replica(view):
+    """Serve GET requests to this view from the replica when it is usable."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            target, reason = replica_router.route()
+            replica_router._count(reason)
+            g._db_route = target
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside this block, e.g. while filling a shared cache."""
+    if not has_app_context():
+        yield
+        return
+    previous = g.get('_db_route')
+    g._db_route = 'primary'
+    try:
+        yield
+    finally:
+        g._db_route = previous
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    # Later reads in this request must see what it just wrote
+    if has_request_context() and g.get('_db_route') == 'replica':
+        g._db_route = 'primary'
+
+
+replica_router = ReplicaRouter()
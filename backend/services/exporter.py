@@ -0,0 +1,153 @@
+# Streaming exporter
+# Reads export queries in server-side chunks (yield_per) and encodes them as
+# NDJSON or CSV on the fly, so memory stays flat whatever the row count and
+# the first bytes leave before the query has been fully read.
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from db import db
+from models.users import User
+from models.plans import Plan
+from models.subscriptions import Subscription
+from models.usage import Usage
+from models.audit_logs import AuditLog
+from models.alerts import Alert
+
+FETCH_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def _subscriptions():
+    fields = [
+        ('id', Subscription.id),
+        ('user_name', User.name),
+        ('user_email', User.email),
+        ('plan_name', Plan.name),
+        ('status', Subscription.status),
+        ('start_date', Subscription.start_date),
+        ('end_date', Subscription.end_date),
+        ('price_paid', Subscription.price_paid),
+        ('created_at', Subscription.created_at)
+    ]
+    query = db.session.query(*[column for _, column in fields]).select_from(Subscription).join(
+        User, Subscription.user_id == User.id
+    ).join(Plan, Subscription.plan_id == Plan.id).order_by(Subscription.id)
+    return [name for name, _ in fields], query
+
+
+def _usage():
+    fields = [
+        ('id', Usage.id),
+        ('user_id', Usage.user_id),
+        ('date', Usage.date),
+        ('data_used_gb', Usage.data_used_gb),
+        ('created_at', Usage.created_at)
+    ]
+    query = db.session.query(*[column for _, column in fields]).order_by(Usage.id)
+    return [name for name, _ in fields], query
+
+
+def _audit_logs():
+    fields = [
+        ('id', AuditLog.id),
+        ('user_id', AuditLog.user_id),
+        ('action', AuditLog.action),
+        ('table_name', AuditLog.table_name),
+        ('record_id', AuditLog.record_id),
+        ('old_values', AuditLog.old_values),
+        ('new_values', AuditLog.new_values),
+        ('ip_address', AuditLog.ip_address),
+        ('user_agent', AuditLog.user_agent),
+        ('created_at', AuditLog.created_at)
+    ]
+    query = db.session.query(*[column for _, column in fields]).order_by(AuditLog.id)
+    return [name for name, _ in fields], query
+
+
+def _alerts():
+    fields = [
+        ('id', Alert.id),
+        ('user_id', Alert.user_id),
+        ('user_name', User.name),
+        ('type', Alert.type),
+        ('title', Alert.title),
+        ('message', Alert.message),
+        ('is_read', Alert.is_read),
+        ('created_at', Alert.created_at)
+    ]
+    query = db.session.query(*[column for _, column in fields]).select_from(Alert).outerjoin(
+        User, Alert.user_id == User.id
+    ).order_by(Alert.id)
+    return [name for name, _ in fields], query
+
+
+EXPORTS = {
+    'subscriptions': _subscriptions,
+    'alerts': _alerts,
+    'usage': _usage,
+    'audit_logs': _audit_logs
+}
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _ndjson_lines(fields, rows):
+    for row in rows:
+        yield json.dumps({name: _plain(value) for name, value in zip(fields, row)}, default=str) + '\n'
+
+
+def _csv_lines(fields, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(fields)
+    yield take()
+    for row in rows:
+        writer.writerow([
+            json.dumps(value) if isinstance(value, (dict, list)) else _plain(value)
+            for value in row
+        ])
+        yield take()
+
+
+def _chunked(lines):
+    """Group encoded lines into ~CHUNK_BYTES writes; the first line goes out at once."""
+    chunk, size = [], 0
+    first = True
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if first or size >= CHUNK_BYTES:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+            first = False
+    if chunk:
+        yield ''.join(chunk)
+
+
+def stream_export(resource, fmt):
+    """Return a generator of text chunks for the given export."""
+    fields, query = EXPORTS[resource]()
+    rows = query.yield_per(FETCH_SIZE)
+    lines = _csv_lines(fields, rows) if fmt == 'csv' else _ndjson_lines(fields, rows)
+    return _chunked(lines)
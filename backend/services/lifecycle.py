@@ -0,0 +1,268 @@
+# Subscription lifecycle sweeps
+# Moves subscriptions along as their dates pass, so status = 'active' (and the
+# active_count rollups behind the dashboard) stays true without every query
+# re-checking dates. In the order a sweep applies them:
+#
+#   resumed  paused, pause_end <= today             -> active, pause dates cleared
+#   paused   active, pause_start <= today, pause_end NULL or after today -> paused
+#   renewed  active, auto_renew, end_date < today   -> end_date moved to the end of the
+#                                                      billing period containing today
+#   expired  active or paused, not auto_renew, end_date < today -> expired
+#
+# Renewal terms follow billing (monthly, or yearly when price_paid covers
+# twelve monthly prices), so a renewed subscription is invoiced by the next
+# billing run. A paused subscription with auto_renew waits for its pause to
+# end and is renewed then.
+#
+# Every rule works through the matching rows SWEEP_BATCH_SIZE ids at a time,
+# each batch one transaction: read the ids (and the columns the rollups
+# need), then one set-based UPDATE ... WHERE id IN (...) AND <rule> (one per
+# new end_date for renewals). No ORM objects are loaded, so the mapper events
+# do not fire: the batch applies the rollup deltas and queues the users for
+# recommendations itself. When a request changed one of the rows in between,
+# the UPDATE matches fewer rows than were read; the batch is rolled back and
+# read again.
+#
+# A daemon thread in each process (started by the first request, like the
+# other background workers) sweeps every LIFECYCLE_SWEEP_INTERVAL seconds.
+# The interval is cut into numbered slots and a sweep first inserts its slot
+# into lifecycle_runs (unique), so with several workers only one of them
+# sweeps per slot. `flask sweep-subscriptions` sweeps at once. Each run
+# records its duration and row counts there and publishes one summary alert
+# when it changed anything.
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.lifecycle import lifecycle_runs
+from models.plans import Plan
+from models.subscriptions import Subscription
+from services import metrics_rollup, recommendations
+from services.alert_dispatcher import publish_alert
+from services.billing import billing_period, term_months
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = 3600
+BATCH_SIZE = 1000
+# Attempts at a batch whose rows keep changing underneath it
+BATCH_ATTEMPTS = 3
+
+RULES = ('resumed', 'paused', 'renewed', 'expired')
+
+_subscriptions = Subscription.__table__
+_c = _subscriptions.c
+
+
+class _RowsChanged(Exception):
+    """A batch's UPDATE matched fewer rows than it read."""
+
+
+class LifecycleSweeper:
+    def __init__(self):
+        self.app = None
+        self.interval = SWEEP_INTERVAL
+        self.batch_size = BATCH_SIZE
+        self.last_run = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('LIFECYCLE_SWEEP_INTERVAL', SWEEP_INTERVAL)
+        self.batch_size = app.config.get('LIFECYCLE_BATCH_SIZE', BATCH_SIZE)
+        app.extensions['lifecycle'] = self
+        if self.interval > 0:
+            app.before_request(self.ensure_scheduler)
+
+    # Scheduler
+
+    def ensure_scheduler(self):
+        """Start the sweep thread, once per process (the first request does it)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._schedule_loop, name='lifecycle-sweeper', daemon=True)
+            self._thread.start()
+
+    def _schedule_loop(self):
+        while True:
+            slot = int(time.time() // self.interval)
+            try:
+                with self.app.app_context():
+                    self.sweep(slot=slot)
+            except Exception:
+                logger.exception('Scheduled subscription sweep failed')
+            time.sleep(max(1.0, (slot + 1) * self.interval - time.time()))
+
+    # Sweeps
+
+    def sweep(self, today=None, batch_size=None, slot=None, log=None):
+        """Apply every rule for `today`; returns a report, or None when another process has this slot."""
+        today = today or date.today()
+        batch_size = batch_size or self.batch_size
+        with self._lock:
+            run_id = self._claim(slot)
+            if run_id is None:
+                return None
+            # Batches take their own connections; do not hold one here meanwhile
+            db.session.commit()
+            started = time.perf_counter()
+            counts = dict.fromkeys(RULES, 0)
+            batches, error = 0, None
+            prices = dict(db.session.execute(select(Plan.id, Plan.monthly_price)).all())
+            db.session.commit()
+            try:
+                for rule in RULES:
+                    last_id = 0
+                    while True:
+                        changed, last_id = self._batch(rule, today, last_id, batch_size, prices)
+                        if last_id is None:
+                            break
+                        batches += 1
+                        counts[rule] += changed
+                    if log and counts[rule]:
+                        log(f'{counts[rule]} {rule}')
+            except Exception as e:
+                # Batches already committed stay; the next sweep picks up the rest
+                logger.exception('Subscription sweep failed')
+                error = str(e)[:500]
+            seconds = time.perf_counter() - started
+            return self._finish(run_id, slot, counts, batches, seconds, error)
+
+    def _claim(self, slot):
+        try:
+            run_id = db.session.execute(lifecycle_runs.insert().values(
+                slot=slot, trigger='manual' if slot is None else 'scheduler', started_at=datetime.now(),
+                batches=0, **dict.fromkeys(RULES, 0)
+            )).inserted_primary_key[0]
+            db.session.commit()
+        except IntegrityError:
+            # Another process swept this slot
+            db.session.rollback()
+            return None
+        return run_id
+
+    def _batch(self, rule, today, last_id, batch_size, prices):
+        """One batch of a rule in its own transaction: (rows changed, last id read), last id None when done."""
+        for attempt in range(BATCH_ATTEMPTS):
+            try:
+                with db.engine.begin() as connection:
+                    return getattr(self, f'_{rule}')(connection, today, last_id, batch_size, prices)
+            except _RowsChanged:
+                if attempt == BATCH_ATTEMPTS - 1:
+                    raise RuntimeError(f'Subscriptions kept changing during the {rule} sweep; try again')
+
+    def _read(self, connection, where, last_id, batch_size, *columns):
+        return connection.execute(
+            select(_c.id, *columns).where(where, _c.id > last_id).order_by(_c.id).limit(batch_size)
+        ).all()
+
+    def _update(self, connection, ids, where, **values):
+        updated = connection.execute(
+            _subscriptions.update().where(_c.id.in_(ids), where).values(updated_at=datetime.now(), **values)
+        ).rowcount
+        if updated != len(ids):
+            raise _RowsChanged()
+
+    def _move(self, connection, where, new_status, last_id, batch_size, **values):
+        """Set the status (and `values`) of a batch of rows matching `where`; keeps the rollups in step."""
+        rows = self._read(connection, where, last_id, batch_size, _c.user_id, _c.plan_id, _c.status,
+                          _c.start_date, _c.created_at, _c.price_paid)
+        if not rows:
+            return 0, None
+        self._update(connection, [row.id for row in rows], where, status=new_status, **values)
+        metrics_rollup.apply_status_changes(connection, [row._mapping for row in rows], new_status)
+        recommendations.mark_users(connection, [row.user_id for row in rows])
+        return len(rows), rows[-1].id
+
+    def _resumed(self, connection, today, last_id, batch_size, prices):
+        where = and_(_c.status == 'paused', _c.pause_end <= today)
+        return self._move(connection, where, 'active', last_id, batch_size, pause_start=None, pause_end=None)
+
+    def _paused(self, connection, today, last_id, batch_size, prices):
+        where = and_(_c.status == 'active', _c.pause_start <= today,
+                     or_(_c.pause_end.is_(None), _c.pause_end > today))
+        return self._move(connection, where, 'paused', last_id, batch_size)
+
+    def _expired(self, connection, today, last_id, batch_size, prices):
+        where = and_(_c.status.in_(('active', 'paused')), _c.end_date < today, _c.auto_renew.is_(False))
+        return self._move(connection, where, 'expired', last_id, batch_size)
+
+    def _renewed(self, connection, today, last_id, batch_size, prices):
+        where = and_(_c.status == 'active', _c.end_date < today, _c.auto_renew.is_(True))
+        rows = self._read(connection, where, last_id, batch_size, _c.plan_id, _c.start_date, _c.price_paid)
+        if not rows:
+            return 0, None
+        # One UPDATE per new end date; a start date after today leaves the row for a later sweep
+        by_end_date = {}
+        for row in rows:
+            period = billing_period(row.start_date, today, term_months(row.price_paid, prices.get(row.plan_id)))
+            if period is not None:
+                by_end_date.setdefault(period[1], []).append(row.id)
+        for end_date, ids in by_end_date.items():
+            self._update(connection, ids, where, end_date=end_date)
+        return sum(len(ids) for ids in by_end_date.values()), rows[-1].id
+
+    def _finish(self, run_id, slot, counts, batches, seconds, error):
+        finished_at = datetime.now()
+        db.session.execute(lifecycle_runs.update().where(lifecycle_runs.c.id == run_id).values(
+            finished_at=finished_at, seconds=seconds, batches=batches, error=error, **counts
+        ))
+        db.session.commit()
+        changed = sum(counts.values())
+        if changed or error:
+            summary = ', '.join(f'{counts[rule]} {rule}' for rule in RULES)
+            publish_alert(
+                type='error' if error else 'info',
+                title='Subscription sweep failed' if error else 'Subscription sweep',
+                message=f'{summary} in {seconds:.1f}s' + (f': {error}' if error else '')
+            )
+        self.last_run = {
+            'run_id': run_id,
+            'trigger': 'manual' if slot is None else 'scheduler',
+            **counts,
+            'batches': batches,
+            'seconds': round(seconds, 3),
+            'rows_per_sec': round(changed / seconds) if seconds > 0 else None,
+            'error': error,
+            'finished_at': finished_at.isoformat()
+        }
+        return self.last_run
+
+    # Reads
+
+    def runs(self, limit=20):
+        rows = db.session.execute(select(lifecycle_runs).order_by(lifecycle_runs.c.id.desc()).limit(limit)).all()
+        return [{
+            'id': row.id,
+            'trigger': row.trigger,
+            'started_at': row.started_at.isoformat(),
+            'finished_at': row.finished_at.isoformat() if row.finished_at else None,
+            'seconds': round(row.seconds, 3) if row.seconds is not None else None,
+            'batches': row.batches,
+            **{rule: getattr(row, rule) for rule in RULES},
+            'error': row.error
+        } for row in rows]
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'batch_size': self.batch_size,
+            'scheduler_running': self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+            'last_run': self.last_run
+        }
+
+
+lifecycle = LifecycleSweeper()
@@ -0,0 +1,488 @@
+# Metrics rollup service
+# Keeps the daily_plan_metrics / daily_usage_metrics tables in step with
+# subscriptions, usage and discounts so the dashboard and analytics
+# endpoints read one row per day instead of scanning the source tables.
+from bisect import bisect_right
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import event, inspect, select, func, case, and_, bindparam
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.plans import Plan
+from models.subscriptions import Subscription
+from models.usage import Usage
+from models.discounts import Discount
+from models.metrics import DailyPlanMetric, DailyUsageMetric
+
+# Rows without a creation timestamp are accounted under this day
+UNKNOWN_DAY = date(1970, 1, 1)
+
+# (column, label, min_gb, max_gb) - a max of None means "and above"
+USAGE_BUCKETS = [
+    ('bucket_0_10', '0-10 GB', 0, 10),
+    ('bucket_10_50', '10-50 GB', 10, 50),
+    ('bucket_50_100', '50-100 GB', 50, 100),
+    ('bucket_100_plus', '100+ GB', 100, None)
+]
+
+plan_metrics = DailyPlanMetric.__table__
+usage_metrics = DailyUsageMetric.__table__
+
+
+def _as_date(value):
+    if value is None:
+        return UNKNOWN_DAY
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _as_decimal(value):
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+def _previous(target, attr):
+    """Value of an attribute before the pending flush."""
+    history = inspect(target).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attr)
+
+
+def _changed(target, *attrs):
+    state = inspect(target)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+def _keep_previous(*attributes):
+    """Load the old value when these attributes are set.
+
+    After a commit they are expired, and setting an unloaded attribute
+    records no history: _previous would return the new value and the
+    update handlers would move nothing out of the old rollup row.
+    """
+    for attribute in attributes:
+        event.listen(attribute, 'set', lambda target, value, oldvalue, initiator: None, active_history=True)
+
+
+def _bump(connection, table, key, deltas, maxima=None):
+    """Add deltas to a rollup row, creating it when missing."""
+    maxima = maxima or {}
+    where = and_(*[table.c[column] == value for column, value in key.items()])
+    values = {column: table.c[column] + delta for column, delta in deltas.items()}
+    for column, value in maxima.items():
+        values[column] = case((table.c[column] < value, value), else_=table.c[column])
+
+    result = connection.execute(table.update().where(where).values(**values))
+    if result.rowcount:
+        return
+
+    try:
+        with connection.begin_nested():
+            connection.execute(table.insert().values(**key, **deltas, **maxima))
+    except IntegrityError:
+        # Another writer created the row first
+        connection.execute(table.update().where(where).values(**values))
+
+
+# Subscriptions
+
+def _subscription_key(created_at, start_date, plan_id):
+    return {'date': _as_date(created_at or start_date), 'plan_id': plan_id or 0}
+
+
+def _subscription_deltas(status, price_paid, sign=1):
+    price = _as_decimal(price_paid) * sign
+    active = status == 'active'
+    return {
+        'subscriptions_created': sign,
+        'revenue': price,
+        'active_count': sign if active else 0,
+        'active_revenue': price if active else Decimal('0')
+    }
+
+
+_keep_previous(Subscription.created_at, Subscription.start_date, Subscription.plan_id,
+               Subscription.status, Subscription.price_paid)
+
+
+@event.listens_for(Subscription, 'after_insert')
+def _subscription_inserted(mapper, connection, target):
+    _bump(connection, plan_metrics,
+          _subscription_key(target.created_at, target.start_date, target.plan_id),
+          _subscription_deltas(target.status, target.price_paid))
+
+
+@event.listens_for(Subscription, 'after_update')
+def _subscription_updated(mapper, connection, target):
+    if not _changed(target, 'created_at', 'start_date', 'plan_id', 'status', 'price_paid'):
+        return
+    _bump(connection, plan_metrics,
+          _subscription_key(_previous(target, 'created_at'), _previous(target, 'start_date'), _previous(target, 'plan_id')),
+          _subscription_deltas(_previous(target, 'status'), _previous(target, 'price_paid'), sign=-1))
+    _subscription_inserted(mapper, connection, target)
+
+
+@event.listens_for(Subscription, 'after_delete')
+def _subscription_deleted(mapper, connection, target):
+    _bump(connection, plan_metrics,
+          _subscription_key(target.created_at, target.start_date, target.plan_id),
+          _subscription_deltas(target.status, target.price_paid, sign=-1))
+
+
+def apply_subscriptions(connection, rows):
+    """Fold bulk-inserted subscriptions (dicts of column values) into the plan rollups."""
+    per_key = {}
+    for row in rows:
+        key = _subscription_key(row.get('created_at'), row['start_date'], row['plan_id'])
+        deltas = _subscription_deltas(row['status'], row['price_paid'])
+        entry = per_key.setdefault((key['date'], key['plan_id']), dict.fromkeys(deltas, 0))
+        for column, delta in deltas.items():
+            entry[column] += delta
+    for (day, plan_id), deltas in per_key.items():
+        _bump(connection, plan_metrics, {'date': day, 'plan_id': plan_id}, deltas)
+
+
+def apply_status_changes(connection, rows, new_status):
+    """Fold Core status updates into the rollups; rows (dicts) carry the status they had before."""
+    per_key = {}
+    for row in rows:
+        key = _subscription_key(row.get('created_at'), row['start_date'], row['plan_id'])
+        entry = per_key.setdefault((key['date'], key['plan_id']), {'active_count': 0, 'active_revenue': Decimal('0')})
+        for status, sign in ((row['status'], -1), (new_status, 1)):
+            deltas = _subscription_deltas(status, row['price_paid'], sign)
+            entry['active_count'] += deltas['active_count']
+            entry['active_revenue'] += deltas['active_revenue']
+    per_key = {key: deltas for key, deltas in per_key.items() if deltas['active_count']}
+    if not per_key:
+        return
+    # The subscriptions were counted when created, so their rows exist: one executemany for
+    # all of them instead of an UPDATE per (day, plan) key
+    existing = set(connection.execute(
+        select(plan_metrics.c.date, plan_metrics.c.plan_id)
+        .where(plan_metrics.c.date.in_({day for day, _ in per_key}),
+               plan_metrics.c.plan_id.in_({plan_id for _, plan_id in per_key}))
+    ).all())
+    found = [{'key_date': day, 'key_plan_id': plan_id, 'delta_count': deltas['active_count'],
+              'delta_revenue': deltas['active_revenue']}
+             for (day, plan_id), deltas in per_key.items() if (day, plan_id) in existing]
+    if found:
+        connection.execute(
+            plan_metrics.update()
+            .where(plan_metrics.c.date == bindparam('key_date'), plan_metrics.c.plan_id == bindparam('key_plan_id'))
+            .values(active_count=plan_metrics.c.active_count + bindparam('delta_count'),
+                    active_revenue=plan_metrics.c.active_revenue + bindparam('delta_revenue')),
+            found
+        )
+    for (day, plan_id), deltas in per_key.items():
+        if (day, plan_id) not in existing:
+            _bump(connection, plan_metrics, {'date': day, 'plan_id': plan_id}, deltas)
+
+
+# Discounts
+
+def _discount_key(created_at, plan_id):
+    return {'date': _as_date(created_at), 'plan_id': plan_id or 0}
+
+
+def _discount_deltas(is_active, used_count, sign=1):
+    return {
+        'discounts_created': sign,
+        'discounts_active': sign if is_active else 0,
+        'discounts_used': (used_count or 0) * sign
+    }
+
+
+_keep_previous(Discount.created_at, Discount.plan_id, Discount.is_active, Discount.used_count)
+
+
+@event.listens_for(Discount, 'after_insert')
+def _discount_inserted(mapper, connection, target):
+    _bump(connection, plan_metrics,
+          _discount_key(target.created_at, target.plan_id),
+          _discount_deltas(target.is_active, target.used_count))
+
+
+@event.listens_for(Discount, 'after_update')
+def _discount_updated(mapper, connection, target):
+    if not _changed(target, 'created_at', 'plan_id', 'is_active', 'used_count'):
+        return
+    _bump(connection, plan_metrics,
+          _discount_key(_previous(target, 'created_at'), _previous(target, 'plan_id')),
+          _discount_deltas(_previous(target, 'is_active'), _previous(target, 'used_count'), sign=-1))
+    _discount_inserted(mapper, connection, target)
+
+
+@event.listens_for(Discount, 'after_delete')
+def _discount_deleted(mapper, connection, target):
+    _bump(connection, plan_metrics,
+          _discount_key(target.created_at, target.plan_id),
+          _discount_deltas(target.is_active, target.used_count, sign=-1))
+
+
+def apply_discount_redemptions(connection, created_at, plan_id, count):
+    """Account for used_count increments made with Core UPDATEs (services/redemption.py)."""
+    _bump(connection, plan_metrics, _discount_key(created_at, plan_id), {'discounts_used': count})
+
+
+# Usage
+
+def _usage_bucket(data_used_gb):
+    for column, label, min_gb, max_gb in USAGE_BUCKETS:
+        if data_used_gb >= min_gb and (max_gb is None or data_used_gb < max_gb):
+            return column
+    return None
+
+
+def _usage_aggregates():
+    columns = [
+        func.count(Usage.id).label('usage_count'),
+        func.sum(Usage.data_used_gb).label('usage_sum'),
+        func.max(Usage.data_used_gb).label('usage_max')
+    ]
+    for column, label, min_gb, max_gb in USAGE_BUCKETS:
+        in_bucket = Usage.data_used_gb >= min_gb
+        if max_gb is not None:
+            in_bucket = and_(in_bucket, Usage.data_used_gb < max_gb)
+        columns.append(func.count(case((in_bucket, Usage.id))).label(column))
+    return columns
+
+
+def _usage_row(day, aggregates):
+    row = {'date': _as_date(day)}
+    for column, value in aggregates._mapping.items():
+        if column != 'date':
+            row[column] = value or 0
+    return row
+
+
+def _recompute_usage_day(connection, day):
+    """Rebuild one day's usage rollup; used when rows shrink or move."""
+    aggregates = connection.execute(
+        select(*_usage_aggregates()).where(Usage.date == day)
+    ).one()
+    connection.execute(usage_metrics.delete().where(usage_metrics.c.date == day))
+    if aggregates.usage_count:
+        connection.execute(usage_metrics.insert().values(**_usage_row(day, aggregates)))
+
+
+_keep_previous(Usage.date)
+
+
+@event.listens_for(Usage, 'after_insert')
+def _usage_inserted(mapper, connection, target):
+    data_used_gb = _as_decimal(target.data_used_gb)
+    deltas = {'usage_count': 1, 'usage_sum': data_used_gb}
+    bucket = _usage_bucket(data_used_gb)
+    if bucket:
+        deltas[bucket] = 1
+    _bump(connection, usage_metrics, {'date': _as_date(target.date)}, deltas,
+          maxima={'usage_max': data_used_gb})
+
+
+@event.listens_for(Usage, 'after_update')
+def _usage_updated(mapper, connection, target):
+    if not _changed(target, 'date', 'data_used_gb'):
+        return
+    old_day = _as_date(_previous(target, 'date'))
+    new_day = _as_date(target.date)
+    _recompute_usage_day(connection, old_day)
+    if new_day != old_day:
+        _recompute_usage_day(connection, new_day)
+
+
+@event.listens_for(Usage, 'after_delete')
+def _usage_deleted(mapper, connection, target):
+    _recompute_usage_day(connection, _as_date(target.date))
+
+
+# Lower bounds of the usage buckets in cents, for bisecting bulk changes
+_BUCKET_COLUMNS = [column for column, _, _, _ in USAGE_BUCKETS]
+_BUCKET_FLOORS = [min_gb * 100 for _, _, min_gb, _ in USAGE_BUCKETS]
+
+
+def apply_usage_cents(connection, changes):
+    """Fold a batch of bulk-written usage rows into the rollups.
+
+    Bulk inserts bypass the mapper events, so writers pass (date, old_cents,
+    new_cents) for every row they touched, with data_used_gb in integer
+    cents; old_cents is None for newly inserted rows.
+    """
+    per_day = {}
+    for day, old, new in changes:
+        entry = per_day.get(day)
+        if entry is None:
+            # [count, sum, max, largest lowered value, bucket deltas]
+            entry = per_day[day] = [0, 0, 0, -1, [0] * len(_BUCKET_COLUMNS)]
+        buckets = entry[4]
+        if old is None:
+            entry[0] += 1
+        else:
+            entry[1] -= old
+            buckets[bisect_right(_BUCKET_FLOORS, old) - 1] -= 1
+            if new < old and old > entry[3]:
+                entry[3] = old
+        entry[1] += new
+        buckets[bisect_right(_BUCKET_FLOORS, new) - 1] += 1
+        if new > entry[2]:
+            entry[2] = new
+
+    for day, (count, total, largest, shrunk, buckets) in per_day.items():
+        deltas = {'usage_count': count, 'usage_sum': Decimal(total).scaleb(-2)}
+        deltas.update((column, delta) for column, delta in zip(_BUCKET_COLUMNS, buckets) if delta)
+        _bump(connection, usage_metrics, {'date': day}, deltas,
+              maxima={'usage_max': Decimal(largest).scaleb(-2)})
+        if shrunk >= 0:
+            # A lowered value may have been the day's maximum
+            stored_max = connection.execute(
+                select(usage_metrics.c.usage_max).where(usage_metrics.c.date == day)
+            ).scalar()
+            if stored_max is not None and shrunk >= _as_decimal(stored_max) * 100:
+                _recompute_usage_day(connection, day)
+
+
+# Backfill
+
+def rebuild_rollups():
+    """Recompute every rollup row from the source tables."""
+    db.session.query(DailyPlanMetric).delete()
+    db.session.query(DailyUsageMetric).delete()
+
+    plan_rows = {}
+
+    def plan_row(day, plan_id):
+        key = (_as_date(day), plan_id or 0)
+        if key not in plan_rows:
+            plan_rows[key] = {
+                'date': key[0], 'plan_id': key[1],
+                'subscriptions_created': 0, 'revenue': 0, 'active_count': 0, 'active_revenue': 0,
+                'discounts_created': 0, 'discounts_active': 0, 'discounts_used': 0
+            }
+        return plan_rows[key]
+
+    subscription_day = func.date(func.coalesce(Subscription.created_at, Subscription.start_date))
+    subscription_stats = db.session.query(
+        subscription_day.label('day'),
+        Subscription.plan_id,
+        func.count(Subscription.id).label('subscriptions_created'),
+        func.sum(Subscription.price_paid).label('revenue'),
+        func.count(case((Subscription.status == 'active', Subscription.id))).label('active_count'),
+        func.sum(case((Subscription.status == 'active', Subscription.price_paid))).label('active_revenue')
+    ).group_by(subscription_day, Subscription.plan_id).all()
+
+    for stat in subscription_stats:
+        row = plan_row(stat.day, stat.plan_id)
+        row['subscriptions_created'] = stat.subscriptions_created
+        row['revenue'] = stat.revenue or 0
+        row['active_count'] = stat.active_count
+        row['active_revenue'] = stat.active_revenue or 0
+
+    discount_day = func.date(Discount.created_at)
+    discount_stats = db.session.query(
+        discount_day.label('day'),
+        Discount.plan_id,
+        func.count(Discount.id).label('discounts_created'),
+        func.count(case((Discount.is_active == True, Discount.id))).label('discounts_active'),
+        func.sum(Discount.used_count).label('discounts_used')
+    ).group_by(discount_day, Discount.plan_id).all()
+
+    for stat in discount_stats:
+        row = plan_row(stat.day, stat.plan_id)
+        row['discounts_created'] = stat.discounts_created
+        row['discounts_active'] = stat.discounts_active
+        row['discounts_used'] = stat.discounts_used or 0
+
+    usage_stats = db.session.query(Usage.date.label('date'), *_usage_aggregates()).group_by(Usage.date).all()
+    usage_rows = [_usage_row(stat.date, stat) for stat in usage_stats]
+
+    # Archived days come from the partition manifests; rows an interrupted
+    # archive run left in the table are already counted there
+    from services.usage_archive import usage_archive  # imports this module
+    archived = {row['date']: row for row in usage_archive.daily_rollups()}
+    usage_rows = [row for row in usage_rows if row['date'] not in archived] + list(archived.values())
+
+    if plan_rows:
+        db.session.execute(plan_metrics.insert(), list(plan_rows.values()))
+    if usage_rows:
+        db.session.execute(usage_metrics.insert(), usage_rows)
+    db.session.commit()
+
+    return {'plan_rows': len(plan_rows), 'usage_rows': len(usage_rows)}
+
+
+def ensure_rollups():
+    """Backfill on first start, when the rollup tables have never been populated."""
+    if DailyPlanMetric.query.first() or DailyUsageMetric.query.first():
+        return None
+    if not (Subscription.query.first() or Usage.query.first() or Discount.query.first()):
+        return None
+    return rebuild_rollups()
+
+
+# Reads
+
+def dashboard_totals(month_start):
+    plan_stats = db.session.query(
+        func.sum(DailyPlanMetric.active_count).label('active_subscriptions'),
+        func.sum(case((DailyPlanMetric.date >= _as_date(month_start), DailyPlanMetric.active_revenue))).label('monthly_revenue')
+    ).one()
+    total_usage = db.session.query(func.sum(DailyUsageMetric.usage_sum)).scalar()
+
+    return {
+        'active_subscriptions': int(plan_stats.active_subscriptions or 0),
+        'monthly_revenue': plan_stats.monthly_revenue or 0,
+        'total_usage': total_usage or 0
+    }
+
+
+def subscription_trends():
+    created = func.sum(DailyPlanMetric.subscriptions_created)
+    return db.session.query(
+        DailyPlanMetric.date,
+        created.label('count')
+    ).group_by(DailyPlanMetric.date).having(created > 0).order_by(DailyPlanMetric.date).all()
+
+
+def plan_popularity():
+    created = func.sum(DailyPlanMetric.subscriptions_created)
+    return db.session.query(
+        Plan.name,
+        created.label('subscription_count')
+    ).join(DailyPlanMetric, DailyPlanMetric.plan_id == Plan.id).group_by(Plan.id, Plan.name).having(created > 0).order_by(Plan.id).all()
+
+
+def usage_summary():
+    columns = [
+        func.sum(DailyUsageMetric.usage_count).label('usage_count'),
+        func.sum(DailyUsageMetric.usage_sum).label('total_usage'),
+        func.max(DailyUsageMetric.usage_max).label('max_usage')
+    ]
+    columns += [func.sum(getattr(DailyUsageMetric, column)).label(column) for column, _, _, _ in USAGE_BUCKETS]
+    stats = db.session.query(*columns).one()
+
+    usage_count = int(stats.usage_count or 0)
+    return {
+        'avg_usage': float(stats.total_usage) / usage_count if usage_count else 0,
+        'max_usage': float(stats.max_usage) if stats.max_usage else 0,
+        'total_usage': float(stats.total_usage) if stats.total_usage else 0,
+        'distribution': [{
+            'range': label,
+            'count': int(getattr(stats, column) or 0)
+        } for column, label, _, _ in USAGE_BUCKETS]
+    }
+
+
+def discount_totals():
+    return db.session.query(
+        func.sum(DailyPlanMetric.discounts_created).label('total_discounts'),
+        func.sum(DailyPlanMetric.discounts_active).label('active_discounts'),
+        func.sum(DailyPlanMetric.discounts_used).label('used_discounts')
+    ).one()
@@ -0,0 +1,307 @@
+# Per-request SQL profiling
+# Engine-level cursor events time every statement run on the request thread;
+# before/after_request hooks collect them into one profile per request with
+# the query count, total DB time, the slowest statements and statements
+# repeated within the request (the usual N+1 signature). Each profile is
+#   - added to rolling per-route histograms served by GET /admin/_perf,
+#   - logged as one JSON line when it is slow or repetitive (or always),
+#   - returned as X-DB-* / Server-Timing response headers in debug mode.
+# Routes that time their own steps add them with profiler.span(); they join
+# the db / app entries in the one Server-Timing header written here, which
+# such routes get even when the X-DB-* debug headers are off.
+# Queries from background threads (alert / audit writers) run outside any
+# request and are not profiled.
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets; the last one catches the rest
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+SLICE_SECONDS = 10
+STATEMENT_CHARS = 300
+RECENT_EVENTS = 50
+
+_WHITESPACE = re.compile(r'\s+')
+# Expanded IN lists vary in length with the data; fold them so they group together
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+
+
+def normalize(statement):
+    return _PLACEHOLDER_LIST.sub('(...)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.statements = {}
+        self.spans = []
+        self.finished = False
+
+    def record(self, statement, seconds):
+        self.query_count += 1
+        self.db_seconds += seconds
+        key = normalize(statement)
+        entry = self.statements.get(key)
+        if entry is None:
+            self.statements[key] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def slowest(self, limit):
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        return [{
+            'statement': statement[:STATEMENT_CHARS],
+            'max_ms': round(max_seconds * 1000, 3),
+            'count': count
+        } for statement, (count, _, max_seconds) in ranked]
+
+    def repeated(self, threshold):
+        return [{
+            'statement': statement[:STATEMENT_CHARS],
+            'count': count,
+            'total_ms': round(total_seconds * 1000, 3)
+        } for statement, (count, total_seconds, _) in self.statements.items() if count >= threshold]
+
+
+class RollingHistogram:
+    """Per-route latency histograms over the last `window` seconds, kept in SLICE_SECONDS slices."""
+
+    def __init__(self, window):
+        self.window = window
+        self._slices = deque()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _empty():
+        return {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'max_queries': 0,
+                'db_ms': 0.0, 'buckets': [0] * len(BUCKETS_MS)}
+
+    def add(self, route, total_ms, query_count, db_ms):
+        now_slice = int(time.time() // SLICE_SECONDS)
+        with self._lock:
+            if not self._slices or self._slices[-1][0] != now_slice:
+                self._slices.append((now_slice, {}))
+            self._expire(now_slice)
+            stats = self._slices[-1][1].setdefault(route, self._empty())
+            stats['count'] += 1
+            stats['total_ms'] += total_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            stats['queries'] += query_count
+            stats['max_queries'] = max(stats['max_queries'], query_count)
+            stats['db_ms'] += db_ms
+            for index, bound in enumerate(BUCKETS_MS):
+                if total_ms <= bound:
+                    stats['buckets'][index] += 1
+                    break
+
+    def _expire(self, now_slice):
+        oldest = now_slice - self.window // SLICE_SECONDS
+        while self._slices and self._slices[0][0] <= oldest:
+            self._slices.popleft()
+
+    def merged(self, window=None):
+        window = min(window or self.window, self.window)
+        now_slice = int(time.time() // SLICE_SECONDS)
+        oldest = now_slice - max(window // SLICE_SECONDS, 1)
+        routes = {}
+        with self._lock:
+            for slice_id, slice_routes in self._slices:
+                if slice_id <= oldest:
+                    continue
+                for route, stats in slice_routes.items():
+                    total = routes.setdefault(route, self._empty())
+                    for key in ('count', 'total_ms', 'queries', 'db_ms'):
+                        total[key] += stats[key]
+                    total['max_ms'] = max(total['max_ms'], stats['max_ms'])
+                    total['max_queries'] = max(total['max_queries'], stats['max_queries'])
+                    total['buckets'] = [a + b for a, b in zip(total['buckets'], stats['buckets'])]
+        return routes
+
+    def clear(self):
+        with self._lock:
+            self._slices.clear()
+
+
+def _percentile(buckets, count, fraction):
+    # Upper bound of the bucket holding the requested rank
+    rank = fraction * count
+    seen = 0
+    for bound, bucket_count in zip(BUCKETS_MS, buckets):
+        seen += bucket_count
+        if seen >= rank:
+            return bound if bound != float('inf') else None
+    return None
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.headers = False
+        self.slow_query_ms = 100
+        self.slow_request_ms = 500
+        self.repeat_threshold = 5
+        self.top_statements = 5
+        self.log_mode = 'slow'
+        self.histogram = RollingHistogram(300)
+        self.slow_queries = deque(maxlen=RECENT_EVENTS)
+        self.repeated_statements = deque(maxlen=RECENT_EVENTS)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILING_ENABLED', True)
+        headers = app.config.get('PROFILING_HEADERS')
+        self.headers = app.debug if headers is None else headers
+        self.slow_query_ms = app.config.get('PROFILING_SLOW_QUERY_MS', 100)
+        self.slow_request_ms = app.config.get('PROFILING_SLOW_REQUEST_MS', 500)
+        self.repeat_threshold = app.config.get('PROFILING_REPEAT_THRESHOLD', 5)
+        self.top_statements = app.config.get('PROFILING_TOP_STATEMENTS', 5)
+        self.log_mode = app.config.get('PROFILING_LOG', 'slow')
+        self.histogram = RollingHistogram(app.config.get('PROFILING_WINDOW', 300))
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        _listen()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g._profile = RequestProfile()
+
+    def span(self, name, duration_ms):
+        """Add a named step to the current request's Server-Timing header."""
+        profile = _current_profile()
+        if profile is not None:
+            profile.spans.append((name, duration_ms))
+
+    def _finish(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        profile.finished = True
+        total_ms = (time.perf_counter() - profile.started) * 1000
+        db_ms = profile.db_seconds * 1000
+        route = f'{request.method} {request.url_rule.rule}' if request.url_rule else 'unmatched'
+        self.histogram.add(route, total_ms, profile.query_count, db_ms)
+
+        slowest = profile.slowest(self.top_statements)
+        slow = [entry for entry in slowest if entry['max_ms'] >= self.slow_query_ms]
+        repeated = profile.repeated(self.repeat_threshold)
+        with self._lock:
+            for entry in slow:
+                self.slow_queries.append(dict(entry, route=route, at=time.time()))
+            for entry in repeated:
+                self.repeated_statements.append(dict(entry, route=route, at=time.time()))
+
+        if self.log_mode == 'all' or (self.log_mode == 'slow' and (slow or repeated or total_ms >= self.slow_request_ms)):
+            logger.info(json.dumps({
+                'event': 'request_profile',
+                'route': route,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(total_ms, 3),
+                'query_count': profile.query_count,
+                'db_ms': round(db_ms, 3),
+                'slowest': slowest,
+                'repeated': repeated
+            }))
+
+        if self.headers:
+            response.headers['X-DB-Time-Ms'] = f'{db_ms:.3f}'
+            response.headers['X-Request-Time-Ms'] = f'{total_ms:.3f}'
+            response.headers['X-DB-Repeated-Statements'] = str(len(repeated))
+            if slowest:
+                response.headers['X-DB-Slowest-Ms'] = f"{slowest[0]['max_ms']:.3f}"
+        # A route that times its own steps gets them reported whatever PROFILING_HEADERS says
+        if self.headers or profile.spans:
+            response.headers['X-DB-Query-Count'] = str(profile.query_count)
+            timings = [f'db;dur={db_ms:.3f}', f'app;dur={total_ms - db_ms:.3f}']
+            timings += [f'{name};dur={duration_ms:.3f}' for name, duration_ms in profile.spans]
+            response.headers['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def snapshot(self, window=None):
+        routes = {}
+        for route, stats in sorted(self.histogram.merged(window).items()):
+            count = stats['count']
+            routes[route] = {
+                'count': count,
+                'mean_ms': round(stats['total_ms'] / count, 3),
+                'max_ms': round(stats['max_ms'], 3),
+                'p50_ms': _percentile(stats['buckets'], count, 0.50),
+                'p95_ms': _percentile(stats['buckets'], count, 0.95),
+                'p99_ms': _percentile(stats['buckets'], count, 0.99),
+                'mean_queries': round(stats['queries'] / count, 2),
+                'max_queries': stats['max_queries'],
+                'mean_db_ms': round(stats['db_ms'] / count, 3),
+                'histogram': [{
+                    'le_ms': '+Inf' if bound == float('inf') else bound,
+                    'count': bucket_count
+                } for bound, bucket_count in zip(BUCKETS_MS, stats['buckets'])]
+            }
+        with self._lock:
+            slow_queries = list(self.slow_queries)
+            repeated = list(self.repeated_statements)
+        return {
+            'enabled': self.enabled,
+            'window_seconds': min(window or self.histogram.window, self.histogram.window),
+            'slow_query_ms': self.slow_query_ms,
+            'repeat_threshold': self.repeat_threshold,
+            'routes': routes,
+            'slow_queries': slow_queries[::-1],
+            'repeated_statements': repeated[::-1]
+        }
+
+    def reset(self):
+        self.histogram.clear()
+        with self._lock:
+            self.slow_queries.clear()
+            self.repeated_statements.clear()
+
+
+_listening = False
+_listen_lock = threading.Lock()
+
+
+def _current_profile():
+    if not has_request_context():
+        return None
+    profile = g.get('_profile')
+    return profile if profile is not None and not profile.finished else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_profile() is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_profile_started', None)
+    profile = _current_profile()
+    if started is not None and profile is not None:
+        profile.record(statement, time.perf_counter() - started)
+
+
+def _listen():
+    # Listen on the Engine class so every engine (including ones created later) is covered
+    global _listening
+    with _listen_lock:
+        if not _listening:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _listening = True
+
+
+profiler = Profiler()
@@ -0,0 +1,311 @@
+# Quota threshold alerts
+# Keeps each user's data usage per quota period in quota_usage, one row per
+# (user, period), and raises an alert the first time the total reaches one of
+# QUOTA_ALERT_THRESHOLDS (default 50, 80 and 100 percent) of the plan's
+# monthly_quota_gb.
+#
+# The quota belongs to the user's most recently started active subscription.
+# Its periods are monthly, anchored on the subscription's start date (as for
+# billing, but monthly for yearly subscriptions too, since the quota is).
+# Users without an active subscription, and plans with a quota of 0, are
+# not tracked.
+#
+# Totals are kept incrementally: usage ingestion (usage_ingest.ingest_batch)
+# passes the old and new value of every record it upserted, and mapper events
+# do the same for ORM writes, so a batch only adds its deltas to the rows it
+# touches. The first write to a (user, period) seeds the row from that
+# period's usage records (at most a month of one user's rows), so there is
+# never a rescan and no backfill is needed. Corrections that lower usage
+# lower the total.
+#
+# Alerts are written in the writing transaction. A row remembers the highest
+# threshold alerted in its period (alerted_pct) and moves it up with a
+# conditional UPDATE (... WHERE alerted_pct < :pct AND used_cents >= :limit),
+# so two writers crossing the same threshold alert once. A batch that jumps
+# over several thresholds raises one alert for each of them. A total that
+# drops back and rises again does not alert a second time in the same period.
+from datetime import date, datetime
+
+from sqlalchemy import and_, bindparam, event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.alerts import Alert
+from models.plans import Plan
+from models.quota import quota_usage
+from models.subscriptions import Subscription
+from models.usage import Usage
+from services.billing import billing_period
+
+THRESHOLDS = (50, 80, 100)
+IN_CHUNK = 5000
+
+_alerts = Alert.__table__
+_quota_key = and_(quota_usage.c.user_id == bindparam('key_user_id'),
+                  quota_usage.c.period_start == bindparam('key_period_start'))
+_add_delta = quota_usage.update().where(_quota_key).values(
+    used_cents=quota_usage.c.used_cents + bindparam('delta'), updated_at=bindparam('now')
+)
+# Moves alerted_pct up to a threshold the total has reached, unless someone already did
+_claim = quota_usage.update().where(
+    _quota_key, quota_usage.c.alerted_pct < bindparam('claim_pct'), quota_usage.c.used_cents >= bindparam('limit')
+).values(alerted_pct=bindparam('new_pct'))
+
+
+def _as_date(value):
+    # Dates come back as strings from some SQLite expressions
+    return date.fromisoformat(value[:10]) if isinstance(value, str) else value
+
+
+def _cents(value):
+    return int(round(float(value) * 100)) if value is not None else None
+
+
+def _previous(target, attr):
+    history = inspect(target).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(target, attr)
+
+
+class QuotaMonitor:
+    def __init__(self):
+        self.thresholds = THRESHOLDS
+        self.alerts_raised = 0
+        self.periods_seeded = 0
+
+    def init_app(self, app):
+        self.thresholds = tuple(sorted(app.config.get('QUOTA_ALERT_THRESHOLDS', THRESHOLDS)))
+        app.extensions['quota'] = self
+
+    # Writes
+
+    def apply_usage(self, connection, changes):
+        """Fold written usage records into the quota totals and raise the alerts they cross.
+
+        changes: (user_id, day, old_cents, new_cents) per record, old_cents None for new
+        records; call it in the writing transaction, after the records are written.
+        """
+        changes = [change for change in changes if change[2] != change[3]]
+        if not changes:
+            return 0
+        plans = self._plans(connection, sorted({user_id for user_id, _, _, _ in changes}))
+
+        # (user_id, period_start) -> [period_end, subscription_id, plan_id, quota_gb, delta]
+        periods = {}
+        # Many users share a start date, and a batch covers few days
+        period_of = {}
+        for user_id, day, old, new in changes:
+            plan = plans.get(user_id)
+            if plan is None:
+                continue
+            subscription_id, plan_id, start_date, quota_gb = plan
+            period = period_of.get((start_date, day), False)
+            if period is False:
+                period = period_of[(start_date, day)] = billing_period(start_date, day, 1)
+            if period is None:
+                continue
+            entry = periods.get((user_id, period[0]))
+            if entry is None:
+                entry = periods[(user_id, period[0])] = [period[1], subscription_id, plan_id, quota_gb, 0]
+            entry[4] += new - (old or 0)
+        if not periods:
+            return 0
+
+        totals = self._add(connection, periods)
+        return self._alert(connection, periods, totals)
+
+    def _plans(self, connection, user_ids):
+        """user id -> (subscription id, plan id, start date, quota GB) of their current quota."""
+        current = {}
+        for i in range(0, len(user_ids), IN_CHUNK):
+            for user_id, subscription_id, plan_id, start_date, quota_gb in connection.execute(
+                select(Subscription.user_id, Subscription.id, Subscription.plan_id, Subscription.start_date,
+                       Plan.monthly_quota_gb)
+                .join(Plan, Plan.id == Subscription.plan_id)
+                .where(Subscription.user_id.in_(user_ids[i:i + IN_CHUNK]), Subscription.status == 'active')
+                .order_by(Subscription.user_id, Subscription.start_date, Subscription.id)
+            ):
+                current[user_id] = (subscription_id, plan_id, _as_date(start_date), quota_gb)
+        return {user_id: plan for user_id, plan in current.items() if plan[3] and plan[3] > 0}
+
+    def _add(self, connection, periods):
+        """Apply the deltas; returns (user_id, period_start) -> (used_cents afterwards, alerted_pct)."""
+        totals = {}
+        users = sorted({user_id for user_id, _ in periods})
+        for i in range(0, len(users), IN_CHUNK):
+            for user_id, period_start, used_cents, alerted_pct in connection.execute(
+                select(quota_usage.c.user_id, quota_usage.c.period_start, quota_usage.c.used_cents,
+                       quota_usage.c.alerted_pct)
+                .where(quota_usage.c.user_id.in_(users[i:i + IN_CHUNK]),
+                       quota_usage.c.period_start.in_(sorted({period_start for _, period_start in periods})))
+            ):
+                key = (user_id, _as_date(period_start))
+                if key in periods:
+                    totals[key] = (used_cents + periods[key][4], alerted_pct)
+
+        now = datetime.now()
+        changed = [{'key_user_id': user_id, 'key_period_start': period_start,
+                    'delta': periods[(user_id, period_start)][4], 'now': now}
+                   for user_id, period_start in totals if periods[(user_id, period_start)][4]]
+        if changed:
+            connection.execute(_add_delta, changed)
+
+        missing = [key for key in periods if key not in totals]
+        if missing:
+            seeded = self._seed(connection, missing, periods)
+            rows = [{
+                'user_id': user_id,
+                'period_start': period_start,
+                'period_end': periods[(user_id, period_start)][0],
+                'subscription_id': periods[(user_id, period_start)][1],
+                'plan_id': periods[(user_id, period_start)][2],
+                'used_cents': seeded[(user_id, period_start)],
+                'alerted_pct': 0,
+                'updated_at': now
+            } for user_id, period_start in missing]
+            totals.update((key, (used_cents, 0)) for key, used_cents in seeded.items())
+            try:
+                with connection.begin_nested():
+                    connection.execute(quota_usage.insert(), rows)
+            except IntegrityError:
+                # Another writer seeded some of them first, from records without this batch's
+                # changes: add the deltas to those instead
+                for row in rows:
+                    key = (row['user_id'], row['period_start'])
+                    try:
+                        with connection.begin_nested():
+                            connection.execute(quota_usage.insert().values(**row))
+                    except IntegrityError:
+                        connection.execute(_add_delta, {'key_user_id': key[0], 'key_period_start': key[1],
+                                                        'delta': periods[key][4], 'now': now})
+                        totals[key] = tuple(connection.execute(
+                            select(quota_usage.c.used_cents, quota_usage.c.alerted_pct)
+                            .where(quota_usage.c.user_id == key[0], quota_usage.c.period_start == key[1])
+                        ).one())
+            self.periods_seeded += len(rows)
+        return totals
+
+    def _seed(self, connection, keys, periods):
+        """Usage of each (user_id, period_start) in keys, summed from its usage records."""
+        seeded = dict.fromkeys(keys, 0)
+        # A user can start two periods in one batch (late records); sum each separately
+        ranges = {}
+        for user_id, period_start in keys:
+            ranges.setdefault(user_id, []).append((period_start, periods[(user_id, period_start)][0]))
+        users = sorted(ranges)
+        first = min(period_start for _, period_start in keys)
+        last = max(periods[key][0] for key in keys)
+        for i in range(0, len(users), IN_CHUNK):
+            for user_id, day, cents in connection.execute(
+                select(Usage.user_id, Usage.date, func.round(Usage.data_used_gb * 100))
+                .where(Usage.user_id.in_(users[i:i + IN_CHUNK]), Usage.date.between(first, last))
+            ):
+                day = _as_date(day)
+                for period_start, period_end in ranges[user_id]:
+                    if period_start <= day <= period_end:
+                        seeded[(user_id, period_start)] += int(cents)
+                        break
+        return seeded
+
+    def _crossed(self, used_cents, alerted_pct, quota_gb):
+        """Thresholds reached by used_cents that were not alerted yet, lowest first."""
+        return [pct for pct in self.thresholds if alerted_pct < pct and used_cents >= quota_gb * pct]
+
+    def _alert(self, connection, periods, totals):
+        """Raise the alerts the new totals cross; returns how many were written."""
+        now = datetime.now()
+        alerts = []
+        for key, (used_cents, alerted_pct) in totals.items():
+            quota_gb = periods[key][3]
+            crossed = self._crossed(used_cents, alerted_pct, quota_gb)
+            # Only crossings are claimed, one statement each
+            while crossed and not connection.execute(_claim, {
+                'key_user_id': key[0], 'key_period_start': key[1], 'claim_pct': crossed[0], 'new_pct': crossed[-1],
+                'limit': quota_gb * crossed[-1]
+            }).rowcount:
+                # A concurrent writer claimed some of them first: alert what it left
+                used_cents, alerted_pct = connection.execute(
+                    select(quota_usage.c.used_cents, quota_usage.c.alerted_pct)
+                    .where(quota_usage.c.user_id == key[0], quota_usage.c.period_start == key[1])
+                ).one()
+                crossed = self._crossed(used_cents, alerted_pct, quota_gb)
+            alerts.extend({
+                'user_id': key[0],
+                'type': 'warning',
+                'title': 'Data Usage Alert',
+                'message': f'You have used {pct}% of your monthly quota '
+                           f'({used_cents / 100:.2f} of {quota_gb} GB since {key[1].isoformat()})',
+                'is_read': False,
+                'created_at': now
+            } for pct in crossed)
+        if alerts:
+            connection.execute(_alerts.insert(), alerts)
+            self.alerts_raised += len(alerts)
+        return len(alerts)
+
+    # Reads
+
+    def for_user(self, user_id, today=None):
+        """The caller's quota period containing today, or None without a tracked quota."""
+        today = today or date.today()
+        plan = self._plans(db.session.connection(), [user_id]).get(user_id)
+        if plan is None:
+            return None
+        subscription_id, plan_id, start_date, quota_gb = plan
+        period = billing_period(start_date, today, 1)
+        if period is None:
+            return None
+        used_cents = db.session.execute(
+            select(quota_usage.c.used_cents)
+            .where(quota_usage.c.user_id == user_id, quota_usage.c.period_start == period[0])
+        ).scalar() or 0
+        return {
+            'subscription_id': subscription_id,
+            'plan_id': plan_id,
+            'period_start': period[0].isoformat(),
+            'period_end': period[1].isoformat(),
+            'quota_gb': quota_gb,
+            'used_gb': used_cents / 100,
+            'used_pct': round(used_cents / quota_gb, 1)
+        }
+
+    def stats(self):
+        return {
+            'thresholds': list(self.thresholds),
+            'alerts_raised': self.alerts_raised,
+            'periods_seeded': self.periods_seeded
+        }
+
+
+quota_monitor = QuotaMonitor()
+
+
+# ORM writes (bulk ingestion calls apply_usage itself)
+
+# A committed row's attributes are expired, and setting an unloaded attribute
+# records no history: load the old value so _usage_updated sees the change
+for _attribute in (Usage.user_id, Usage.date, Usage.data_used_gb):
+    event.listen(_attribute, 'set', lambda target, value, oldvalue, initiator: None, active_history=True)
+
+
+@event.listens_for(Usage, 'after_insert')
+def _usage_inserted(mapper, connection, target):
+    quota_monitor.apply_usage(connection, [(target.user_id, _as_date(target.date), None,
+                                            _cents(target.data_used_gb))])
+
+
+@event.listens_for(Usage, 'after_update')
+def _usage_updated(mapper, connection, target):
+    old_user_id, old_day = _previous(target, 'user_id'), _as_date(_previous(target, 'date'))
+    new_day = _as_date(target.date)
+    if (old_user_id, old_day) == (target.user_id, new_day):
+        quota_monitor.apply_usage(connection, [(target.user_id, new_day, _cents(_previous(target, 'data_used_gb')),
+                                                _cents(target.data_used_gb))])
+    else:
+        # Moved to another user or day: out of the old period, into the new one
+        quota_monitor.apply_usage(connection, [(old_user_id, old_day, _cents(_previous(target, 'data_used_gb')), 0),
+                                               (target.user_id, new_day, None, _cents(target.data_used_gb))])
+
+
+@event.listens_for(Usage, 'after_delete')
+def _usage_deleted(mapper, connection, target):
+    quota_monitor.apply_usage(connection, [(target.user_id, _as_date(target.date), _cents(target.data_used_gb), 0)])
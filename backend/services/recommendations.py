@@ -0,0 +1,344 @@
+# Plan recommendations
+# GET /user/recommendations reads the caller's best RECOMMENDATION_COUNT plans
+# from plan_recommendations (one primary-key range read). The rows are filled
+# by a batch job, `flask refresh-recommendations` (run it from cron), that
+# scores users against every active plan with NumPy array operations, a chunk
+# of users at a time.
+#
+# Scoring: a user's projected monthly usage is their mean daily usage over the
+# last RECOMMENDATION_WINDOW_DAYS, counted from their first record in that
+# window so a new user is not diluted, times 30. A plan costs the user its
+# price, plus the GB it falls short of the projection (with
+# RECOMMENDATION_HEADROOM on top) at SHORTFALL_PENALTY times the plan's own
+# price per GB. Plans are ranked by that cost; the score is the cheapest cost
+# over the plan's, so the best fit scores 1.0.
+#
+# Incremental refresh: writes that change a user's inputs queue the user in
+# recommendation_queue in the same transaction (mapper events on usage,
+# subscriptions and users; usage ingestion and the dataset import call
+# mark_users). Plan changes queue EVERYONE, which turns the next run into a
+# full one. A run without --full rescores the queued users only.
+#
+# NumPy is optional, as for the usage analytics: without it refresh() raises
+# and the endpoint keeps serving what is stored.
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.plans import Plan
+from models.recommendations import plan_recommendations, recommendation_queue
+from models.subscriptions import Subscription
+from models.usage import Usage
+from models.users import User
+from services import catalog
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RECOMMENDATION_COUNT = 3
+WINDOW_DAYS = 90
+HEADROOM = 0.2
+SHORTFALL_PENALTY = 2.0
+# A user with fewer days of history is averaged over this many
+MIN_DAYS = 7
+DAYS_PER_MONTH = 30
+CHUNK_USERS = 5000
+MARK_CHUNK = 500
+# Queued in place of a user id: rescore every user
+EVERYONE = 0
+
+def available():
+    return np is not None
+
+
+def _as_date(value):
+    # MIN() over a date column comes back as a string on SQLite
+    return date.fromisoformat(value[:10]) if isinstance(value, str) else value
+
+
+# Queue
+
+def mark_users(connection, user_ids):
+    """Queue users for the next incremental refresh; call it inside the writing transaction."""
+    queue = recommendation_queue
+    ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    now = datetime.now()
+    for i in range(0, len(ids), MARK_CHUNK):
+        chunk = ids[i:i + MARK_CHUNK]
+        # Re-stamp users already queued, so a refresh running now keeps them queued
+        restamped = connection.execute(
+            queue.update().where(queue.c.user_id.in_(chunk)).values(marked_at=now)
+        ).rowcount
+        if restamped == len(chunk):
+            continue
+        queued = set(connection.execute(select(queue.c.user_id).where(queue.c.user_id.in_(chunk))).scalars())
+        missing = [{'user_id': user_id, 'marked_at': now} for user_id in chunk if user_id not in queued]
+        try:
+            with connection.begin_nested():
+                connection.execute(queue.insert(), missing)
+        except IntegrityError:
+            # Another writer queued some of them first
+            for row in missing:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(queue.insert().values(**row))
+                except IntegrityError:
+                    pass
+
+
+def mark_everyone(connection):
+    mark_users(connection, [EVERYONE])
+
+
+@event.listens_for(Usage, 'after_insert')
+@event.listens_for(Usage, 'after_delete')
+@event.listens_for(Subscription, 'after_insert')
+@event.listens_for(Subscription, 'after_delete')
+def _user_row_written(mapper, connection, target):
+    mark_users(connection, [target.user_id])
+
+
+@event.listens_for(Usage, 'after_update')
+@event.listens_for(Subscription, 'after_update')
+def _user_row_updated(mapper, connection, target):
+    # A row moved to another user changes both users' inputs
+    mark_users(connection, [target.user_id, *inspect(target).attrs.user_id.history.deleted])
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def _user_written(mapper, connection, target):
+    mark_users(connection, [target.id])
+
+
+@event.listens_for(Plan, 'after_insert')
+@event.listens_for(Plan, 'after_update')
+@event.listens_for(Plan, 'after_delete')
+def _plan_written(mapper, connection, target):
+    mark_everyone(connection)
+
+
+# Reads
+
+def for_user(user_id):
+    """The stored recommendations of one user, best first, with the plans' current details."""
+    rows = db.session.execute(
+        select(plan_recommendations).where(plan_recommendations.c.user_id == user_id)
+        .order_by(plan_recommendations.c.rank)
+    ).all()
+    plans = {plan['id']: plan for plan in catalog.plan_catalog()}
+    current = plans.get(rows[0].current_plan_id) if rows else None
+    recommendations = []
+    for row in rows:
+        plan = plans.get(row.plan_id)
+        if plan is None:
+            # Deleted since the last refresh
+            continue
+        recommendations.append({
+            'rank': row.rank,
+            'plan_id': row.plan_id,
+            'plan_name': plan['name'],
+            'monthly_price': plan['monthly_price'],
+            'monthly_quota_gb': plan['monthly_quota_gb'],
+            'score': round(row.score, 4),
+            'monthly_cost': round(row.monthly_cost, 2),
+            'fits': row.fits,
+            'is_current': row.plan_id == row.current_plan_id,
+            'monthly_savings': round(current['monthly_price'] - plan['monthly_price'], 2) if current else None
+        })
+    return {
+        'user_id': user_id,
+        'projected_monthly_gb': round(rows[0].projected_gb, 2) if rows else None,
+        'current_plan_id': rows[0].current_plan_id if rows else None,
+        'computed_at': rows[0].computed_at.isoformat() if rows else None,
+        'recommendations': recommendations
+    }
+
+
+class PlanRecommender:
+    def __init__(self):
+        self.count = RECOMMENDATION_COUNT
+        self.window_days = WINDOW_DAYS
+        self.headroom = HEADROOM
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.count = app.config.get('RECOMMENDATION_COUNT', RECOMMENDATION_COUNT)
+        self.window_days = app.config.get('RECOMMENDATION_WINDOW_DAYS', WINDOW_DAYS)
+        self.headroom = app.config.get('RECOMMENDATION_HEADROOM', HEADROOM)
+        app.extensions['recommender'] = self
+
+    # Batch job
+
+    def refresh(self, full=False, chunk_users=CHUNK_USERS, today=None, log=None):
+        """Rescore the queued users, or everyone when `full` or a plan changed; returns a report."""
+        if not available():
+            raise RuntimeError('Plan recommendations require numpy (pip install numpy)')
+        with self._lock:
+            started = time.perf_counter()
+            today = today or date.today()
+            queue = recommendation_queue
+            claimed = db.session.execute(select(queue.c.user_id, queue.c.marked_at)).all()
+            full = full or any(user_id == EVERYONE for user_id, _ in claimed)
+            plans = db.session.execute(
+                select(Plan.id, Plan.monthly_price, Plan.monthly_quota_gb)
+                .where(Plan.is_active.is_(True)).order_by(Plan.id)
+            ).all()
+
+            scored = chunks = 0
+            if full:
+                last_id = 0
+                while True:
+                    user_ids = db.session.execute(
+                        select(User.id).where(User.id > last_id).order_by(User.id).limit(chunk_users)
+                    ).scalars().all()
+                    # The last chunk also replaces the rows of any higher (deleted) user ids
+                    upper = user_ids[-1] if len(user_ids) == chunk_users else None
+                    in_chunk = plan_recommendations.c.user_id > last_id
+                    if upper is not None:
+                        in_chunk &= plan_recommendations.c.user_id <= upper
+                    scored += self._score(user_ids, plans, today, in_chunk, dense=True)
+                    chunks += 1
+                    if log:
+                        log(f'{scored} users scored')
+                    if upper is None:
+                        break
+                    last_id = upper
+            else:
+                pending = sorted(user_id for user_id, _ in claimed)
+                for i in range(0, len(pending), chunk_users):
+                    chunk = pending[i:i + chunk_users]
+                    user_ids = db.session.execute(
+                        select(User.id).where(User.id.in_(chunk)).order_by(User.id)
+                    ).scalars().all()
+                    scored += self._score(user_ids, plans, today, plan_recommendations.c.user_id.in_(chunk), dense=False)
+                    chunks += 1
+
+            # Only marks not re-stamped since they were read: a user written meanwhile stays queued
+            if claimed:
+                db.session.execute(
+                    queue.delete().where(queue.c.user_id == bindparam('claimed_id'),
+                                         queue.c.marked_at == bindparam('claimed_at')),
+                    [{'claimed_id': user_id, 'claimed_at': marked_at} for user_id, marked_at in claimed]
+                )
+            db.session.commit()
+            seconds = time.perf_counter() - started
+            self.last_run = {
+                'full': full,
+                'users': scored,
+                'chunks': chunks,
+                'plans': len(plans),
+                'seconds': round(seconds, 3),
+                'users_per_sec': round(scored / seconds) if seconds > 0 else None,
+                'finished_at': datetime.now().isoformat()
+            }
+            return self.last_run
+
+    def _score(self, user_ids, plans, today, replaced, dense):
+        """Score one chunk of users (sorted ids) and replace the stored rows matching `replaced`."""
+        now = datetime.now()
+        rows = []
+        if user_ids and plans:
+            users = np.array(user_ids, dtype=np.int64)
+            # A full run's chunk is every user in an id range; queued users are looked up by id
+            selections = [Usage.user_id.between(user_ids[0], user_ids[-1])] if dense else \
+                [Usage.user_id.in_(user_ids[i:i + MARK_CHUNK]) for i in range(0, len(user_ids), MARK_CHUNK)]
+            usage = []
+            for in_users in selections:
+                # One row per user: the database sums the window on the (user_id, date) index
+                usage += db.session.execute(
+                    select(Usage.user_id, func.sum(func.round(Usage.data_used_gb * 100)), func.min(Usage.date))
+                    .where(in_users, Usage.date >= today - timedelta(days=self.window_days - 1), Usage.date <= today)
+                    .group_by(Usage.user_id)
+                ).all()
+            projected = self._projected_gb(users, usage, today)
+
+            plan_id = np.array([plan.id for plan in plans], dtype=np.int64)
+            price = np.array([float(plan.monthly_price) for plan in plans], dtype=np.float64)
+            quota = np.array([plan.monthly_quota_gb or 0 for plan in plans], dtype=np.float64)
+            needed = projected * (1 + self.headroom)
+            shortfall = np.maximum(needed[:, None] - quota[None, :], 0)
+            cost = price[None, :] + shortfall * (price / np.maximum(quota, 1) * SHORTFALL_PENALTY)[None, :]
+            # Cheapest effective cost first, then the lower price, then the older plan
+            order = np.lexsort((np.broadcast_to(plan_id, cost.shape), np.broadcast_to(price, cost.shape), cost), axis=1)
+            top = order[:, :self.count]
+            top_cost = np.take_along_axis(cost, top, axis=1)
+            best = top_cost[:, :1]
+            score = np.where(top_cost > 0, best / np.where(top_cost > 0, top_cost, 1), 1.0)
+            fits = quota[top] >= needed[:, None]
+
+            current = self._current_plans(user_ids)
+            top_plan = plan_id[top].tolist()
+            for user_index, user_id in enumerate(user_ids):
+                for rank in range(top.shape[1]):
+                    rows.append({
+                        'user_id': user_id,
+                        'rank': rank + 1,
+                        'plan_id': top_plan[user_index][rank],
+                        'score': float(score[user_index, rank]),
+                        'monthly_cost': float(top_cost[user_index, rank]),
+                        'fits': bool(fits[user_index, rank]),
+                        'projected_gb': float(projected[user_index]),
+                        'current_plan_id': current.get(user_id),
+                        'computed_at': now
+                    })
+
+        db.session.execute(plan_recommendations.delete().where(replaced))
+        if rows:
+            db.session.execute(plan_recommendations.insert(), rows)
+        db.session.commit()
+        return len(user_ids)
+
+    def _projected_gb(self, users, usage, today):
+        """Expected monthly GB per user (aligned with the sorted `users` array) from (user, cents, first day) rows."""
+        count = len(users)
+        projected = np.zeros(count, dtype=np.float64)
+        if not usage:
+            return projected
+        usage_user = np.fromiter((row[0] for row in usage), dtype=np.int64, count=len(usage))
+        usage_cents = np.fromiter((int(row[1]) for row in usage), dtype=np.int64, count=len(usage))
+        first_day = np.fromiter((_as_date(row[2]).toordinal() for row in usage), dtype=np.int64, count=len(usage))
+        index = np.minimum(np.searchsorted(users, usage_user), count - 1)
+        # Users created after the chunk's ids were read
+        known = users[index] == usage_user
+        index = index[known]
+
+        days = np.clip(today.toordinal() - first_day[known] + 1, MIN_DAYS, self.window_days)
+        projected[index] = usage_cents[known] / 100 / days * DAYS_PER_MONTH
+        return projected
+
+    def _current_plans(self, user_ids):
+        """user id -> plan of their most recently started active subscription."""
+        current = {}
+        for chunk in range(0, len(user_ids), MARK_CHUNK):
+            for user_id, plan_id in db.session.execute(
+                select(Subscription.user_id, Subscription.plan_id)
+                .where(Subscription.user_id.in_(user_ids[chunk:chunk + MARK_CHUNK]), Subscription.status == 'active')
+                .order_by(Subscription.user_id, Subscription.start_date, Subscription.id)
+            ):
+                current[user_id] = plan_id
+        return current
+
+    def stats(self):
+        queue = recommendation_queue
+        queued = db.session.execute(select(func.count()).select_from(queue)).scalar()
+        everyone = db.session.execute(select(queue.c.user_id).where(queue.c.user_id == EVERYONE)).first() is not None
+        return {
+            'available': available(),
+            'count': self.count,
+            'window_days': self.window_days,
+            'headroom': self.headroom,
+            'queued_users': queued - everyone,
+            'full_refresh_queued': everyone,
+            'last_run': self.last_run
+        }
+
+
+recommender = PlanRecommender()
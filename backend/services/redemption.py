@@ -0,0 +1,308 @@
+# Discount redemption
+# redeem() checks a code against a checkout (plan, amount, validity window)
+# and takes one use of it. The checks read the cached discount
+# (catalog.discount_by_code); the usage limit is enforced by the write itself,
+# a single conditional UPDATE in its own short transaction:
+#
+#   UPDATE discounts SET used_count = used_count + 1
+#   WHERE id = :id AND counter_shards = 0 AND is_active
+#     AND (usage_limit IS NULL OR used_count < usage_limit) AND <within window>
+#     AND <same terms>
+#
+# There is no read-modify-write, so two checkouts can never both take the
+# last use, and the row lock lasts one statement. The UPDATE also requires the
+# terms the checkout was priced with (type, value, minimum, cap, plan) to be
+# the row's current ones, so a cached copy that another worker's edit has made
+# stale is never charged. When nothing is updated the cached copy was stale or
+# the code ran out: the discount is re-read from the primary and the attempt
+# repeated once, which tells the two apart.
+#
+# Every redemption of a code still queues on that one row. Hot promo codes
+# can be split into counter shards (PUT /admin/discounts/<id>/shards): the
+# remaining uses are divided between N rows of discount_counter_shards and a
+# redemption decrements a random shard, moving on to the shards that still
+# have uses left when it is empty, so concurrent checkouts mostly lock
+# different rows and the shards' quotas still add up to the limit. Shard redemptions reach
+# discounts.used_count (and the rollups) when they are folded: by
+# `flask fold-discount-counters` and whenever the shards are resized. Until
+# then used_count lags for sharded codes.
+#
+# Lock order is shard row, then discount row, everywhere, so redemptions and
+# resizes cannot deadlock. Cached discounts keep their used_count from when
+# they were loaded: redemptions do not invalidate the cache (that would send
+# every checkout of a hot code to the database).
+import random
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sqlalchemy import and_, exists, or_, select
+
+from db import db
+from models.discounts import Discount, discount_counter_shards
+from services import catalog, metrics_rollup
+from services.db_routing import primary
+
+MAX_SHARDS = 64
+
+_discounts = Discount.__table__
+_CENT = Decimal('0.01')
+
+
+class RedemptionRefused(Exception):
+    """The code cannot be applied; `reason` is a short machine-readable tag."""
+
+    def __init__(self, reason, message, status=400):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+
+
+def _money(value, field):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        raise RedemptionRefused('invalid_request', f'{field} must be a number')
+    if not amount.is_finite() or amount < 0:
+        raise RedemptionRefused('invalid_request', f'{field} must be a non-negative number')
+    return amount
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _quote(discount, plan_id, amount, now, fresh):
+    """Validate the checkout against a discount dict; returns (amount, discount_amount)."""
+    if discount is None:
+        raise RedemptionRefused('not_found', 'Unknown discount code', 404)
+    if not discount['is_active']:
+        raise RedemptionRefused('inactive', 'Discount code is not active')
+    valid_from = _parse_time(discount['valid_from'])
+    valid_until = _parse_time(discount['valid_until'])
+    if valid_from and now < valid_from:
+        raise RedemptionRefused('not_started', 'Discount code is not valid yet')
+    if valid_until and now > valid_until:
+        raise RedemptionRefused('expired', 'Discount code has expired')
+    if discount['plan_id'] and plan_id != discount['plan_id']:
+        raise RedemptionRefused('wrong_plan', 'Discount code does not apply to this plan')
+    if amount is None:
+        plan = catalog.get_plan(plan_id) if plan_id else None
+        if plan is None:
+            raise RedemptionRefused('invalid_request', 'amount or a valid plan_id is required')
+        amount = _money(plan['monthly_price'], 'plan price')
+    if discount['min_amount'] is not None and amount < _money(discount['min_amount'], 'min_amount'):
+        raise RedemptionRefused('below_minimum', f"Order amount must be at least {discount['min_amount']:.2f}")
+    # used_count is only exact when read from the primary for an unsharded code
+    if fresh and not discount['counter_shards'] and discount['usage_limit'] is not None \
+            and discount['used_count'] >= discount['usage_limit']:
+        raise RedemptionRefused('exhausted', 'Discount code has reached its usage limit', 409)
+    return amount, discount_amount(discount, amount)
+
+
+def discount_amount(discount, amount):
+    """What a discount dict takes off a Decimal amount, capped by max_discount and the amount itself."""
+    value = _money(discount['discount_value'], 'discount_value')
+    if discount['discount_type'] == 'fixed':
+        off = value
+    else:
+        off = amount * value / 100
+    if discount['max_discount'] is not None:
+        off = min(off, _money(discount['max_discount'], 'max_discount'))
+    return min(off, amount).quantize(_CENT, ROUND_HALF_UP)
+
+
+def _within_window(now):
+    return and_(
+        _discounts.c.is_active.is_(True),
+        or_(_discounts.c.valid_from.is_(None), _discounts.c.valid_from <= now),
+        or_(_discounts.c.valid_until.is_(None), _discounts.c.valid_until >= now)
+    )
+
+
+def _terms_unchanged(discount):
+    """The discount row still has the terms the (possibly cached) dict was priced with."""
+    def same(column, value):
+        # Discount.to_dict() maps a 0 min_amount / max_discount to None as well
+        if value is None:
+            return or_(column.is_(None), column == 0)
+        return column == Decimal(str(value))
+    return and_(
+        _discounts.c.discount_type == discount['discount_type'],
+        same(_discounts.c.discount_value, discount['discount_value']),
+        same(_discounts.c.min_amount, discount['min_amount']),
+        same(_discounts.c.max_discount, discount['max_discount']),
+        _discounts.c.plan_id.is_(None) if discount['plan_id'] is None else _discounts.c.plan_id == discount['plan_id']
+    )
+
+
+def _take(discount, now):
+    """Take one use with conditional UPDATEs, committing each; False when nothing could be taken.
+
+    Runs on the session's connection, so a request never waits for a second
+    pooled connection while holding one.
+    """
+    shards = discount['counter_shards']
+    if not shards:
+        connection = db.session.connection()
+        taken = connection.execute(
+            _discounts.update()
+            .where(_discounts.c.id == discount['id'], _discounts.c.counter_shards == 0, _within_window(now),
+                   _terms_unchanged(discount),
+                   or_(_discounts.c.usage_limit.is_(None), _discounts.c.used_count < _discounts.c.usage_limit))
+            .values(used_count=_discounts.c.used_count + 1)
+        ).rowcount
+        if taken:
+            metrics_rollup.apply_discount_redemptions(
+                connection, _parse_time(discount['created_at']), discount['plan_id'], 1)
+        db.session.commit()
+        return bool(taken)
+
+    # A random shard first; when it has run out, the others that still have
+    # uses left, one transaction each so a full shard is not left locked
+    has_uses = or_(discount_counter_shards.c.remaining.is_(None), discount_counter_shards.c.remaining > 0)
+    still_valid = exists().where(_discounts.c.id == discount['id'], _discounts.c.counter_shards == shards,
+                                 _within_window(now), _terms_unchanged(discount))
+    first = random.randrange(shards)
+    candidates = [first]
+    while candidates:
+        shard = candidates.pop()
+        taken = db.session.connection().execute(
+            discount_counter_shards.update()
+            .where(discount_counter_shards.c.discount_id == discount['id'],
+                   discount_counter_shards.c.shard == shard, has_uses, still_valid)
+            .values(remaining=discount_counter_shards.c.remaining - 1,
+                    redeemed=discount_counter_shards.c.redeemed + 1)
+        ).rowcount
+        if shard == first and not taken:
+            candidates = db.session.execute(
+                select(discount_counter_shards.c.shard)
+                .where(discount_counter_shards.c.discount_id == discount['id'],
+                       discount_counter_shards.c.shard != first, has_uses)
+            ).scalars().all()
+            random.shuffle(candidates)
+        db.session.commit()
+        if taken:
+            return True
+    return False
+
+
+def _load(code):
+    with primary():
+        discount = Discount.query.filter_by(code=code).first()
+        return discount.to_dict() if discount else None
+
+
+def redeem(code, plan_id=None, amount=None, now=None):
+    """Apply a discount code to a checkout and take one use of it (commits the session).
+
+    Returns the amounts; raises RedemptionRefused when the code does not apply or has run out.
+    """
+    now = now or datetime.now()
+    amount = _money(amount, 'amount') if amount is not None else None
+    if plan_id is not None:
+        try:
+            plan_id = int(plan_id)
+        except (TypeError, ValueError):
+            raise RedemptionRefused('invalid_request', 'plan_id must be an integer')
+    discount = catalog.discount_by_code(code)
+    fresh = False
+    while True:
+        order_amount, discount_amount = _quote(discount, plan_id, amount, now, fresh)
+        if _take(discount, now):
+            return {
+                'discount_id': discount['id'],
+                'code': discount['code'],
+                'plan_id': plan_id,
+                'amount': float(order_amount),
+                'discount_amount': float(discount_amount),
+                'final_amount': float(order_amount - discount_amount)
+            }
+        if fresh:
+            raise RedemptionRefused('exhausted', 'Discount code has reached its usage limit', 409)
+        # Stale cache (edited, resharded) or used up: decide on the primary's copy
+        catalog.invalidate_discount(code)
+        discount = _load(code)
+        fresh = True
+
+
+# Shards
+
+def _fold(connection, discount_id):
+    """Move the shards' redemptions into discounts.used_count; returns how many moved."""
+    pending = connection.execute(
+        select(discount_counter_shards.c.shard, discount_counter_shards.c.redeemed)
+        .where(discount_counter_shards.c.discount_id == discount_id, discount_counter_shards.c.redeemed > 0)
+        .with_for_update()
+    ).all()
+    moved = 0
+    for shard, redeemed in pending:
+        # A transfer: never below zero, so a concurrent fold cannot count the same uses twice
+        moved += redeemed * connection.execute(
+            discount_counter_shards.update()
+            .where(discount_counter_shards.c.discount_id == discount_id, discount_counter_shards.c.shard == shard,
+                   discount_counter_shards.c.redeemed >= redeemed)
+            .values(redeemed=discount_counter_shards.c.redeemed - redeemed)
+        ).rowcount
+    if moved:
+        connection.execute(_discounts.update().where(_discounts.c.id == discount_id)
+                           .values(used_count=_discounts.c.used_count + moved))
+        row = connection.execute(select(_discounts.c.created_at, _discounts.c.plan_id)
+                                 .where(_discounts.c.id == discount_id)).one()
+        metrics_rollup.apply_discount_redemptions(connection, row.created_at, row.plan_id, moved)
+    return moved
+
+
+def set_shards(discount_id, shards):
+    """Split the discount's remaining uses over `shards` counters (0 goes back to the single row)."""
+    if not 0 <= shards <= MAX_SHARDS:
+        raise ValueError(f'shards must be between 0 and {MAX_SHARDS}')
+    db.session.commit()
+    with db.engine.begin() as connection:
+        # Shard rows first (locked by the fold), then the discount row
+        folded = _fold(connection, discount_id)
+        discount = connection.execute(
+            select(_discounts.c.code, _discounts.c.usage_limit, _discounts.c.used_count)
+            .where(_discounts.c.id == discount_id).with_for_update()
+        ).one_or_none()
+        if discount is None:
+            raise LookupError('Discount not found')
+        connection.execute(discount_counter_shards.delete().where(discount_counter_shards.c.discount_id == discount_id))
+        if shards:
+            if discount.usage_limit is None:
+                quotas = [None] * shards
+            else:
+                left = max(0, discount.usage_limit - discount.used_count)
+                quotas = [left // shards + (1 if shard < left % shards else 0) for shard in range(shards)]
+            connection.execute(discount_counter_shards.insert(), [
+                {'discount_id': discount_id, 'shard': shard, 'remaining': quota, 'redeemed': 0}
+                for shard, quota in enumerate(quotas)
+            ])
+        connection.execute(_discounts.update().where(_discounts.c.id == discount_id).values(counter_shards=shards))
+    catalog.invalidate_discount(discount.code)
+    return {'discount_id': discount_id, 'shards': shards, 'folded': folded,
+            'used_count': discount.used_count, 'usage_limit': discount.usage_limit}
+
+
+def drop_shards(discount_id):
+    """Remove a deleted discount's counters (the table has no foreign key to cascade)."""
+    with db.engine.begin() as connection:
+        connection.execute(discount_counter_shards.delete().where(discount_counter_shards.c.discount_id == discount_id))
+
+
+def fold_counters():
+    """Fold every sharded discount's redemptions into used_count; returns {discount_id: moved}."""
+    sharded = db.session.execute(select(_discounts.c.id).where(_discounts.c.counter_shards > 0)).scalars().all()
+    db.session.commit()
+    folded = {}
+    for discount_id in sharded:
+        with db.engine.begin() as connection:
+            folded[discount_id] = _fold(connection, discount_id)
+    return folded
+
+
+def shard_status(discount_id):
+    rows = db.session.execute(
+        select(discount_counter_shards.c.shard, discount_counter_shards.c.remaining, discount_counter_shards.c.redeemed)
+        .where(discount_counter_shards.c.discount_id == discount_id).order_by(discount_counter_shards.c.shard)
+    ).all()
+    return [{'shard': row.shard, 'remaining': row.remaining, 'unfolded': row.redeemed} for row in rows]
@@ -0,0 +1,378 @@
+# In-process metrics registry and the /metrics endpoint
+# Counters, gauges and fixed-bucket histograms with labels, rendered in the
+# Prometheus text format (0.0.4). Every request to the admin and user
+# blueprints is counted and timed; the database pool, the background
+# writers and the cache are sampled when /metrics is scraped. Values are per
+# process: with several workers, scrape each one (or sum them in Prometheus).
+#
+# /metrics sits outside the blueprints' token guard and names every route and
+# the auth rejection counts, so it checks its own Authorization header: the
+# METRICS_TOKEN bearer token (for the scraper) or an admin token. It is only
+# open when neither METRICS_TOKEN nor AUTH_REQUIRED is set.
+import hmac
+import math
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, got_request_exception, request
+
+from services.db_pool import pool_monitor
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in sorted(children):
+            yield from child.samples(self.name, self.labelnames, values)
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, values):
+        yield f'{name}{_label_text(labelnames, values)} {_format_value(self.value)}'
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            le = 'le="' + _format_value(float(bound)) + '"'
+            yield f'{name}_bucket{_label_text(labelnames, values, le)} {cumulative}'
+        yield f'{name}_sum{_label_text(labelnames, values)} {_format_value(total)}'
+        yield f'{name}_count{_label_text(labelnames, values)} {cumulative}'
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f'Metric {metric.name} is already registered differently')
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """`collect()` returns [(name, kind, documentation, [(labels_dict, value), ...])] at scrape time."""
+        with self._lock:
+            if collect not in self._collectors:
+                self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        for collect in collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_label_text(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    'http_requests_total', 'Requests handled, by route and status code.', ('method', 'route', 'status'))
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Request latency, by route.', ('method', 'route'))
+request_exceptions = registry.counter(
+    'http_request_exceptions_total', 'Unhandled exceptions raised by a route, by exception class.',
+    ('method', 'route', 'exception'))
+requests_in_progress = registry.gauge(
+    'http_requests_in_progress', 'Requests currently being handled.')
+_in_progress = requests_in_progress.labels()
+pool_checkout = registry.histogram(
+    'db_pool_checkout_seconds', 'Time spent waiting for a pooled database connection.',
+    buckets=CHECKOUT_BUCKETS)
+pool_checkout_errors = registry.counter(
+    'db_pool_checkout_errors_total', 'Pool checkouts that failed (e.g. pool timeout), by exception class.',
+    ('exception',))
+
+
+class Telemetry:
+    def __init__(self):
+        self.enabled = False
+        self.blueprints = ()
+        self.token = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.blueprints = tuple(app.config.get('METRICS_BLUEPRINTS', ('admin', 'user')))
+        self.token = app.config.get('METRICS_TOKEN') or None
+        app.extensions['telemetry'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        got_request_exception.connect(self._exception, app, weak=False)
+        app.add_url_rule('/metrics', 'metrics', self._serve)
+        registry.add_collector(self._collect_pool_status)
+        registry.add_collector(self._collect_services)
+        pool_monitor.add_checkout_observer(_observe_checkout)
+
+    # The hooks run on every request: resolve the request proxy once and keep
+    # per-request state in the WSGI environ rather than going through g
+    def _start(self):
+        current = request._get_current_object()
+        if current.blueprint in self.blueprints:
+            current.environ['telemetry.started'] = time.perf_counter()
+            _in_progress.inc()
+
+    def _finish(self, response):
+        current = request._get_current_object()
+        started = current.environ.pop('telemetry.started', None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            route = current.url_rule.rule if current.url_rule else 'unmatched'
+            _in_progress.dec()
+            request_duration.labels(current.method, route).observe(elapsed)
+            requests_total.labels(current.method, route, str(response.status_code)).inc()
+        return response
+
+    def _exception(self, sender, exception, **extra):
+        if request.blueprint in self.blueprints:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_exceptions.labels(request.method, route, type(exception).__name__).inc()
+
+    def _allowed(self):
+        from services.auth import auth
+
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        token = token.strip()
+        if scheme.lower() != 'bearer' or not token:
+            return self.token is None and not auth.enabled
+        if self.token is not None and hmac.compare_digest(token.encode(), self.token.encode()):
+            return True
+        if not auth.enabled:
+            return self.token is None
+        auth.ensure_sync()
+        try:
+            return auth.authenticate(token).role == 'admin'
+        except ValueError:
+            return False
+
+    def _serve(self):
+        if not self._allowed():
+            return Response('Authentication required\n', status=401, content_type='text/plain',
+                            headers={'WWW-Authenticate': 'Bearer'})
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    def _collect_pool_status(self):
+        stats = pool_monitor.stats()
+        samples = []
+        for name, key, documentation in (
+            ('db_pool_size', 'size', 'Configured number of pooled connections.'),
+            ('db_pool_checked_out', 'checked_out', 'Connections currently checked out of the pool.'),
+            ('db_pool_checked_in', 'checked_in', 'Idle connections held by the pool.'),
+            ('db_pool_overflow', 'overflow', 'Connections open beyond the pool size.'),
+            ('db_connections_open', 'open', 'Open database connections (checked out + idle).'),
+        ):
+            if key in stats['live']:
+                samples.append((name, 'gauge', documentation, [({}, stats['live'][key])]))
+        for name, key, documentation in (
+            ('db_connections_opened_total', 'connections_opened', 'Database connections opened by the pool.'),
+            ('db_connections_invalidated_total', 'invalidations',
+             'Pooled connections discarded as stale or broken (e.g. failed pre-ping).'),
+        ):
+            samples.append((name, 'counter', documentation, [({}, stats[key])]))
+        return samples
+
+    def _collect_services(self):
+        from services.alert_dispatcher import dispatcher
+        from services.audit_writer import audit_writer
+        from services.auth import auth
+        from services.cache import cache
+        from services.credentials import credentials
+
+        samples = []
+        for writer in (dispatcher, audit_writer):
+            stats = writer.stats()
+            labels = {'writer': writer.thread_name}
+            for key, documentation in (
+                ('published', 'Rows submitted to a background batch writer.'),
+                ('written', 'Rows written by a background batch writer.'),
+                ('dropped', 'Rows a background batch writer had to drop.'),
+                ('failed', 'Rows a background batch writer could not write.'),
+                ('batches', 'Batches written by a background batch writer.'),
+            ):
+                samples.append((f'batch_writer_{key}_total', 'counter', documentation, [(labels, stats[key])]))
+            samples.append(('batch_writer_queue_depth', 'gauge', 'Rows waiting in a batch writer queue.',
+                            [(labels, stats['queue_depth'])]))
+        tokens = auth.stats()
+        for key, documentation in (
+            ('cache_hits', 'Bearer tokens found in the verified-token cache.'),
+            ('cache_misses', 'Bearer tokens whose signature had to be checked.'),
+        ):
+            samples.append((f'auth_token_{key}_total', 'counter', documentation, [({}, tokens[key])]))
+        for reason, count in tokens['rejected'].items():
+            samples.append(('auth_rejections_total', 'counter', 'Requests refused by the token guard, by reason.',
+                            [({'reason': reason}, count)]))
+        hashing = credentials.stats()
+        for key, documentation in (
+            ('hashed', 'Passwords hashed for signups and password changes.'),
+            ('checked', 'Password checks for logins.'),
+            ('upgraded', 'Stored hashes replaced with the configured method at login.'),
+            ('busy', 'Password hashes refused because every hashing slot stayed taken.'),
+        ):
+            samples.append((f'password_hash_{key}_total', 'counter', documentation, [({}, hashing[key])]))
+        samples.append(('password_hash_pending', 'gauge', 'Password hashes running or waiting for a worker.',
+                        [({}, hashing['pending'])]))
+        for namespace, counters in cache.stats().get('namespaces', {}).items():
+            for key in ('hits', 'misses'):
+                samples.append((f'cache_{key}_total', 'counter', f'Cache {key} by namespace.',
+                                [({'namespace': namespace}, counters[key])]))
+        return _merge_families(samples)
+
+
+def _merge_families(samples):
+    # One HELP/TYPE block per metric name, as the text format requires
+    families = {}
+    for name, kind, documentation, values in samples:
+        families.setdefault(name, (kind, documentation, []))[2].extend(values)
+    return [(name, kind, documentation, values) for name, (kind, documentation, values) in families.items()]
+
+
+def _observe_checkout(seconds, error):
+    pool_checkout.labels().observe(seconds)
+    if error is not None:
+        pool_checkout_errors.labels(type(error).__name__).inc()
+
+
+telemetry = Telemetry()
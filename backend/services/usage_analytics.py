@@ -0,0 +1,268 @@
+# Columnar usage analytics
+# Loads usage, subscriptions, users and plans into NumPy columns (keyset-paged
+# chunks, so memory stays at the arrays plus one chunk of rows) and computes
+# histograms, quantiles, per-user / per-plan aggregates and signup cohorts with
+# array operations. The snapshot is cached per process for SNAPSHOT_TTL
+# seconds (?refresh=1 rebuilds it): figures can be that stale, which is fine
+# for reporting. NumPy is an optional dependency (pip install numpy); without it
+# available() is False and GET /admin/analytics/usage answers 501.
+#
+# Archived months (services/usage_archive.py) are read from their
+# memory-mapped column files instead of the usage table.
+#
+# Memory: usage costs 16 bytes a row (int32 user id and day, int64 cents), so
+# 10M rows take about 160 MB.
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+
+from db import db
+from models.users import User
+from models.plans import Plan
+from models.subscriptions import Subscription
+from models.usage import Usage
+from services.metrics_rollup import USAGE_BUCKETS
+from services.usage_archive import usage_archive
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_ROWS = 100000
+SNAPSHOT_TTL = 300
+# Histogram edges in cents, from the same buckets as the daily rollups
+_BUCKET_EDGES = [min_gb * 100 for _, _, min_gb, _ in USAGE_BUCKETS[1:]]
+QUANTILES = (50, 90, 95, 99)
+COHORT_MONTHS = 12
+RECENT_DAYS = 30
+
+
+def available():
+    return np is not None
+
+
+def _month_index(value):
+    return value.year * 12 + value.month - 1 if value else -1
+
+
+def _load(id_column, columns, chunk_rows):
+    """Keyset-paged read of `columns`: [(expression, dtype, convert)] -> list of arrays."""
+    parts = [[] for _ in columns]
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(id_column, *[expression for expression, _, _ in columns])
+            .where(id_column > last_id).order_by(id_column).limit(chunk_rows)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for index, (_, dtype, convert) in enumerate(columns):
+            parts[index].append(np.fromiter((convert(row[index + 1]) for row in rows), dtype=dtype, count=len(rows)))
+        if len(rows) < chunk_rows:
+            break
+    return [np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+            for chunks, (_, dtype, _) in zip(parts, columns)]
+
+
+def _archived_usage():
+    """(user, day ordinal, cents) arrays per archived month, read from the mapped column files."""
+    parts = []
+    for partition in usage_archive.partitions():
+        day_of_month = np.frombuffer(partition.column('day'), dtype=np.uint8)
+        parts.append((
+            np.frombuffer(partition.column('user_id'), dtype=np.int32),
+            day_of_month.astype(np.int32) + (partition.month.toordinal() - 1),
+            np.frombuffer(partition.column('cents'), dtype=np.int64)
+        ))
+    return parts
+
+
+class Snapshot:
+    """Column arrays for usage, subscriptions and users, plus the (small) plan table."""
+
+    def __init__(self, chunk_rows=CHUNK_ROWS):
+        started = time.perf_counter()
+        hot = _load(Usage.id, [
+            (Usage.user_id, np.int32, int),
+            (Usage.date, np.int32, date.toordinal),
+            (func.round(Usage.data_used_gb * 100), np.int64, int),
+        ], chunk_rows)
+        archived = _archived_usage()
+        archived_before = usage_archive.archived_before()
+        if archived_before:
+            # Rows an interrupted archive run left in the table are already in the archive
+            keep = hot[1] >= archived_before.toordinal()
+            hot = [column[keep] for column in hot]
+        self.archived_rows = sum(len(part[0]) for part in archived)
+        self.usage_user, self.usage_day, self.usage_cents = (
+            np.concatenate([part[i] for part in archived] + [hot[i]]) for i in range(3)
+        )
+        self.sub_user, self.sub_plan, self.sub_active, self.sub_start, self.sub_price_cents = _load(Subscription.id, [
+            (Subscription.user_id, np.int32, int),
+            (Subscription.plan_id, np.int32, int),
+            (Subscription.status == 'active', np.bool_, bool),
+            (Subscription.start_date, np.int32, date.toordinal),
+            (func.round(Subscription.price_paid * 100), np.int64, int),
+        ], chunk_rows)
+        self.user_id, self.user_month = _load(User.id, [
+            (User.id, np.int32, int),
+            (User.created_at, np.int32, _month_index),
+        ], chunk_rows)
+        plans = Plan.query.order_by(Plan.id).all()
+        self.plan_id = np.array([plan.id for plan in plans], dtype=np.int32)
+        self.plan_name = [plan.name for plan in plans]
+        self.plan_quota_gb = np.array([plan.monthly_quota_gb or 0 for plan in plans], dtype=np.float64)
+        self.built_at = datetime.now()
+        self.build_seconds = time.perf_counter() - started
+
+    @property
+    def usage_rows(self):
+        return len(self.usage_cents)
+
+
+def _quantiles(values):
+    if not len(values):
+        return {f'p{q}': None for q in QUANTILES}
+    return {f'p{q}': round(float(v), 2) for q, v in zip(QUANTILES, np.percentile(values, QUANTILES))}
+
+
+def _lookup(keys, sorted_keys, sorted_values, default=0):
+    """sorted_values[i] where sorted_keys[i] == key, else default (vectorized dictionary lookup)."""
+    if not len(sorted_keys):
+        return np.full(len(keys), default, dtype=np.float64)
+    position = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[position] == keys, sorted_values[position], default)
+
+
+def _latest_active_subscriptions(snapshot):
+    # One current subscription per user: the most recently started active one
+    active = np.flatnonzero(snapshot.sub_active)
+    order = active[np.lexsort((snapshot.sub_start[active], snapshot.sub_user[active]))]
+    users = snapshot.sub_user[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = users[1:] != users[:-1]
+    picked = order[last]
+    return snapshot.sub_user[picked], snapshot.sub_plan[picked]
+
+
+def compute(snapshot, now=None):
+    now = now or datetime.now()
+    month_start = now.date().replace(day=1).toordinal()
+    recent_start = (now.date() - timedelta(days=RECENT_DAYS)).toordinal()
+    gb = snapshot.usage_cents / 100.0
+    total_users = len(snapshot.user_id)
+
+    # Distribution of daily usage records
+    bucket = np.digitize(snapshot.usage_cents, _BUCKET_EDGES)
+    counts = np.bincount(bucket, minlength=len(USAGE_BUCKETS))
+    records = snapshot.usage_rows
+    distribution = [{
+        'range': label,
+        'count': int(count),
+        'percentage': round(float(count) / records * 100, 1) if records else 0
+    } for (_, label, _, _), count in zip(USAGE_BUCKETS, counts)]
+
+    # Per-user totals over all time and over the current month
+    users, inverse = np.unique(snapshot.usage_user, return_inverse=True)
+    user_totals = np.bincount(inverse, weights=gb, minlength=len(users))
+    user_days = np.bincount(inverse, minlength=len(users))
+    in_month = snapshot.usage_day >= month_start
+    month_users, month_inverse = np.unique(snapshot.usage_user[in_month], return_inverse=True)
+    month_totals = np.bincount(month_inverse, weights=gb[in_month], minlength=len(month_users))
+
+    # Quota utilisation of each user's current plan this month
+    active_users, active_plans = _latest_active_subscriptions(snapshot)
+    used_gb = _lookup(active_users, month_users, month_totals)
+    quota_gb = _lookup(active_plans, snapshot.plan_id, snapshot.plan_quota_gb)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        utilisation = np.where(quota_gb > 0, used_gb / quota_gb, np.nan)
+
+    plan_index = np.searchsorted(snapshot.plan_id, snapshot.sub_plan)
+    plan_index = np.where(
+        (plan_index < len(snapshot.plan_id)) & (snapshot.plan_id[np.minimum(plan_index, len(snapshot.plan_id) - 1)] == snapshot.sub_plan),
+        plan_index, len(snapshot.plan_id)
+    ) if len(snapshot.plan_id) else np.zeros(len(snapshot.sub_plan), dtype=np.int64)
+    subscription_counts = np.bincount(plan_index, minlength=len(snapshot.plan_id) + 1)
+    revenue_cents = np.bincount(plan_index, weights=snapshot.sub_price_cents, minlength=len(snapshot.plan_id) + 1)
+
+    plans = []
+    for index, plan_id in enumerate(snapshot.plan_id):
+        on_plan = active_plans == plan_id
+        plan_utilisation = utilisation[on_plan]
+        plan_utilisation = plan_utilisation[~np.isnan(plan_utilisation)]
+        plans.append({
+            'plan_id': int(plan_id),
+            'plan_name': snapshot.plan_name[index],
+            'subscription_count': int(subscription_counts[index]),
+            'total_revenue': round(float(revenue_cents[index]) / 100, 2),
+            'active_subscribers': int(on_plan.sum()),
+            'quota_gb': float(snapshot.plan_quota_gb[index]),
+            'mean_utilisation': round(float(plan_utilisation.mean()), 4) if len(plan_utilisation) else None,
+            'utilisation_quantiles': _quantiles(plan_utilisation),
+            'over_quota': int((plan_utilisation > 1).sum())
+        })
+
+    # Signup-month cohorts: size, share with an active subscription, recent usage per member
+    current_month = _month_index(now)
+    recent = snapshot.usage_day >= recent_start
+    recent_users, recent_inverse = np.unique(snapshot.usage_user[recent], return_inverse=True)
+    recent_totals = np.bincount(recent_inverse, weights=gb[recent], minlength=len(recent_users))
+    member_recent_gb = _lookup(snapshot.user_id, recent_users, recent_totals)
+    member_active = np.isin(snapshot.user_id, active_users)
+    age = current_month - snapshot.user_month
+    in_window = (age >= 0) & (age < COHORT_MONTHS)
+    cohort_size = np.bincount(age[in_window], minlength=COHORT_MONTHS)
+    cohort_active = np.bincount(age[in_window], weights=member_active[in_window], minlength=COHORT_MONTHS)
+    cohort_usage = np.bincount(age[in_window], weights=member_recent_gb[in_window], minlength=COHORT_MONTHS)
+    cohorts = []
+    for months_ago in range(COHORT_MONTHS - 1, -1, -1):
+        size = int(cohort_size[months_ago])
+        year, month = divmod(current_month - months_ago, 12)
+        cohorts.append({
+            'cohort': f'{year}-{month + 1:02d}',
+            'users': size,
+            'active_rate': round(float(cohort_active[months_ago]) / size, 4) if size else None,
+            f'mean_usage_gb_last_{RECENT_DAYS}_days': round(float(cohort_usage[months_ago]) / size, 2) if size else None
+        })
+
+    return {
+        'snapshot': {
+            'built_at': snapshot.built_at.isoformat(),
+            'build_seconds': round(snapshot.build_seconds, 3),
+            'usage_rows': records,
+            'archived_rows': snapshot.archived_rows,
+            'subscription_rows': len(snapshot.sub_user),
+            'users': total_users
+        },
+        'usage': {
+            'total_usage_gb': round(float(gb.sum()), 2),
+            'average_usage_per_user': round(float(gb.sum()) / total_users, 2) if total_users else 0,
+            'distribution': distribution,
+            'daily_record_quantiles_gb': _quantiles(gb),
+            'per_user_total_quantiles_gb': _quantiles(user_totals),
+            'per_user_daily_mean_gb': round(float((user_totals / np.maximum(user_days, 1)).mean()), 2) if len(users) else None,
+            'month_to_date_quantiles_gb': _quantiles(month_totals)
+        },
+        'plans': plans,
+        'cohorts': cohorts
+    }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(max_age=SNAPSHOT_TTL, refresh=False, chunk_rows=CHUNK_ROWS):
+    """The cached snapshot, rebuilt when older than max_age seconds (one builder at a time)."""
+    global _snapshot
+    if not available():
+        raise RuntimeError('Columnar analytics requires numpy (pip install numpy)')
+    with _snapshot_lock:
+        stale = _snapshot is None or refresh or (datetime.now() - _snapshot.built_at).total_seconds() > max_age
+        if stale:
+            _snapshot = Snapshot(chunk_rows)
+        return _snapshot
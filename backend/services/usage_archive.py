@@ -0,0 +1,358 @@
+# Usage archive
+# Moves usage rows older than USAGE_ARCHIVE_MONTHS whole months out of the
+# usage table into one partition per month under USAGE_ARCHIVE_DIR:
+#   month=2024-01/_manifest.json   row count, byte order, per-day rollups, totals
+#   month=2024-01/id.bin, user_id.bin, day.bin, cents.bin
+#                                  one fixed-width column per file, rows sorted by (day, user_id)
+#   month=2024-01/totals_user_id.bin, totals_cents.bin
+#                                  each user's total for the month, sorted by user
+# Columns are stored narrow (day of month in one byte, usage in integer cents)
+# and uncompressed, so readers memory-map them and share the pages instead of
+# decoding: per-user lookups bisect the mapped totals, and the columnar
+# snapshot (services/usage_analytics.py) wraps the mapped usage columns.
+#
+# Archived days keep their daily_usage_metrics rows, so the dashboard and
+# usage summary are unchanged; the detailed analytics add the manifest
+# totals. A partition is written to a temporary directory and renamed into
+# place before its rows are deleted from the table, so an interrupted run
+# loses nothing: the next run merges whatever is still in the table into the
+# partition (table rows win). Ingestion rejects dates in archived months.
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from db import db
+from models.usage import Usage
+from services.metrics_rollup import USAGE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 50000
+DELETE_CHUNK = 5000
+MANIFEST = '_manifest.json'
+FORMAT_VERSION = 1
+
+# Column name -> array typecode
+USAGE_COLUMNS = {'id': 'i', 'user_id': 'i', 'day': 'B', 'cents': 'q'}
+TOTAL_COLUMNS = {'totals_user_id': 'i', 'totals_cents': 'q'}
+
+_BUCKET_COLUMNS = [column for column, _, _, _ in USAGE_BUCKETS]
+_BUCKET_FLOORS = [min_gb * 100 for _, _, min_gb, _ in USAGE_BUCKETS]
+
+usage_table = Usage.__table__
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _months_back(month, months):
+    index = month.year * 12 + month.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month):
+    return f'month={month:%Y-%m}'
+
+
+def _write_file(path, data):
+    with open(path, 'wb') as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+
+
+def _fsync_dir(path):
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class Partition:
+    """One archived month; its columns are memory-mapped on first use."""
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.month = date.fromisoformat(manifest['month'])
+        self.rows = manifest['rows']
+        self._views = {}
+
+    def column(self, name):
+        """Read-only memoryview over a column file, typed by its array typecode."""
+        view = self._views.get(name)
+        if view is None:
+            typecode = self.manifest['columns'][name]
+            path = os.path.join(self.path, f'{name}.bin')
+            if not os.path.getsize(path):
+                view = memoryview(array(typecode))
+            else:
+                with open(path, 'rb') as handle:
+                    mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mapped).cast(typecode)
+            self._views[name] = view
+        return view
+
+    def day_range(self, day):
+        """Row slice holding one day's records (rows are sorted by day)."""
+        days = self.column('day')
+        return bisect_left(days, day.day), bisect_right(days, day.day)
+
+
+class UsageArchive:
+    def __init__(self):
+        self.directory = None
+        self.months = 12
+        self._partitions = []
+        self._listed = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config.get('USAGE_ARCHIVE_DIR') or os.path.join(app.instance_path, 'usage_archive')
+        self.months = app.config.get('USAGE_ARCHIVE_MONTHS', 12)
+        app.extensions['usage_archive'] = self
+
+    # Reads
+
+    def partitions(self):
+        """Archived months, oldest first; re-listed whenever the archive directory changes."""
+        try:
+            stamp = os.stat(self.directory).st_mtime_ns
+        except (FileNotFoundError, TypeError):
+            return []
+        with self._lock:
+            if stamp != self._listed:
+                found = []
+                for name in sorted(os.listdir(self.directory)):
+                    # In-progress and replaced partitions carry a suffix after the month
+                    if not name.startswith('month=') or '.' in name:
+                        continue
+                    path = os.path.join(self.directory, name)
+                    try:
+                        with open(os.path.join(path, MANIFEST), encoding='utf-8') as handle:
+                            manifest = json.load(handle)
+                    except (OSError, ValueError):
+                        logger.warning('Skipping unreadable usage archive partition %s', path)
+                        continue
+                    if manifest.get('byteorder') != sys.byteorder:
+                        logger.warning('Skipping usage archive partition %s written on a %s-endian host',
+                                       path, manifest.get('byteorder'))
+                        continue
+                    found.append(Partition(path, manifest))
+                self._partitions = found
+                self._listed = stamp
+            return self._partitions
+
+    def partition(self, month):
+        return next((partition for partition in self.partitions() if partition.month == month), None)
+
+    def archived_before(self):
+        """First day that is not archived, or None when nothing is."""
+        partitions = self.partitions()
+        return _next_month(partitions[-1].month) if partitions else None
+
+    def totals(self):
+        """Row count, usage in cents and usage bucket counts over the whole archive."""
+        totals = {'rows': 0, 'cents': 0, 'max_cents': 0, 'buckets': [0] * len(_BUCKET_COLUMNS)}
+        for partition in self.partitions():
+            stats = partition.manifest['totals']
+            totals['rows'] += partition.rows
+            totals['cents'] += stats['cents']
+            totals['max_cents'] = max(totals['max_cents'], stats['max_cents'])
+            totals['buckets'] = [a + b for a, b in zip(totals['buckets'], stats['buckets'])]
+        return totals
+
+    def user_totals(self, user_ids):
+        """Archived usage in cents for the given users: {user_id: cents} (users with none are left out)."""
+        totals = {}
+        for partition in self.partitions():
+            users = partition.column('totals_user_id')
+            cents = partition.column('totals_cents')
+            for user_id in user_ids:
+                index = bisect_left(users, user_id)
+                if index < len(users) and users[index] == user_id:
+                    totals[user_id] = totals.get(user_id, 0) + cents[index]
+        return totals
+
+    def daily_rollups(self):
+        """daily_usage_metrics rows for every archived day."""
+        for partition in self.partitions():
+            for day, (count, cents, max_cents, buckets) in partition.manifest['days'].items():
+                row = {
+                    'date': date.fromisoformat(day),
+                    'usage_count': count,
+                    'usage_sum': Decimal(cents).scaleb(-2),
+                    'usage_max': Decimal(max_cents).scaleb(-2)
+                }
+                row.update(zip(_BUCKET_COLUMNS, buckets))
+                yield row
+
+    def status(self):
+        partitions = self.partitions()
+        return {
+            'directory': self.directory,
+            'months_kept': self.months,
+            'archived_before': self.archived_before().isoformat() if partitions else None,
+            'partitions': [{
+                'month': f'{partition.month:%Y-%m}',
+                'rows': partition.rows,
+                'bytes': partition.manifest['bytes'],
+                'archived_at': partition.manifest['archived_at']
+            } for partition in partitions]
+        }
+
+    # Archiving
+
+    def cutoff(self, months=None, today=None):
+        """First day of the oldest month that stays in the usage table."""
+        return _months_back((today or date.today()).replace(day=1), self.months if months is None else months)
+
+    def run(self, months=None, today=None, dry_run=False, log=None):
+        """Archive every whole month before the cutoff, oldest first; returns one report per month."""
+        cutoff = self.cutoff(months, today)
+        reports = []
+        month_start = date.min
+        while True:
+            oldest = db.session.query(func.min(Usage.date)).filter(
+                Usage.date >= month_start, Usage.date < cutoff
+            ).scalar()
+            if oldest is None:
+                break
+            month_start = oldest.replace(day=1)
+            if dry_run:
+                rows = db.session.query(func.count(Usage.id)).filter(
+                    Usage.date >= month_start, Usage.date < _next_month(month_start)
+                ).scalar()
+                report = {'month': f'{month_start:%Y-%m}', 'rows': rows, 'partition_rows': None, 'bytes': None}
+            else:
+                report = self._archive_month(month_start)
+            reports.append(report)
+            if log:
+                log(f"{report['month']}: {report['rows']} rows" +
+                    (f" -> {report['partition_rows']} archived, {report['bytes']:,} bytes" if not dry_run else ''))
+            month_start = _next_month(month_start)
+        db.session.commit()
+        return reports
+
+    def _read_day(self, day):
+        """(id, user_id, cents) of one day's usage rows, keyset-paged by id."""
+        rows = []
+        last_id = 0
+        while True:
+            chunk = db.session.query(
+                Usage.id, Usage.user_id, func.round(Usage.data_used_gb * 100)
+            ).filter(Usage.date == day, Usage.id > last_id).order_by(Usage.id).limit(READ_CHUNK).all()
+            rows.extend((row_id, user_id, int(cents)) for row_id, user_id, cents in chunk)
+            if len(chunk) < READ_CHUNK:
+                return rows
+            last_id = chunk[-1][0]
+
+    def _archive_month(self, month_start):
+        month_end = _next_month(month_start)
+        existing = self.partition(month_start)
+        columns = {name: array(typecode) for name, typecode in USAGE_COLUMNS.items()}
+        user_cents = {}
+        days = {}
+        archived_ids = array('i')
+
+        day = month_start
+        while day < month_end:
+            # user_id -> (id, cents); rows still in the table replace archived ones
+            merged = {}
+            if existing is not None:
+                start, end = existing.day_range(day)
+                ids, users, cents = (existing.column(name)[start:end] for name in ('id', 'user_id', 'cents'))
+                merged.update(zip(users, zip(ids, cents)))
+            for row_id, user_id, cents in self._read_day(day):
+                merged[user_id] = (row_id, cents)
+                archived_ids.append(row_id)
+
+            if merged:
+                buckets = [0] * len(_BUCKET_COLUMNS)
+                total = largest = 0
+                for user_id in sorted(merged):
+                    row_id, cents = merged[user_id]
+                    columns['id'].append(row_id)
+                    columns['user_id'].append(user_id)
+                    columns['day'].append(day.day)
+                    columns['cents'].append(cents)
+                    user_cents[user_id] = user_cents.get(user_id, 0) + cents
+                    buckets[bisect_right(_BUCKET_FLOORS, cents) - 1] += 1
+                    total += cents
+                    largest = max(largest, cents)
+                days[day.isoformat()] = [len(merged), total, largest, buckets]
+            day = date.fromordinal(day.toordinal() + 1)
+
+        totals_users = array(TOTAL_COLUMNS['totals_user_id'], sorted(user_cents))
+        totals_cents = array(TOTAL_COLUMNS['totals_cents'], (user_cents[user_id] for user_id in totals_users))
+        files = dict(columns, totals_user_id=totals_users, totals_cents=totals_cents)
+        size = self._publish(month_start, files, days)
+
+        # The partition is durable; only now drop the rows from the table
+        for i in range(0, len(archived_ids), DELETE_CHUNK):
+            db.session.execute(usage_table.delete().where(usage_table.c.id.in_(archived_ids[i:i + DELETE_CHUNK].tolist())))
+            db.session.commit()
+
+        return {
+            'month': f'{month_start:%Y-%m}',
+            'rows': len(archived_ids),
+            'partition_rows': len(columns['id']),
+            'bytes': size
+        }
+
+    def _publish(self, month_start, files, days):
+        """Write a partition next to its final path, then swap it in with renames."""
+        name = _partition_name(month_start)
+        final = os.path.join(self.directory, name)
+        staging = os.path.join(self.directory, f'{name}.tmp-{os.getpid()}')
+        replaced = os.path.join(self.directory, f'{name}.old-{os.getpid()}')
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        size = 0
+        for column, values in files.items():
+            data = values.tobytes()
+            _write_file(os.path.join(staging, f'{column}.bin'), data)
+            size += len(data)
+        day_cents = [stats[1] for stats in days.values()]
+        manifest = {
+            'format': FORMAT_VERSION,
+            'month': month_start.isoformat(),
+            'rows': len(files['id']),
+            'byteorder': sys.byteorder,
+            'columns': {column: values.typecode for column, values in files.items()},
+            'bytes': size,
+            'archived_at': datetime.now().isoformat(),
+            'totals': {
+                'cents': sum(day_cents),
+                'max_cents': max((stats[2] for stats in days.values()), default=0),
+                'buckets': [sum(column) for column in zip(*(stats[3] for stats in days.values()))]
+                           or [0] * len(_BUCKET_COLUMNS)
+            },
+            'days': days
+        }
+        _write_file(os.path.join(staging, MANIFEST), json.dumps(manifest).encode('utf-8'))
+        _fsync_dir(staging)
+
+        if os.path.exists(final):
+            os.replace(final, replaced)
+        os.replace(staging, final)
+        _fsync_dir(self.directory)
+        shutil.rmtree(replaced, ignore_errors=True)
+        return size
+
+
+usage_archive = UsageArchive()
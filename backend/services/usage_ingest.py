@@ -0,0 +1,284 @@
+# Bulk usage ingestion
+# Accepts batched NDJSON / CSV metering records, validates each batch column by
+# column, and upserts on (user_id, date) with multi-row INSERT ... ON DUPLICATE
+# KEY UPDATE (ON CONFLICT DO UPDATE on SQLite / PostgreSQL).
+import csv
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+from sqlalchemy import select, func
+
+from db import db
+from models.users import User
+from models.usage import Usage
+from services import metrics_rollup, recommendations
+from services.quota import quota_monitor
+from services.usage_archive import usage_archive
+
+BATCH_SIZE = 10000
+ROWS_PER_STATEMENT = 2000
+IN_CHUNK = 5000
+MAX_ERRORS_PER_BATCH = 20
+
+# data_used_gb is Numeric(10, 2)
+MAX_CENTS = 9999999999
+
+usage_table = Usage.__table__
+UPSERT_COLUMNS = ('user_id', 'date', 'data_used_gb', 'created_at')
+
+
+def read_records(lines, fmt):
+    """Yield (line, record) pairs from an iterable of text lines.
+
+    `line` is the 1-based line a record starts on, so error reports match
+    the input file across skipped blank lines and multi-line CSV fields.
+    """
+    if fmt == 'csv':
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        while header is not None:
+            start = reader.line_num + 1
+            row = next(reader, None)
+            if row is None:
+                return
+            if row:
+                yield start, dict(zip(header, row))
+        return
+
+    decode = json.JSONDecoder().decode
+    for number, line in enumerate(lines, start=1):
+        try:
+            record = decode(line)
+        except ValueError:
+            if not line.strip():
+                continue
+            record = None
+        yield number, record if type(record) is dict else {}
+
+
+def _batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Column parsers return None for invalid values. Money is handled in integer
+# cents so validation and the rollup arithmetic avoid per-row Decimal work.
+
+def _parse_user_id(value):
+    try:
+        user_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return user_id if user_id > 0 else None
+
+
+def _parse_date(value):
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_cents(value):
+    try:
+        cents = int((Decimal(str(value)) * 100).to_integral_value(ROUND_HALF_EVEN))
+    except (InvalidOperation, ValueError, OverflowError):
+        return None
+    return cents if 0 <= cents <= MAX_CENTS else None
+
+
+def _user_id_column(values):
+    if all(type(value) is int for value in values) and min(values) > 0:
+        return values
+    return list(map(_parse_user_id, values))
+
+
+def _date_column(values):
+    try:
+        return list(map(date.fromisoformat, values))
+    except (TypeError, ValueError):
+        return list(map(_parse_date, values))
+
+
+def _cents_column(values):
+    # JSON numbers arrive as float / int; round() matches quantizing to cents
+    if all(type(value) in (float, int) for value in values):
+        try:
+            cents = [round(value * 100) for value in values]
+        except (ValueError, OverflowError):
+            cents = None
+        if cents and min(cents) >= 0 and max(cents) <= MAX_CENTS:
+            return cents
+    return list(map(_parse_cents, values))
+
+
+def _id_filter(column, ids):
+    """Chunks of filters matching `ids` (sorted): one range when they are dense, IN lists otherwise."""
+    if ids[-1] - ids[0] < 2 * len(ids):
+        return [column.between(ids[0], ids[-1])]
+    return [column.in_(ids[i:i + IN_CHUNK]) for i in range(0, len(ids), IN_CHUNK)]
+
+
+def _validate(records):
+    """Validate a batch column by column; returns parsed columns and per-row errors."""
+    get = dict.get
+    user_ids = _user_id_column([get(record, 'user_id') for record in records])
+    days = _date_column([get(record, 'date') for record in records])
+    cents = _cents_column([get(record, 'data_used_gb') for record in records])
+
+    errors = {}
+    for name, column in (('user_id', user_ids), ('date', days), ('data_used_gb', cents)):
+        if None in column:
+            for index, parsed in enumerate(column):
+                if parsed is None:
+                    errors.setdefault(index, []).append(f'invalid {name}')
+
+    # Archived months live in the archive files; new rows for them would be counted twice
+    archived_before = usage_archive.archived_before()
+    if archived_before:
+        for index, day in enumerate(days):
+            if day is not None and day < archived_before:
+                errors.setdefault(index, []).append('date is archived')
+
+    # Unknown users would violate the foreign key and fail the whole statement
+    wanted = sorted(set(user_ids) - {None})
+    if wanted:
+        missing = set(wanted)
+        for condition in _id_filter(User.id, wanted):
+            missing.difference_update(row[0] for row in db.session.query(User.id).filter(condition))
+        if missing:
+            for index, user_id in enumerate(user_ids):
+                if user_id in missing:
+                    errors.setdefault(index, []).append('unknown user_id')
+
+    return user_ids, days, cents, errors
+
+
+def _existing_cents(keys):
+    """Current data_used_gb, in cents, for the (user_id, date) keys that already exist."""
+    existing = {}
+    user_ids = sorted({user_id for user_id, _ in keys})
+    days = sorted({day for _, day in keys})
+    for condition in _id_filter(Usage.user_id, user_ids):
+        rows = db.session.execute(
+            select(Usage.user_id, Usage.date, func.round(Usage.data_used_gb * 100)).where(
+                condition, Usage.date.in_(days)
+            )
+        )
+        for user_id, day, value in rows:
+            key = (user_id, day)
+            if key in keys:
+                existing[key] = int(value)
+    return existing
+
+
+def _upsert_sql(dialect):
+    """Driver-level upsert on (user_id, date).
+
+    It is sent with executemany and pre-converted parameter tuples, which
+    skips per-row SQLAlchemy bind processing. PyMySQL rewrites an
+    executemany INSERT into multi-row INSERT ... VALUES (...), (...)
+    ON DUPLICATE KEY UPDATE statements; sqlite3 reuses one prepared
+    statement.
+    """
+    preparer = dialect.identifier_preparer
+    table = preparer.format_table(usage_table)
+    columns = ', '.join(preparer.quote(column) for column in UPSERT_COLUMNS)
+    marks = ', '.join(['?' if dialect.paramstyle == 'qmark' else '%s'] * len(UPSERT_COLUMNS))
+    value = preparer.quote('data_used_gb')
+
+    if dialect.name == 'mysql':
+        conflict = f'ON DUPLICATE KEY UPDATE {value} = VALUES({value})'
+    else:
+        keys = ', '.join(preparer.quote(column) for column in ('user_id', 'date'))
+        conflict = f'ON CONFLICT ({keys}) DO UPDATE SET {value} = excluded.{value}'
+    return f'INSERT INTO {table} ({columns}) VALUES ({marks}) {conflict}'
+
+
+def _driver_rows(dialect, latest, now):
+    if dialect.name == 'sqlite':
+        # Match SQLAlchemy's SQLite storage formats for Date / DateTime / Numeric
+        created_at = now.strftime('%Y-%m-%d %H:%M:%S.%f')
+        return [(user_id, day.isoformat(), cents / 100, created_at) for (user_id, day), cents in latest.items()]
+    return [(user_id, day, Decimal(cents).scaleb(-2), now) for (user_id, day), cents in latest.items()]
+
+
+def ingest_batch(records, first_row=1, row_numbers=None):
+    """Validate and upsert one batch; returns its report.
+
+    Errors name the 1-based row of each rejected record: row_numbers[index]
+    when given, else counting from `first_row` for records[0].
+    """
+    started = time.perf_counter()
+    user_ids, days, cents, errors = _validate(records)
+
+    # Last record wins when a batch repeats a key
+    if errors:
+        latest = {(user_id, day): value
+                  for index, (user_id, day, value) in enumerate(zip(user_ids, days, cents))
+                  if index not in errors}
+    else:
+        latest = dict(zip(zip(user_ids, days), cents))
+
+    existing = _existing_cents(latest) if latest else {}
+
+    connection = db.session.connection()
+    sql = _upsert_sql(connection.dialect)
+    rows = _driver_rows(connection.dialect, latest, datetime.now())
+    for i in range(0, len(rows), ROWS_PER_STATEMENT):
+        connection.exec_driver_sql(sql, rows[i:i + ROWS_PER_STATEMENT])
+
+    metrics_rollup.apply_usage_cents(
+        connection, [(key[1], existing.get(key), value) for key, value in latest.items()]
+    )
+    # Bulk upserts skip the mapper events that queue recommendation refreshes and track quotas
+    recommendations.mark_users(connection, {user_id for user_id, _ in latest})
+    quota_monitor.apply_usage(connection, [(user_id, day, existing.get((user_id, day)), value)
+                                           for (user_id, day), value in latest.items()])
+    db.session.commit()
+
+    seconds = time.perf_counter() - started
+    return {
+        'received': len(records),
+        'accepted': len(records) - len(errors),
+        'inserted': len(latest) - len(existing),
+        'updated': len(existing),
+        'rejected': len(errors),
+        'errors': [{'row': row_numbers[index] if row_numbers else first_row + index, 'errors': messages}
+                   for index, messages in sorted(errors.items())[:MAX_ERRORS_PER_BATCH]],
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(len(records) / seconds) if seconds > 0 else None
+    }
+
+
+def ingest(lines, fmt='ndjson', batch_size=BATCH_SIZE, on_batch=None):
+    """Ingest every record from `lines`; on_batch(report) is called after each commit."""
+    started = time.perf_counter()
+    reports = []
+    for number, batch in enumerate(_batches(read_records(lines, fmt), batch_size), start=1):
+        try:
+            report = ingest_batch([record for _, record in batch], row_numbers=[row for row, _ in batch])
+        except Exception:
+            db.session.rollback()
+            raise
+        report['batch'] = number
+        reports.append(report)
+        if on_batch:
+            on_batch(report)
+
+    seconds = time.perf_counter() - started
+    totals = {key: sum(report[key] for report in reports)
+              for key in ('received', 'accepted', 'inserted', 'updated', 'rejected')}
+    totals['seconds'] = round(seconds, 4)
+    totals['rows_per_sec'] = round(totals['received'] / seconds) if seconds > 0 else None
+    return {'totals': totals, 'batches': reports}
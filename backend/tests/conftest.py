@@ -0,0 +1,45 @@
+# Shared fixtures for the backend tests
+# The app runs against a throwaway SQLite database, seeded with the same
+# generator as the benchmarks.
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope='session')
+def app():
+    workdir = tempfile.mkdtemp(prefix='tests_')
+    # Never the configured database: the tests write to it
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'test.db')}"
+    # Audit events spilled while the database goes away at exit stay out of instance/
+    os.environ['AUDIT_SPILL_DIR'] = os.path.join(workdir, 'audit_spill')
+    from benchmarks.common import make_app
+    app = make_app()
+    yield app
+    # Write what the background writers still hold before the database goes
+    from services.alert_dispatcher import dispatcher
+    from services.audit_writer import audit_writer
+    dispatcher.stop()
+    audit_writer.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def admin_client(app):
+    from benchmarks.common import authorized_client
+    return authorized_client(app)
+
+
+@pytest.fixture(scope='session')
+def seeded(app):
+    """Users with subscriptions and usage, written once for every test that reads them."""
+    from benchmarks.common import seed_dataset
+    from db import db
+    with app.app_context():
+        seed_dataset(db, users=300, subscriptions_per_user=3, usage_days=20)
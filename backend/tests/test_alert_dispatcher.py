@@ -0,0 +1,14 @@
+# Alerts published from handlers are written by the background dispatcher in batches
+def test_published_alerts_are_written_in_batches(app):
+    from models.alerts import Alert
+    from services.alert_dispatcher import dispatcher, publish_alert
+
+    before = dispatcher.stats()
+    with app.app_context():
+        for i in range(50):
+            publish_alert('info', f'Batched alert {i}', 'Written by the dispatcher worker')
+        assert dispatcher.flush(timeout=10)
+        assert Alert.query.filter(Alert.title.like('Batched alert %')).count() == 50
+    after = dispatcher.stats()
+    assert after['published'] - before['published'] == 50
+    assert 0 < after['batches'] - before['batches'] < 50
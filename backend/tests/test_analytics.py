@@ -0,0 +1,12 @@
+# /admin/analytics/detailed: every usage record falls in exactly one usage range
+def test_usage_ranges_cover_every_record(app, admin_client, seeded):
+    from db import db
+    from models.usage import Usage
+    with app.app_context():
+        records = db.session.query(Usage).count()
+        between_50_and_100 = db.session.query(Usage).filter(Usage.data_used_gb >= 50, Usage.data_used_gb < 100).count()
+    response = admin_client.get('/admin/analytics/detailed')
+    assert response.status_code == 200, response.get_json()
+    ranges = {entry['range']: entry['count'] for entry in response.get_json()['usage_analytics']['usage_distribution']}
+    assert ranges['50-100 GB'] == between_50_and_100 > 0
+    assert sum(ranges.values()) == records
@@ -0,0 +1,44 @@
+# Bearer token guard: revoked tokens get 401, in this process at once and in
+# the others after their next revocation sync
+import time
+from datetime import datetime
+
+
+def user_client(app):
+    from benchmarks.common import bench_token
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {bench_token(app, role='user')}"
+    return client
+
+
+def test_missing_token_gets_401(app):
+    response = app.test_client().get('/user/dashboard')
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+
+def test_logged_out_token_gets_401(app):
+    client = user_client(app)
+    assert client.get('/user/dashboard').status_code == 200
+    assert client.post('/user/logout').status_code == 200
+    assert client.get('/user/dashboard').status_code == 401
+
+
+def test_revocation_from_another_process_applies_after_sync(app):
+    from db import db
+    from models.auth import auth_revocations
+    from models.users import User
+    from services.auth import auth
+    client = user_client(app)
+    assert client.get('/user/dashboard').status_code == 200
+
+    # What another worker writes when the user's password changes
+    with app.app_context():
+        user_id = User.query.filter_by(email='bench-user@example.com').one().id
+        now = time.time()
+        with db.engine.begin() as connection:
+            connection.execute(auth_revocations.insert().values(
+                kind='user', key=str(user_id), revoked_at=now, expires_at=now + auth.token_ttl,
+                created_at=datetime.now()))
+    auth._sync()
+    assert client.get('/user/dashboard').status_code == 401
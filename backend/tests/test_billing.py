@@ -0,0 +1,33 @@
+# Billing runs: a stopped run resumes with its open chunks, every due
+# subscription gets exactly one invoice per period, and a second run bills nothing
+from datetime import date
+
+from sqlalchemy import func, select
+
+
+def test_stopped_run_resumes_and_rerun_bills_nothing(app, seeded):
+    from db import db
+    from models.billing import invoices
+    from services.billing import billing
+
+    def invoice_counts():
+        total = db.session.execute(select(func.count()).select_from(invoices)).scalar()
+        periods = db.session.execute(select(func.count()).select_from(
+            select(invoices.c.subscription_id, invoices.c.period_start).distinct().subquery()
+        )).scalar()
+        return total, periods
+
+    today = date.today()
+    with app.app_context():
+        before, _ = invoice_counts()
+        first = billing.run(run_date=today, chunk_size=50, workers=2, max_chunks=1)
+        assert first['invoices'] > 0 and first['open_chunks'] > 0
+
+        resumed = billing.run(run_date=today, workers=2)
+        assert resumed['open_chunks'] == 0
+
+        again = billing.run(run_date=today, workers=2)
+        assert again['invoices'] == 0
+
+        total, periods = invoice_counts()
+        assert total == periods == before + first['invoices'] + resumed['invoices']
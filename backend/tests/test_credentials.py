@@ -0,0 +1,35 @@
+# Password hashing: the process pool is optional and never required to hash
+import os
+import subprocess
+import sys
+
+from werkzeug.security import check_password_hash
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+UNGUARDED_SCRIPT = f'''
+import sys
+sys.path.insert(0, {BACKEND!r})
+from services.credentials import CredentialService
+service = CredentialService()
+service.configure(workers=1)
+print(service.hash_password('secret'))
+service.stop()
+'''
+
+
+def test_no_workers_hashes_inline():
+    from services.credentials import CredentialService
+    service = CredentialService()
+    service.configure(workers=0)
+    assert check_password_hash(service.hash_password('secret'), 'secret')
+    assert service._pool is None
+
+
+def test_script_without_main_guard_can_hash(tmp_path):
+    script = tmp_path / 'hash_password.py'
+    script.write_text(UNGUARDED_SCRIPT)
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'BrokenProcessPool' not in result.stderr
+    assert check_password_hash(result.stdout.split()[-1], 'secret')
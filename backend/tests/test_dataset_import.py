@@ -0,0 +1,45 @@
+# An interrupted dataset import resumes after its last committed batch when
+# the same source is imported again, without duplicating rows
+import pytest
+
+
+@pytest.fixture
+def source(tmp_path):
+    (tmp_path / 'plans.csv').write_text('Product ID,Name,Price,Quota GB\n1,Import Plan,9.99,10\n')
+    (tmp_path / 'users.csv').write_text('User ID,Name,Email\n' + ''.join(
+        f'{i},Import User {i},import{i}@example.org\n' for i in range(5)))
+    return str(tmp_path)
+
+
+def test_interrupted_import_resumes(app, source, monkeypatch):
+    from models.users import User
+    from services.dataset_import import DatasetImport
+
+    write_users = DatasetImport._write_users
+    calls = []
+
+    def fail_second_batch(self, prepared):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError('connection lost')
+        return write_users(self, prepared)
+
+    def imported():
+        return User.query.filter(User.email.like('import%@example.org')).count()
+
+    with app.app_context():
+        monkeypatch.setattr(DatasetImport, '_write_users', fail_second_batch)
+        with pytest.raises(RuntimeError):
+            DatasetImport(source, batch_size=2, workers=1, default_password='secret').run()
+        assert imported() == 2
+
+        monkeypatch.undo()
+        reports = {report['sheet']: report for report in
+                   DatasetImport(source, batch_size=2, workers=1, default_password='secret').run()}
+        assert reports['plans'].get('skipped') == 'already imported'
+        assert (reports['users']['resumed_at_row'], reports['users']['imported']) == (2, 3)
+        assert imported() == 5
+
+        reports = DatasetImport(source, batch_size=2, workers=1, default_password='secret').run()
+        assert all(report.get('skipped') == 'already imported' for report in reports)
+        assert imported() == 5
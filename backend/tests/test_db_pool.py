@@ -0,0 +1,32 @@
+# Connection pool monitoring: every checkout is counted and timed, including
+# the ones that give up at pool_timeout
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+def test_requests_show_up_in_pool_stats(admin_client):
+    before = admin_client.get('/admin/db/pool').get_json()
+    admin_client.get('/admin/users')
+    after = admin_client.get('/admin/db/pool').get_json()
+    assert after['checkouts'] > before['checkouts']
+    assert after['pool_class'] == before['pool_class']
+
+
+def test_exhausted_pool_counts_the_timeout(tmp_path):
+    from services.db_pool import PoolMonitor
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.1)
+    monitor = PoolMonitor()
+    monitor._wrap(engine.pool)
+
+    held = engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    held.close()
+    engine.dispose()
+
+    assert monitor.checkouts == 2
+    assert monitor.checkout_timeouts == 1
+    assert monitor.wait_max >= 0.1
@@ -0,0 +1,61 @@
+# Subscription lifecycle sweeps: each rule moves its rows once, a second sweep
+# changes nothing, and the dashboard's active count follows the table
+from datetime import date, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func, select
+
+
+def test_sweep_moves_each_subscription_once(app, seeded):
+    from db import db
+    from models.plans import Plan
+    from models.subscriptions import Subscription
+    from models.users import User
+    from services import metrics_rollup
+    from services.lifecycle import lifecycle
+
+    today = date.today()
+    with app.app_context():
+        plan = Plan.query.first()
+        user = User(name='Lifecycle Check', email='lifecycle@example.org', role='user', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+
+        def subscription(**values):
+            return Subscription(user_id=user.id, plan_id=plan.id, start_date=today - timedelta(days=60),
+                                price_paid=Decimal(plan.monthly_price), **values)
+
+        schedules = {
+            'expired': subscription(status='active', end_date=today - timedelta(days=3)),
+            'renewed': subscription(status='active', end_date=today - timedelta(days=3), auto_renew=True),
+            'paused': subscription(status='active', pause_start=today - timedelta(days=1),
+                                   pause_end=today + timedelta(days=30)),
+            'resumed': subscription(status='paused', pause_start=today - timedelta(days=30), pause_end=today)
+        }
+        db.session.add_all(schedules.values())
+        db.session.commit()
+        metrics_rollup.rebuild_rollups()
+
+        report = lifecycle.sweep(today=today)
+        assert not report['error']
+        assert all(report[rule] >= 1 for rule in schedules)
+        for subscription in schedules.values():
+            db.session.refresh(subscription)
+        assert [subscription.status for subscription in schedules.values()] == ['expired', 'active', 'paused', 'active']
+        assert schedules['renewed'].end_date >= today
+        assert schedules['resumed'].pause_end is None
+
+        again = lifecycle.sweep(today=today)
+        assert all(again[rule] == 0 for rule in schedules)
+
+        active = db.session.execute(
+            select(func.count()).select_from(Subscription).where(Subscription.status == 'active')
+        ).scalar()
+        assert metrics_rollup.dashboard_totals(today.replace(day=1))['active_subscriptions'] == active
+
+
+def test_a_scheduler_slot_is_swept_once(app):
+    from services.lifecycle import lifecycle
+    with app.app_context():
+        assert lifecycle.sweep(slot=1) is not None
+        assert lifecycle.sweep(slot=1) is None
@@ -0,0 +1,20 @@
+# /metrics is outside the blueprint guard and checks its own bearer token
+def test_metrics_refuses_anonymous_scrapes(app):
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 401
+    assert b'http_requests_total' not in response.data
+
+
+def test_metrics_accepts_admin_tokens(admin_client):
+    response = admin_client.get('/metrics')
+    assert response.status_code == 200
+    assert b'# TYPE http_requests_total counter' in response.data
+
+
+def test_metrics_accepts_the_scrape_token(app, monkeypatch):
+    from services.telemetry import telemetry
+    monkeypatch.setattr(telemetry, 'token', 'scrape-secret')
+
+    client = app.test_client()
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}).status_code == 200
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
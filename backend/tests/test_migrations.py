@@ -0,0 +1,29 @@
+# Migrations run against their own frozen table definitions, on a fresh database
+import importlib
+from datetime import date
+
+from sqlalchemy import MetaData, Table, create_engine, select
+
+
+def test_hot_path_indexes_collapse_duplicate_usage(tmp_path):
+    baseline = importlib.import_module('migrations.versions.0001_baseline')
+    indexes = importlib.import_module('migrations.versions.0002_hot_path_indexes')
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    day = date(2024, 1, 15)
+    with engine.begin() as connection:
+        baseline.upgrade(connection)
+        connection.exec_driver_sql(
+            "INSERT INTO users (id, name, email, password_hash, role) VALUES (1, 'A', 'a@example.com', 'x', 'user')")
+        # Two rows for one user and day: the newer one (55 GB) is kept
+        connection.exec_driver_sql(
+            "INSERT INTO usage (id, user_id, date, data_used_gb) VALUES (1, 1, '2024-01-15', 5), "
+            "(2, 1, '2024-01-15', 55)")
+        connection.exec_driver_sql(
+            "INSERT INTO daily_usage_metrics VALUES ('2024-01-15', 2, 60, 55, 1, 0, 1, 0)")
+        indexes.upgrade(connection)
+
+        usage = Table('usage', MetaData(), autoload_with=connection)
+        rollup = Table('daily_usage_metrics', MetaData(), autoload_with=connection)
+        assert connection.execute(select(usage.c.id)).scalars().all() == [2]
+        row = connection.execute(select(rollup).where(rollup.c.date == day)).one()
+        assert (row.usage_count, float(row.usage_sum), row.bucket_0_10, row.bucket_50_100) == (1, 55, 0, 1)
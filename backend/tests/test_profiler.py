@@ -0,0 +1,23 @@
+# Timing headers: one Server-Timing header, written by the profiler
+def test_analytics_timings_join_the_profiler_header(admin_client, monkeypatch):
+    from services.profiler import profiler
+    monkeypatch.setattr(profiler, 'headers', True)
+
+    response = admin_client.get('/admin/analytics/detailed')
+    assert response.status_code == 200, response.get_json()
+    assert len(response.headers.getlist('Server-Timing')) == 1
+    names = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert names == ['db', 'app', 'users', 'subscriptions', 'usage', 'plans', 'discounts']
+    assert 'X-Query-Count' not in response.headers
+
+
+def test_analytics_timings_do_not_need_debug_headers(admin_client, monkeypatch):
+    from services.profiler import profiler
+    monkeypatch.setattr(profiler, 'headers', False)
+
+    response = admin_client.get('/admin/analytics/detailed')
+    assert 'usage;dur=' in response.headers['Server-Timing']
+    assert int(response.headers['X-DB-Query-Count']) >= 5
+    assert 'X-DB-Time-Ms' not in response.headers
+    # Routes that time nothing themselves keep their headers for debug mode
+    assert 'Server-Timing' not in admin_client.get('/admin/plans').headers
@@ -0,0 +1,50 @@
+# Quota alerts: each threshold alerts once per period, whichever write path
+# crosses it and however often the same records are written again
+from datetime import date, timedelta
+from decimal import Decimal
+
+
+def test_thresholds_alert_once_per_period(app):
+    from db import db
+    from models.alerts import Alert
+    from models.plans import Plan
+    from models.subscriptions import Subscription
+    from models.usage import Usage
+    from models.users import User
+    from services import usage_ingest
+
+    today = date.today()
+    with app.app_context():
+        plan = Plan(name='Quota Check Plan', monthly_price=10, monthly_quota_gb=10, is_active=True)
+        user = User(name='Quota Check', email='quota@example.org', role='user', password_hash='x')
+        db.session.add_all([plan, user])
+        db.session.commit()
+        db.session.add(Subscription(user_id=user.id, plan_id=plan.id, status='active',
+                                    start_date=today - timedelta(days=5), price_paid=Decimal('10')))
+        db.session.commit()
+
+        def ingest(days, gb):
+            usage_ingest.ingest_batch([{'user_id': user.id, 'date': (today - timedelta(days=day)).isoformat(),
+                                        'data_used_gb': gb} for day in days])
+
+        def alerted():
+            messages = [alert.message for alert in Alert.query.filter_by(user_id=user.id)]
+            return sorted(int(message.split('%')[0].rsplit(' ', 1)[1]) for message in messages)
+
+        ingest([4, 3], 3)
+        assert alerted() == [50]
+        ingest([4, 3], 3)
+        ingest([2], 3)
+        assert alerted() == [50, 80]
+
+        usage = Usage.query.filter_by(user_id=user.id, date=today - timedelta(days=2)).one()
+
+        # Dropping below a threshold and rising again does not alert twice
+        ingest([2], 0)
+        ingest([2], 3)
+        assert alerted() == [50, 80]
+
+        # An ORM correction of a row loaded before those commits crosses 100%
+        usage.data_used_gb = Decimal('5')
+        db.session.commit()
+        assert alerted() == [50, 80, 100]
@@ -0,0 +1,54 @@
+# Plan recommendations: writes queue the users whose inputs changed, and an
+# incremental refresh rescores only those users
+from datetime import date, timedelta
+
+import pytest
+
+
+def queued():
+    from db import db
+    from models.recommendations import recommendation_queue
+    return set(db.session.execute(recommendation_queue.select()).scalars())
+
+
+@pytest.fixture(scope='module')
+def heavy_user(app):
+    from db import db
+    from models.users import User
+    from services import usage_ingest
+    with app.app_context():
+        user = User(name='Heavy Streamer', email='heavy@example.org', role='user', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        # 5 GB a day for ten days projects to 150 GB a month
+        usage_ingest.ingest_batch([{'user_id': user.id, 'date': (date.today() - timedelta(days=day)).isoformat(),
+                                    'data_used_gb': 5} for day in range(10)])
+        return user.id
+
+
+def test_writes_queue_their_users(app, heavy_user):
+    from db import db
+    from models.plans import Plan
+    from services.recommendations import EVERYONE
+    with app.app_context():
+        assert heavy_user in queued()
+        db.session.add(Plan(name='Queue Check Plan', monthly_price=5, monthly_quota_gb=1))
+        db.session.commit()
+        assert EVERYONE in queued()
+
+
+def test_incremental_refresh_rescores_queued_users(app, heavy_user):
+    pytest.importorskip('numpy')
+    from services import recommendations, usage_ingest
+    from services.recommendations import recommender
+    with app.app_context():
+        recommender.refresh(full=True)
+        assert queued() == set()
+
+        usage_ingest.ingest_batch([{'user_id': heavy_user, 'date': date.today().isoformat(), 'data_used_gb': 6}])
+        report = recommender.refresh()
+        assert (report['full'], report['users']) == (False, 1)
+        assert queued() == set()
+
+        best = recommendations.for_user(heavy_user)['recommendations'][0]
+        assert best['fits'] and best['monthly_quota_gb'] >= 150
@@ -0,0 +1,63 @@
+# Redemptions price a checkout with the row's current terms, even when this
+# worker's cache still holds a copy another worker has since changed
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def discount(app):
+    from db import db
+    from models.discounts import Discount
+    with app.app_context():
+        row = Discount(code='STALE10', discount_type='percentage', discount_value=10, used_count=0,
+                       is_active=True, created_at=datetime.now(), updated_at=datetime.now())
+        db.session.add(row)
+        db.session.commit()
+        yield row.id
+        db.session.delete(db.session.get(Discount, row.id))
+        db.session.commit()
+
+
+def test_stale_cached_terms_are_not_charged(app, discount):
+    from db import db
+    from models.discounts import Discount
+    from services import catalog, redemption
+    with app.app_context():
+        assert catalog.discount_by_code('STALE10')['discount_value'] == 10
+        # An edit made by another worker: this worker's cache is not invalidated
+        db.session.execute(Discount.__table__.update().where(Discount.id == discount).values(discount_value=25))
+        db.session.commit()
+        result = redemption.redeem('STALE10', amount=100)
+        assert result['discount_amount'] == 25
+        assert db.session.get(Discount, discount).used_count == 1
+
+
+def test_deactivated_code_is_refused_despite_the_cache(app, discount):
+    from db import db
+    from models.discounts import Discount
+    from services import catalog, redemption
+    with app.app_context():
+        catalog.discount_by_code('STALE10')
+        db.session.execute(Discount.__table__.update().where(Discount.id == discount).values(is_active=False))
+        db.session.commit()
+        with pytest.raises(redemption.RedemptionRefused) as refused:
+            redemption.redeem('STALE10', amount=100)
+        assert refused.value.reason == 'inactive'
+
+
+def test_zero_terms_still_match_the_row(app):
+    from db import db
+    from models.discounts import Discount
+    from services import redemption
+    with app.app_context():
+        row = Discount(code='ZERO5', discount_type='fixed', discount_value=5, min_amount=0, max_discount=0,
+                       used_count=0, is_active=True, created_at=datetime.now(), updated_at=datetime.now())
+        db.session.add(row)
+        db.session.commit()
+        try:
+            assert redemption.redeem('ZERO5', amount=100)['discount_amount'] == 5
+            assert db.session.get(Discount, row.id).used_count == 1
+        finally:
+            db.session.delete(db.session.get(Discount, row.id))
+            db.session.commit()
@@ -0,0 +1,40 @@
+# Read-replica routing decisions: lag and read-your-writes
+import time
+
+import pytest
+from flask import Response
+
+
+@pytest.fixture
+def router(app, monkeypatch):
+    from services.db_routing import replica_router
+    # A replica that answered the last probe 0.5s behind; no probe thread
+    monkeypatch.setattr(replica_router, 'enabled', True)
+    monkeypatch.setattr(replica_router, 'ensure_probe', lambda: None)
+    monkeypatch.setattr(replica_router, 'healthy', True)
+    monkeypatch.setattr(replica_router, 'lag', 0.5)
+    monkeypatch.setattr(replica_router, '_checked', time.monotonic())
+    return replica_router
+
+
+def test_fresh_replica_serves_reads(app, router):
+    with app.test_request_context('/admin/dashboard'):
+        assert router.route() == ('replica', 'replica')
+
+
+def test_lagging_replica_sends_reads_to_the_primary(app, router, monkeypatch):
+    monkeypatch.setattr(router, 'lag', router.max_lag + 1)
+    with app.test_request_context('/admin/dashboard'):
+        assert router.route() == ('primary', 'lag')
+
+
+def test_writes_return_a_deadline_the_spa_can_echo(app, router):
+    from services.db_routing import STICKY_HEADER
+    with app.test_request_context('/admin/plans', method='POST'):
+        until = router._mark_writer(Response(status=201)).headers[STICKY_HEADER]
+    assert float(until) > time.time()
+
+    with app.test_request_context('/admin/plans', headers={STICKY_HEADER: until}):
+        assert router.route() == ('primary', 'recent_write')
+    with app.test_request_context('/admin/plans', headers={STICKY_HEADER: str(time.time() - 1)}):
+        assert router.route() == ('replica', 'replica')
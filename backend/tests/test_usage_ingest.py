@@ -0,0 +1,32 @@
+# Usage ingestion error reports name rows the way the input file numbers them
+def rejected_rows(app, lines, fmt, batch_size=2):
+    from services import usage_ingest
+    with app.app_context():
+        report = usage_ingest.ingest(lines, fmt=fmt, batch_size=batch_size)
+    return [error['row'] for batch in report['batches'] for error in batch['errors']]
+
+
+def test_csv_rows_are_file_lines(app):
+    lines = ['user_id,date,data_used_gb\n'] + [f'bad{i},2024-01-01,1.5\n' for i in range(3)]
+    assert rejected_rows(app, lines, 'csv') == [2, 3, 4]
+
+
+def test_ndjson_rows_are_one_based(app):
+    lines = [f'{{"user_id": "bad{i}", "date": "2024-01-01", "data_used_gb": 1.5}}\n' for i in range(3)]
+    assert rejected_rows(app, lines, 'ndjson') == [1, 2, 3]
+
+
+def test_blank_ndjson_lines_keep_their_numbers(app):
+    record = '{"user_id": "bad", "date": "2024-01-01", "data_used_gb": 1.5}\n'
+    lines = ['\n', record, '\n', '\n', record, record]
+    assert rejected_rows(app, lines, 'ndjson') == [2, 5, 6]
+
+
+def test_csv_rows_start_where_the_record_starts(app):
+    lines = ['user_id,date,data_used_gb,note\n',
+             'bad0,2024-01-01,1.5,"two\n', 'lines"\n',
+             '\n',
+             'bad1,2024-01-01,1.5,one\n',
+             'bad2,2024-01-01,1.5,"three\n', '\n', 'lines"\n',
+             'bad3,2024-01-01,1.5,one\n']
+    assert rejected_rows(app, lines, 'csv') == [2, 5, 6, 9]
@@ -0,0 +1,41 @@
+# Admin user search: short terms without trigrams still match as substrings,
+# like the ILIKE search they replaced
+import pytest
+
+
+@pytest.fixture(scope='module')
+def people(app):
+    from db import db
+    from models.users import User
+    with app.app_context():
+        users = [User(name=name, email=email, role='user', password_hash='x') for name, email in (
+            ('J. Search', 'j.search@example.org'),
+            ('李明', 'liming@example.org'),
+            ('Alma Search', 'alma@example.org')
+        )]
+        db.session.add_all(users)
+        db.session.commit()
+        return {user.name: user.id for user in users}
+
+
+def matches(app, term):
+    from models.users import User
+    from services import user_search
+    with app.app_context():
+        return {user.id for user in user_search.search_users(User.query, term).all()}
+
+
+def test_short_term_with_punctuation(app, people):
+    assert people['J. Search'] in matches(app, 'j.')
+
+
+def test_short_non_ascii_term(app, people):
+    assert matches(app, '李') == {people['李明']}
+
+
+def test_short_word_matches_inside_words(app, people):
+    # 'al' inside 'Alma', 'mi' inside 'liming', 'e' inside every email
+    assert people['Alma Search'] in matches(app, 'al')
+    assert people['李明'] in matches(app, 'mi')
+    assert set(people.values()) <= matches(app, 'e')
+    assert people['J. Search'] not in matches(app, 'al')
@@ -0,0 +1,19 @@
+# /admin/users/detailed batch-loads subscriptions and usage, so the number of
+# statements per request must not grow with the page size (N+1 regression)
+from benchmarks.common import QueryCounter
+
+PAGE_SIZES = [10, 50, 100, 250]
+
+
+def test_statement_count_does_not_grow_with_page_size(app, admin_client, seeded):
+    from db import db
+    with app.app_context():
+        engine = db.engine
+    counts = {}
+    for per_page in PAGE_SIZES:
+        with QueryCounter(engine) as counter:
+            response = admin_client.get(f'/admin/users/detailed?per_page={per_page}')
+        assert response.status_code == 200, response.get_json()
+        assert len(response.get_json()['users']) == per_page
+        counts[per_page] = counter.count
+    assert len(set(counts.values())) == 1, counts
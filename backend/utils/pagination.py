@@ -0,0 +1,183 @@
+# Keyset (cursor) pagination helpers
+# Listings are ordered newest first on (created_at, id). A cursor encodes the
+# boundary row's key and the direction to read in, so every page is an index
+# range scan with no OFFSET, regardless of how deep the client pages.
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_, func, text
+
+from db import db
+
+MAX_PER_PAGE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id, direction):
+    payload = {
+        'c': created_at.isoformat() if created_at else None,
+        'i': row_id,
+        'd': direction
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        created_at = datetime.fromisoformat(payload['c']) if payload['c'] else None
+        row_id = int(payload['i'])
+        direction = payload['d']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if direction not in ('next', 'prev'):
+        raise InvalidCursor('Invalid cursor')
+    return created_at, row_id, direction
+
+
+def _after(created_col, id_col, created_at, row_id):
+    """Rows that follow the key in (created_at DESC, id DESC) order; NULL dates sort last."""
+    if created_at is None:
+        return and_(created_col.is_(None), id_col < row_id)
+    return or_(
+        created_col < created_at,
+        and_(created_col == created_at, id_col < row_id),
+        created_col.is_(None)
+    )
+
+
+def _before(created_col, id_col, created_at, row_id):
+    """Rows that precede the key in (created_at DESC, id DESC) order."""
+    if created_at is None:
+        return or_(created_col.isnot(None), id_col > row_id)
+    return or_(
+        created_col > created_at,
+        and_(created_col == created_at, id_col > row_id)
+    )
+
+
+def estimate_count(table_name):
+    """Cheap row estimate from catalogue statistics, or None if the backend has none."""
+    if db.engine.dialect.name != 'mysql':
+        return None
+    return db.session.execute(text(
+        'SELECT TABLE_ROWS FROM information_schema.TABLES '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name'
+    ), {'table_name': table_name}).scalar()
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, prev_cursor, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+
+def keyset_paginate(query, model, cursor=None, per_page=10, include_total=None):
+    """Return one KeysetPage of `query`, ordered by (model.created_at, model.id) newest first.
+
+    include_total may be 'exact' (COUNT over the filtered query) or 'estimate'
+    (catalogue statistics, falling back to an exact count).
+    """
+    created_col = model.created_at
+    id_col = model.id
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+
+    direction = 'next'
+    created_at = row_id = None
+    if cursor:
+        created_at, row_id, direction = decode_cursor(cursor)
+
+    total = None
+    if include_total == 'estimate':
+        total = estimate_count(model.__tablename__)
+    if include_total == 'exact' or (include_total == 'estimate' and total is None):
+        total = query.order_by(None).with_entities(func.count(id_col)).scalar()
+
+    page_query = query
+    if direction == 'next':
+        if row_id is not None:
+            page_query = page_query.filter(_after(created_col, id_col, created_at, row_id))
+        page_query = page_query.order_by(created_col.desc(), id_col.desc())
+    else:
+        page_query = page_query.filter(_before(created_col, id_col, created_at, row_id))
+        page_query = page_query.order_by(created_col.asc(), id_col.asc())
+
+    rows = page_query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if direction == 'prev':
+        rows.reverse()
+        # Reading backwards: "more" means there are still newer rows
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = row_id is not None, more
+
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id, 'next')
+    if rows and has_prev:
+        prev_cursor = encode_cursor(rows[0].created_at, rows[0].id, 'prev')
+
+    return KeysetPage(rows, next_cursor, prev_cursor, total)
+
+
+def offset_paginate(query, model, page=1, per_page=10):
+    """Numbered pages, in the same order as keyset_paginate, for clients that still send ?page=.
+
+    OFFSET reads and discards every earlier row, so deep pages get slower; cursors do not.
+    """
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    return query.order_by(model.created_at.desc(), model.id.desc()).paginate(
+        page=max(1, page), per_page=per_page, error_out=False
+    )
+
+
+def page_args(args):
+    """Read cursor / per_page / include_total from request args."""
+    return {
+        'cursor': args.get('cursor') or None,
+        'per_page': args.get('per_page', 10, type=int),
+        'include_total': args.get('include_total') or None
+    }
+
+
+def wants_offset(args):
+    """?page= without a cursor: the numbered pages these listings returned before cursors."""
+    return 'page' in args and not args.get('cursor')
+
+
+def offset_args(args):
+    return {
+        'page': args.get('page', 1, type=int),
+        'per_page': args.get('per_page', 10, type=int)
+    }
+
+
+def offset_meta(pagination):
+    return {
+        'total': pagination.total,
+        'pages': pagination.pages,
+        'current_page': pagination.page
+    }
+
+
+def page_meta(page):
+    return {
+        'total': page.total,
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'has_more': page.has_more
+    }
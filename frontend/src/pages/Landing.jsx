@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { adminAPI, userAPI } from '../utils/api';
 
 const Landing = () => {
   const [user, setUser] = useState(null);
@@ -19,7 +20,10 @@ const Landing = () => {
     setUserType(storedUserType);
   }, [navigate]);
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    // Revoke the token on the server before dropping it; the local session is cleared either way
+    await (userType === 'admin' ? adminAPI : userAPI).logout().catch(() => {});
+    localStorage.removeItem('token');
     localStorage.removeItem('user');
     localStorage.removeItem('userType');
     navigate('/login');
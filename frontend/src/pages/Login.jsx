@@ -37,6 +37,7 @@ const Login = () => {
         // Store user data in localStorage
         localStorage.setItem('user', JSON.stringify(response.data.user));
         localStorage.setItem('userType', userType);
+        localStorage.setItem('token', response.data.token);
         
         // Navigate to landing page first, then to appropriate dashboard
         navigate('/landing');
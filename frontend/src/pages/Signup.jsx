@@ -34,6 +34,7 @@ const Signup = () => {
         // Store user data in localStorage
         localStorage.setItem('user', JSON.stringify(response.data.user));
         localStorage.setItem('userType', 'user');
+        localStorage.setItem('token', response.data.token);
         
         // Navigate to landing page after a short delay
         setTimeout(() => {
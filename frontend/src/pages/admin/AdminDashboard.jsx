@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { adminAPI } from '../../utils/api';
 
 const AdminDashboard = () => {
   const [user, setUser] = useState(null);
@@ -17,7 +18,10 @@ const AdminDashboard = () => {
     setUser(JSON.parse(storedUser));
   }, [navigate]);
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    // Revoke the token on the server before dropping it; the local session is cleared either way
+    await adminAPI.logout().catch(() => {});
+    localStorage.removeItem('token');
     localStorage.removeItem('user');
     localStorage.removeItem('userType');
     navigate('/login');
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
+import { userAPI } from '../../utils/api';
 
 const UserDashboard = () => {
   const [user, setUser] = useState(null);
@@ -17,7 +18,10 @@ const UserDashboard = () => {
     setUser(JSON.parse(storedUser));
   }, [navigate]);
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    // Revoke the token on the server before dropping it; the local session is cleared either way
+    await userAPI.logout().catch(() => {});
+    localStorage.removeItem('token');
     localStorage.removeItem('user');
     localStorage.removeItem('userType');
     navigate('/login');
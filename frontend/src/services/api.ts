@@ -1,15 +1,28 @@
 const API_BASE_URL = 'http://localhost:5001';
 
+// Read-your-writes: after a write the API names a time until which this
+// client's reads must go to the primary database; send it back until then
+const PRIMARY_UNTIL_HEADER = 'X-DB-Primary-Until';
+const PRIMARY_UNTIL_KEY = 'dbPrimaryUntil';
+
+const primaryUntilHeader = (): Record<string, string> => {
+  const until = sessionStorage.getItem(PRIMARY_UNTIL_KEY);
+  return until && parseFloat(until) > Date.now() / 1000 ? { [PRIMARY_UNTIL_HEADER]: until } : {};
+};
+
 class ApiService {
   private async request<T>(
     endpoint: string,
     options: RequestInit = {}
   ): Promise<T> {
     const url = `${API_BASE_URL}${endpoint}`;
+    const token = localStorage.getItem('token');
     
     const config: RequestInit = {
       headers: {
         'Content-Type': 'application/json',
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+        ...primaryUntilHeader(),
         ...options.headers,
       },
       ...options,
@@ -17,6 +30,10 @@ class ApiService {
 
     try {
       const response = await fetch(url, config);
+      const primaryUntil = response.headers.get(PRIMARY_UNTIL_HEADER);
+      if (primaryUntil) {
+        sessionStorage.setItem(PRIMARY_UNTIL_KEY, primaryUntil);
+      }
       
       if (!response.ok) {
         let errorMessage = `HTTP error! status: ${response.status}`;
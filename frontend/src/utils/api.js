@@ -9,11 +9,47 @@ const api = axios.create({
   },
 });
 
+// Read-your-writes: after a write the API names a time until which this
+// client's reads must go to the primary database; send it back until then
+const PRIMARY_UNTIL_HEADER = 'X-DB-Primary-Until';
+const PRIMARY_UNTIL_KEY = 'dbPrimaryUntil';
+
+// Send the bearer token issued at login/signup with every request
+api.interceptors.request.use((config) => {
+  const token = localStorage.getItem('token');
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  const primaryUntil = sessionStorage.getItem(PRIMARY_UNTIL_KEY);
+  if (primaryUntil && parseFloat(primaryUntil) > Date.now() / 1000) {
+    config.headers[PRIMARY_UNTIL_HEADER] = primaryUntil;
+  }
+  return config;
+});
+
+api.interceptors.response.use((response) => {
+  const primaryUntil = response.headers[PRIMARY_UNTIL_HEADER.toLowerCase()];
+  if (primaryUntil) {
+    sessionStorage.setItem(PRIMARY_UNTIL_KEY, primaryUntil);
+  }
+  return response;
+});
+
+// The token as of the call: callers clear localStorage right after logging
+// out, before the interceptor above would run
+const currentToken = () => {
+  const token = localStorage.getItem('token');
+  return token ? { headers: { Authorization: `Bearer ${token}` } } : {};
+};
+
 // Admin API calls
 export const adminAPI = {
   login: (email, password) => 
     api.post('/admin/login', { email, password }),
   
+  logout: () => 
+    api.post('/admin/logout', null, currentToken()),
+  
   getDashboard: () => 
     api.get('/admin/dashboard'),
   
@@ -38,6 +74,9 @@ export const userAPI = {
   login: (email, password) => 
     api.post('/user/login', { email, password }),
   
+  logout: () => 
+    api.post('/user/logout', null, currentToken()),
+  
   getDashboard: () => 
     api.get('/user/dashboard'),
   